@@ -0,0 +1,210 @@
+"""
+RSS 检查与推送流程的离线基准测试。
+
+在本地启动假 RSS 服务器和假 Telegram Bot API，按给定的用户数、每用户关键词数和每轮新帖子数
+反复执行 check_rss_and_send_to_users，并报告每轮耗时、关键词匹配吞吐量、发送速率和内存峰值。
+不会访问外网，也不会使用真实的机器人 Token。
+
+用法示例:
+    python benchmarks/bench_cycle.py --users 5000 --keywords-per-user 5 --posts 30 --cycles 5
+    python benchmarks/bench_cycle.py --error-429 0.01 --error-403 0.005 --error-400 0.02 --json result.json
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_servers import VOCABULARY, FakeRssServer, FakeTelegramApi  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000, help='订阅用户数')
+    parser.add_argument('--keywords-per-user', type=int, default=5, help='每个用户的关键词数')
+    parser.add_argument('--filter-off-ratio', type=float, default=0.05, help='关闭关键词过滤 (接收全部帖子) 的用户比例')
+    parser.add_argument('--match-fields', default='title',
+                        help='用户匹配的字段，逗号分隔 (title,summary,category)')
+    parser.add_argument('--feeds', type=int, default=1, help='feed 数量')
+    parser.add_argument('--posts', type=int, default=20, help='每轮每个 feed 的新帖子数')
+    parser.add_argument('--cycles', type=int, default=5, help='检查轮数')
+    parser.add_argument('--workers', type=int, default=8, help='投递线程数 (DELIVERY_WORKERS)')
+    parser.add_argument('--global-rate', type=float, default=100000, help='全局发送速率上限 (GLOBAL_SEND_RATE)')
+    parser.add_argument('--per-chat-rate', type=float, default=1000, help='单聊天发送速率上限 (PER_CHAT_SEND_RATE)')
+    parser.add_argument('--storage', choices=('json', 'sqlite'), default='json', help='存储后端 (STORAGE_BACKEND)')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='假 Bot API 每个请求的延迟 (秒)')
+    parser.add_argument('--error-429', type=float, default=0.0, help='注入 429 Too Many Requests 的比例')
+    parser.add_argument('--error-403', type=float, default=0.0, help='注入 403 Forbidden 的比例')
+    parser.add_argument('--error-400', type=float, default=0.0, help='注入 400 实体解析失败的比例')
+    parser.add_argument('--retry-after', type=int, default=1, help='429 响应中的 retry_after 秒数')
+    parser.add_argument('--match-titles', type=int, default=2000, help='单独测量匹配吞吐量时使用的标题数')
+    parser.add_argument('--no-memory', action='store_true', help='不使用 tracemalloc 统计内存 (其开销会拉长耗时)')
+    parser.add_argument('--log-level', default='WARNING', help='机器人日志级别')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', dest='json_path', help='将结果另存为 JSON，便于与基线比较')
+    return parser.parse_args()
+
+
+def configure_environment(args, data_dir: str, rss: FakeRssServer):
+    """机器人在导入时读取配置，因此必须在 import bot 之前设置环境变量。"""
+    feeds = [{'name': f'feed{i}', 'url': rss.url_for(f'feed{i}'), 'interval': 0} for i in range(args.feeds)]
+    os.environ.update({
+        'TELEGRAM_BOT_TOKEN': '123456:benchmark',
+        'DATA_DIR': data_dir,
+        'RSS_FEEDS': json.dumps(feeds),
+        'ADAPTIVE_POLLING': 'false',
+        'STORAGE_BACKEND': args.storage,
+        'DELIVERY_WORKERS': str(args.workers),
+        'GLOBAL_SEND_RATE': str(args.global_rate),
+        'PER_CHAT_SEND_RATE': str(args.per_chat_rate),
+    })
+    os.environ.pop('ADMIN_CHAT_ID', None)
+    os.environ.pop('METRICS_PORT', None)
+
+
+def populate_users(bot_module, args, rng: random.Random):
+    match_fields = [field.strip() for field in args.match_fields.split(',') if field.strip()]
+    with bot_module.subscription_store.edit() as subscriptions:
+        for i in range(args.users):
+            subscriptions[str(i + 1)] = {
+                'chat_id': i + 1,
+                'keywords': rng.sample(VOCABULARY, min(args.keywords_per_user, len(VOCABULARY))),
+                'enabled': True,
+                'keyword_filter_active': rng.random() >= args.filter_off_ratio,
+                'match_fields': match_fields,
+            }
+        bot_module.subscription_store.mark_changed()
+
+
+def measure_match_throughput(bot_module, rss: FakeRssServer, count: int) -> dict:
+    from keyword_matcher import KeywordMatcher
+
+    _, subscriptions = bot_module.subscription_store.snapshot()
+    started = time.perf_counter()
+    matcher = KeywordMatcher(subscriptions)
+    build_seconds = time.perf_counter() - started
+
+    titles = [rss.random_title() for _ in range(count)]
+    matched = 0
+    started = time.perf_counter()
+    for title in titles:
+        matched += len(matcher.match(title))
+    seconds = time.perf_counter() - started
+    return {
+        'matcher_build_seconds': build_seconds,
+        'titles_per_second': count / seconds if seconds else float('inf'),
+        'avg_recipients_per_title': matched / count if count else 0,
+    }
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    data_dir = tempfile.mkdtemp(prefix='rss-bench-')
+    rss = FakeRssServer([f'feed{i}' for i in range(args.feeds)], posts_per_batch=args.posts,
+                        feed_size=max(50, args.posts), seed=args.seed)
+    api = FakeTelegramApi({'429': args.error_429, '403': args.error_403, '400': args.error_400},
+                          latency=args.api_latency, retry_after=args.retry_after, seed=args.seed)
+    configure_environment(args, data_dir, rss)
+
+    if not args.no_memory:
+        tracemalloc.start()
+
+    import telegram
+    from telegram.utils.request import Request
+
+    import bot as bot_module
+    from delivery import DeliveryQueue
+
+    logging.getLogger().setLevel(args.log_level.upper())
+
+    tg_bot = telegram.Bot(bot_module.TELEGRAM_BOT_TOKEN, base_url=api.base_url,
+                          request=Request(con_pool_size=args.workers + 4))
+    bot_module.delivery_queue = DeliveryQueue(tg_bot, workers=args.workers, global_rate=args.global_rate,
+                                              per_chat_rate=args.per_chat_rate,
+                                              on_chat_migrated=bot_module.on_chat_migrated,
+                                              on_forbidden=bot_module.on_forbidden,
+                                              on_delivered=bot_module.on_delivered,
+                                              outbox=bot_module.outbox)
+    context = types.SimpleNamespace(bot=tg_bot)
+
+    # 先在没有用户时检查一轮，让去重记录包含 feed 中已有的帖子，之后每轮都只有 --posts 个新帖子
+    rss.next_batch()
+    bot_module.check_rss_and_send_to_users(context)
+    populate_users(bot_module, args, rng)
+
+    cycles = []
+    for cycle in range(1, args.cycles + 1):
+        rss.next_batch()
+        sent_before = api.sent_messages()
+        started = time.perf_counter()
+        bot_module.check_rss_and_send_to_users(context)
+        cycle_seconds = time.perf_counter() - started
+        queued = bot_module.delivery_queue.pending()
+        bot_module.delivery_queue.join()
+        total_seconds = time.perf_counter() - started
+        sent = api.sent_messages() - sent_before
+        cycles.append({
+            'cycle': cycle,
+            'cycle_seconds': cycle_seconds,
+            'queued_after_cycle': queued,
+            'drain_seconds': total_seconds - cycle_seconds,
+            'sent': sent,
+            'sends_per_second': sent / total_seconds if total_seconds else 0,
+        })
+        print(f"第 {cycle} 轮: 检查耗时 {cycle_seconds * 1000:.1f} ms, 发送 {sent} 条, "
+              f"清空队列共 {total_seconds:.2f} s ({cycles[-1]['sends_per_second']:.0f} 条/秒)")
+
+    match = measure_match_throughput(bot_module, rss, args.match_titles)
+    peak_memory = tracemalloc.get_traced_memory()[1] if not args.no_memory else None
+
+    bot_module.delivery_queue.stop()
+    bot_module.outbox.close()
+    bot_module.feed_fetch_executor.shutdown(wait=False)
+    bot_module.subscription_store.close()
+    if bot_module.delivery_log:
+        bot_module.delivery_log.flush()
+    if bot_module.database:
+        bot_module.database.close()
+    rss.close()
+    api.close()
+
+    result = {
+        'params': {key: value for key, value in vars(args).items() if key != 'json_path'},
+        'cycles': cycles,
+        'cycle_seconds_median': statistics.median(c['cycle_seconds'] for c in cycles) if cycles else None,
+        'sends_per_second_median': statistics.median(c['sends_per_second'] for c in cycles) if cycles else None,
+        'match': match,
+        'api_errors_injected': api.errors,
+        'peak_memory_bytes': peak_memory,
+    }
+
+    print()
+    print(f"用户 {args.users} / 每用户关键词 {args.keywords_per_user} / feed {args.feeds} / 每轮新帖 {args.posts}"
+          f" / 存储 {args.storage}")
+    if cycles:
+        print(f"检查耗时中位数:   {result['cycle_seconds_median'] * 1000:.1f} ms")
+        print(f"发送速率中位数:   {result['sends_per_second_median']:.0f} 条/秒")
+    print(f"匹配器构建:       {match['matcher_build_seconds'] * 1000:.1f} ms")
+    print(f"匹配吞吐量:       {match['titles_per_second']:.0f} 标题/秒 "
+          f"(平均每个标题 {match['avg_recipients_per_title']:.1f} 个收件人)")
+    print(f"注入的 API 错误:  {api.errors}")
+    if peak_memory is not None:
+        print(f"内存峰值:         {peak_memory / 1024 / 1024:.1f} MiB (tracemalloc)")
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"结果已保存到 {args.json_path}")
+
+
+if __name__ == '__main__':
+    main()
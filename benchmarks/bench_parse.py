@@ -0,0 +1,76 @@
+"""
+feed 解析基准测试：增量解析与 feedparser 完整解析的比较。
+
+生成一个包含 --feed-size 个帖子的合成 feed，其中最新的 --new 个帖子尚未处理，
+分别用两种方式找出新帖子，报告每次解析的耗时以及实际解析的帖子数。不会访问外网。
+
+用法示例:
+    python benchmarks/bench_parse.py --feed-size 100 --new 2
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import feedparser  # noqa: E402
+
+from fake_servers import FakeRssServer  # noqa: E402
+from feed_fetcher import FeedFetchResult  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--feed-size', type=int, default=100, help='feed 中的帖子数')
+    parser.add_argument('--new', type=int, default=2, help='其中尚未处理的帖子数')
+    parser.add_argument('--stop-after-seen', type=int, default=3, help='增量解析连续遇到多少个已处理帖子后停止')
+    parser.add_argument('--repeat', type=int, default=200, help='每种方式重复解析的次数')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    rss = FakeRssServer(['feed'], posts_per_batch=args.feed_size, feed_size=args.feed_size)
+    rss.next_batch()
+    body = rss.body('feed')
+    rss.close()
+    links = [f'https://www.nodeseek.com/post-{100000 + i}-1' for i in range(1, args.feed_size + 1)]
+    # 帖子按从新到旧排列，编号最大的 --new 个为新帖子
+    seen = set(links[:args.feed_size - args.new])
+
+    def run(streaming: bool):
+        timings = []
+        checked = 0
+        found = None
+
+        def is_seen(link):
+            # 每个解析出的帖子都会检查一次
+            nonlocal checked
+            checked += 1
+            return link in seen
+
+        for _ in range(args.repeat):
+            checked = 0
+            result = FeedFetchResult('bench', not_modified=False, body=body, response_headers={})
+            started = time.perf_counter()
+            if not streaming:
+                result.feed = feedparser.parse(body)
+            found = result.new_entries(is_seen, stop_after_seen=args.stop_after_seen)
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings), checked, [entry.link for entry in found]
+
+    feedparser_seconds, feedparser_checked, feedparser_found = run(streaming=False)
+    streaming_seconds, streaming_checked, streaming_found = run(streaming=True)
+
+    print(f"feed 大小 {args.feed_size} / 新帖子 {args.new} / 体积 {len(body) / 1024:.0f} KiB")
+    print(f"feedparser 完整解析: {feedparser_seconds * 1000:.2f} ms，解析 {feedparser_checked} 个帖子，"
+          f"找到 {len(feedparser_found)} 个新帖子")
+    print(f"增量解析:            {streaming_seconds * 1000:.2f} ms，解析 {streaming_checked} 个帖子，"
+          f"找到 {len(streaming_found)} 个新帖子")
+    sys.exit(0 if feedparser_found == streaming_found else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""
+冷启动基准测试。
+
+生成一份较大的已处理帖子记录 (模拟长期运行后的 sent_posts_global.txt) 和一批订阅用户，
+然后在子进程中启动 bot.py (长轮询模式，指向本地假 Telegram Bot API)，测量:
+  * import bot 的耗时，以及 bot 直接导入的模块中最慢的几个 (python -X importtime)；
+  * 从启动进程到开始轮询更新 (第一次 getUpdates) 的时间；
+  * 从启动进程到回复第一条 /start 命令的时间；
+  * 已处理帖子记录加载完成的时间。
+不会访问外网，也不会使用真实的机器人 Token。
+
+用法示例:
+    python benchmarks/bench_startup.py --sent-posts 200000 --runs 3
+    python benchmarks/bench_startup.py --storage sqlite --json startup.json
+"""
+import argparse
+import json
+import os
+import re
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_servers import FakeTelegramApi  # noqa: E402
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_SCRIPT = os.path.join(REPO_DIR, 'bot.py')
+USER_ID = 424242
+DEDUP_LOADED_RE = re.compile(r'已加载 \d+ 条已处理帖子记录')
+IMPORTTIME_RE = re.compile(r'import time:\s+\d+ \|\s+(\d+) \|( +)(\S+)')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sent-posts', type=int, default=200000, help='已处理帖子记录的条数')
+    parser.add_argument('--users', type=int, default=1000, help='订阅用户数')
+    parser.add_argument('--storage', choices=('json', 'sqlite'), default='json', help='存储后端 (STORAGE_BACKEND)')
+    parser.add_argument('--runs', type=int, default=3, help='启动次数 (取中位数)')
+    parser.add_argument('--timeout', type=float, default=60.0, help='每次启动等待回复的最长时间 (秒)')
+    parser.add_argument('--json', dest='json_path', help='将结果另存为 JSON')
+    return parser.parse_args()
+
+
+def prepare_data_dir(args) -> str:
+    data_dir = tempfile.mkdtemp(prefix='rss-bench-startup-')
+    now = time.time()
+    with open(os.path.join(data_dir, 'sent_posts_global.txt'), 'w', encoding='utf-8') as f:
+        f.writelines(f"{1000000 + i}\t{now - (args.sent_posts - i):.0f}\n" for i in range(args.sent_posts))
+    subscriptions = {
+        str(i + 1): {'chat_id': i + 1, 'keywords': ['vps', f'w{i % 500}'], 'enabled': True,
+                     'keyword_filter_active': True}
+        for i in range(args.users)
+    }
+    with open(os.path.join(data_dir, 'user_subscriptions.json'), 'w', encoding='utf-8') as f:
+        json.dump(subscriptions, f)
+    return data_dir
+
+
+def bot_environment(args, data_dir: str, api: FakeTelegramApi) -> dict:
+    env = dict(os.environ)
+    for name in ('ADMIN_CHAT_ID', 'METRICS_PORT', 'WEBHOOK_URL', 'RSS_FEEDS', 'WORKER_PROCESSES'):
+        env.pop(name, None)
+    env.update({
+        'TELEGRAM_BOT_TOKEN': '123456:benchmark',
+        'TELEGRAM_API_BASE_URL': api.base_url,
+        'DATA_DIR': data_dir,
+        'STORAGE_BACKEND': args.storage,
+        # 保留全部记录，模拟记录窗口很大的部署；RSS 地址指向本机不存在的服务，测量期间不会抓取
+        'SENT_POSTS_MAX_ENTRIES': str(args.sent_posts),
+        'RSS_URL': 'http://127.0.0.1:9/rss',
+        'PYTHONUNBUFFERED': '1',
+    })
+    return env
+
+
+def measure_import(env: dict) -> dict:
+    """在新进程中 import bot，返回总耗时与 bot 直接导入的最慢模块 (累计耗时)。"""
+    started = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import bot'], cwd=REPO_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    seconds = time.perf_counter() - started
+    direct = {}
+    for line in completed.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        # bot 直接导入的模块在 importtime 输出中缩进两个空格
+        if match and len(match.group(2)) == 3:
+            direct[match.group(3)] = int(match.group(1)) / 1000
+    slowest = sorted(direct.items(), key=lambda item: item[1], reverse=True)[:8]
+    return {'seconds': seconds, 'slowest_ms': dict(slowest)}
+
+
+def start_update(update_id: int) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': int(time.time()), 'text': '/start',
+            'chat': {'id': USER_ID, 'type': 'private'},
+            'from': {'id': USER_ID, 'is_bot': False, 'first_name': 'bench'},
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+        },
+    }
+
+
+def measure_startup(env: dict, api: FakeTelegramApi, run: int, timeout: float) -> dict:
+    """启动 bot.py，返回各阶段相对于进程启动的时间 (秒)。"""
+    # SQLite 后端按需查询已处理帖子，启动时没有需要加载的记录
+    wait_for_dedup = env['STORAGE_BACKEND'] == 'json'
+    calls_before = len(api.calls)
+    log_times = {}
+    started = time.monotonic()
+    process = subprocess.Popen([sys.executable, BOT_SCRIPT], cwd=REPO_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+    def read_log():
+        for line in process.stderr:
+            if DEDUP_LOADED_RE.search(line):
+                log_times.setdefault('dedup_loaded', time.monotonic())
+
+    reader = threading.Thread(target=read_log, daemon=True)
+    reader.start()
+
+    def first_call(method: str, after: int, chat_id=None):
+        for called_at, call_method, call_chat_id, _ in api.calls[after:]:
+            if call_method == method and (chat_id is None or str(call_chat_id) == str(chat_id)):
+                return called_at
+        return None
+
+    result = {'polling': None, 'first_reply': None, 'dedup_loaded': None}
+    deadline = started + timeout
+    pushed = False
+    try:
+        while time.monotonic() < deadline and process.poll() is None:
+            if result['polling'] is None:
+                polling_at = first_call('getUpdates', calls_before)
+                if polling_at is not None:
+                    result['polling'] = polling_at - started
+            # 进程启动后立即放入 /start，测量机器人最早能在什么时候回复
+            if not pushed:
+                api.push_update(start_update(run + 1))
+                pushed = True
+            reply_at = first_call('sendMessage', calls_before, USER_ID)
+            if reply_at is not None:
+                result['first_reply'] = reply_at - started
+            if result['first_reply'] is not None and ('dedup_loaded' in log_times or not wait_for_dedup):
+                break
+            time.sleep(0.005)
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        reader.join(5)
+    if 'dedup_loaded' in log_times:
+        result['dedup_loaded'] = log_times['dedup_loaded'] - started
+    return result
+
+
+def main():
+    args = parse_args()
+    data_dir = prepare_data_dir(args)
+    api = FakeTelegramApi()
+    env = bot_environment(args, data_dir, api)
+
+    # SQLite 后端首次启动时会导入已有文件，先启动一次完成导入，之后的测量不包含这一步
+    if args.storage == 'sqlite':
+        measure_import(env)
+
+    imports = [measure_import(env) for _ in range(args.runs)]
+    runs = [measure_startup(env, api, run, args.timeout) for run in range(args.runs)]
+    api.close()
+
+    def median(values):
+        values = [value for value in values if value is not None]
+        return statistics.median(values) if values else None
+
+    result = {
+        'params': {key: value for key, value in vars(args).items() if key != 'json_path'},
+        'import_seconds': median(item['seconds'] for item in imports),
+        'slowest_imports_ms': imports[-1]['slowest_ms'],
+        'runs': runs,
+        'polling_seconds': median(run['polling'] for run in runs),
+        'first_reply_seconds': median(run['first_reply'] for run in runs),
+        'dedup_loaded_seconds': median(run['dedup_loaded'] for run in runs),
+    }
+
+    def fmt(seconds):
+        return f"{seconds * 1000:.0f} ms" if seconds is not None else "未完成"
+
+    print(f"已处理帖子记录 {args.sent_posts} 条 / 用户 {args.users} / 存储 {args.storage} / 启动 {args.runs} 次")
+    print(f"import bot:             {fmt(result['import_seconds'])}")
+    for module, ms in result['slowest_imports_ms'].items():
+        print(f"    {module:<28} {ms:.1f} ms")
+    print(f"开始轮询更新:           {fmt(result['polling_seconds'])}")
+    print(f"回复第一条命令:         {fmt(result['first_reply_seconds'])}")
+    if args.storage == 'json':
+        print(f"已处理帖子记录加载完成: {fmt(result['dedup_loaded_seconds'])}")
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"结果已保存到 {args.json_path}")
+
+    sys.exit(0 if all(run['first_reply'] is not None for run in runs) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""
+Webhook 模式的离线冒烟测试与命令响应延迟基准。
+
+在本地启动假 Telegram Bot API，以 webhook 模式启动机器人的命令处理部分，
+然后像 Telegram 一样把伪造的 Update JSON POST 到 webhook 路径，测量从发出更新到
+机器人调用 sendMessage 回复之间的延迟，并检查健康检查路由。不会访问外网。
+
+用法示例:
+    python benchmarks/bench_webhook.py --updates 500 --concurrency 8
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_servers import FakeTelegramApi  # noqa: E402
+
+COMMANDS = ('/start', '/addkeyword vps', '/listkeywords', '/myrssstatus')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=200, help='发送的更新 (命令) 数')
+    parser.add_argument('--users', type=int, default=50, help='发送命令的用户数')
+    parser.add_argument('--concurrency', type=int, default=4, help='同时发送更新的连接数')
+    parser.add_argument('--workers', type=int, default=4, help='Dispatcher 处理线程数')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='假 Bot API 每个请求的延迟 (秒)')
+    parser.add_argument('--timeout', type=float, default=30.0, help='等待全部回复的最长时间 (秒)')
+    parser.add_argument('--log-level', default='WARNING', help='机器人日志级别')
+    parser.add_argument('--json', dest='json_path', help='将结果另存为 JSON')
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def fake_update(update_id: int, user_id: int, text: str) -> dict:
+    command_length = len(text.split(' ', 1)[0])
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': int(time.time()), 'text': text,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': command_length}],
+        },
+    }
+
+
+class WebhookClient:
+    """每个线程一个 keep-alive 连接，像 Telegram 一样 POST 更新。"""
+
+    def __init__(self, port: int):
+        self.port = port
+        self._local = threading.local()
+
+    def request(self, method: str, path: str, payload: dict = None) -> int:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        headers = {'Content-Type': 'application/json'} if body else {}
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+
+
+def main():
+    args = parse_args()
+    api = FakeTelegramApi(latency=args.api_latency)
+    port = free_port()
+    os.environ.update({
+        'TELEGRAM_BOT_TOKEN': '123456:benchmark',
+        'DATA_DIR': tempfile.mkdtemp(prefix='rss-bench-webhook-'),
+        'WEBHOOK_URL': 'https://bot.example.invalid',
+        'WEBHOOK_LISTEN': '127.0.0.1',
+        'WEBHOOK_PORT': str(port),
+    })
+    for name in ('ADMIN_CHAT_ID', 'METRICS_PORT', 'WEBHOOK_PATH', 'WEBHOOK_HEALTH_PATH', 'RSS_FEEDS'):
+        os.environ.pop(name, None)
+
+    from telegram.ext import Updater
+
+    import bot as bot_module
+    from webhook import start_webhook
+
+    logging.getLogger().setLevel(args.log_level.upper())
+
+    updater = Updater(bot_module.TELEGRAM_BOT_TOKEN, base_url=api.base_url, use_context=True, workers=args.workers,
+                      request_kwargs={'con_pool_size': args.workers + 4})
+    bot_module.register_handlers(updater.dispatcher)
+    url_path = bot_module.default_url_path(bot_module.TELEGRAM_BOT_TOKEN)
+    start_webhook(updater, '127.0.0.1', port, url_path,
+                  bot_module.join_webhook_url(bot_module.WEBHOOK_URL, url_path),
+                  health_check=bot_module.health_status, health_path=bot_module.WEBHOOK_HEALTH_PATH)
+
+    client = WebhookClient(port)
+    # 健康检查路由在 webhook 服务的事件循环中注册，稍等片刻
+    health_status = None
+    for _ in range(50):
+        health_status = client.request('GET', bot_module.WEBHOOK_HEALTH_PATH)
+        if health_status != 404:
+            break
+        time.sleep(0.05)
+    wrong_path_status = client.request('POST', '/not-the-webhook', {'update_id': 0})
+    set_webhook_calls = sum(1 for call in api.calls if call[1] == 'setWebhook')
+
+    # 每个用户先 /start，之后循环发送其他命令；每条更新使用不同的 chat 以便把回复对应到更新
+    updates = []
+    for i in range(args.updates):
+        user_id = 1000 + i
+        text = COMMANDS[0] if i < args.users else COMMANDS[1 + i % (len(COMMANDS) - 1)]
+        updates.append(fake_update(i + 1, user_id, text))
+
+    sent_at = {}
+
+    def post(update):
+        sent_at[str(update['message']['chat']['id'])] = time.monotonic()
+        return client.request('POST', '/' + url_path, update)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        post_statuses = list(executor.map(post, updates))
+    post_seconds = time.monotonic() - started
+
+    deadline = time.monotonic() + args.timeout
+    replied_at = {}
+    while time.monotonic() < deadline:
+        replied_at = {}
+        for called_at, method, chat_id, _ in list(api.calls):
+            # python-telegram-bot 以字符串形式发送 chat_id
+            chat_id = str(chat_id)
+            if method == 'sendMessage' and chat_id in sent_at and chat_id not in replied_at:
+                replied_at[chat_id] = called_at
+        if len(replied_at) >= len(updates):
+            break
+        time.sleep(0.05)
+
+    latencies = sorted(replied_at[chat_id] - sent_at[chat_id] for chat_id in replied_at)
+    updater.stop()
+    bot_module.subscription_store.close()
+    api.close()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else None
+
+    result = {
+        'params': {key: value for key, value in vars(args).items() if key != 'json_path'},
+        'set_webhook_calls': set_webhook_calls,
+        'health_status': health_status,
+        'wrong_path_status': wrong_path_status,
+        'post_errors': sum(1 for status in post_statuses if status != 200),
+        'updates_per_second': len(updates) / post_seconds if post_seconds else None,
+        'replied': len(replied_at),
+        'latency_ms': {'p50': percentile(0.5), 'p95': percentile(0.95),
+                       'max': latencies[-1] * 1000 if latencies else None,
+                       'mean': statistics.mean(latencies) * 1000 if latencies else None},
+    }
+
+    print(f"setWebhook 调用:  {set_webhook_calls}")
+    print(f"健康检查:         HTTP {health_status}")
+    print(f"错误路径:         HTTP {wrong_path_status}")
+    print(f"POST 更新:        {len(updates)} 条，失败 {result['post_errors']} 条，"
+          f"{result['updates_per_second']:.0f} 条/秒")
+    print(f"收到回复:         {len(replied_at)} / {len(updates)}")
+    if latencies:
+        latency = result['latency_ms']
+        print(f"命令响应延迟:     p50 {latency['p50']:.1f} ms / p95 {latency['p95']:.1f} ms / "
+              f"最大 {latency['max']:.1f} ms")
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"结果已保存到 {args.json_path}")
+
+    ok = (set_webhook_calls and health_status == 200 and wrong_path_status == 404
+          and not result['post_errors'] and len(replied_at) == len(updates))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
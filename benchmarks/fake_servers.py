@@ -0,0 +1,216 @@
+"""
+基准测试使用的本地假服务器。
+
+FakeRssServer 提供合成的 NodeSeek 风格 RSS feed，每次调用 next_batch() 生成一批新帖子；
+FakeTelegramApi 模拟 Telegram Bot API，记录所有请求，并可按比例注入 429 / 403 / 400 错误；
+push_update() 放入的更新会通过 getUpdates (长轮询) 返回给机器人。
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+WORDS = ['vps', 'cn2', 'gia', 'dmit', 'bandwagon', '甲骨文', '搬瓦工', '黑五', '补货', '特价', 'aws', 'azure',
+         'vultr', 'linode', 'hetzner', '香港', '日本', '美国', '新加坡', 'nat', 'ipv6', '独服', '大盘鸡', '收',
+         '出', '求推荐', '测评', '优惠码', '年付', '月付', 'debian', 'docker', '面板', '闲聊', '机场', '域名']
+# 标题与关键词从同一词表中抽取。除常见词外补充一批合成词，使每个关键词的命中率接近真实情况 (约 1%)
+VOCABULARY = WORDS + [f'w{i}' for i in range(500)]
+CATEGORIES = ['info', 'review', 'trade', 'daily', 'tech', 'promotion']
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 响应头与正文一次写出，避免 Nagle 算法与延迟 ACK 叠加造成每个请求约 40 ms 的额外延迟
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, content_type: str, body: bytes):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _serve(handler_class) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class FakeRssServer:
+    """按路径 /<feed 名称> 提供合成 RSS feed。"""
+
+    def __init__(self, feed_names: list, posts_per_batch: int = 20, feed_size: int = 50, seed: int = 0):
+        self.posts_per_batch = posts_per_batch
+        self.feed_size = feed_size
+        self._random = random.Random(seed)
+        self._next_post_id = 100000
+        self._items = {name: [] for name in feed_names}
+        self._bodies = {name: self._render(name) for name in feed_names}
+        self.requests = 0
+
+        server_self = self
+
+        class Handler(_QuietHandler):
+            def do_GET(self):
+                server_self.requests += 1
+                body = server_self._bodies.get(self.path.strip('/'))
+                if body is None:
+                    self._reply(404, 'text/plain', b'not found')
+                else:
+                    self._reply(200, 'application/rss+xml; charset=utf-8', body)
+
+        self._server = _serve(Handler)
+        self.base_url = f'http://127.0.0.1:{self._server.server_port}/'
+
+    def url_for(self, feed_name: str) -> str:
+        return self.base_url + feed_name
+
+    def random_title(self, words: int = 6) -> str:
+        return ' '.join(self._random.choice(VOCABULARY) for _ in range(words))
+
+    def next_batch(self):
+        """为每个 feed 生成 posts_per_batch 个新帖子 (feed 中只保留最近 feed_size 个)。"""
+        for name, items in self._items.items():
+            for _ in range(self.posts_per_batch):
+                self._next_post_id += 1
+                post_id = self._next_post_id
+                title = self.random_title()
+                items.insert(0, (
+                    f'<item><title>{escape(title)}</title>'
+                    f'<link>https://www.nodeseek.com/post-{post_id}-1</link>'
+                    f'<guid isPermaLink="false">{post_id}</guid>'
+                    f'<description>{escape("<p>" + self.random_title(30) + "</p>")}</description>'
+                    f'<category>{self._random.choice(CATEGORIES)}</category>'
+                    f'<pubDate>{time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime())}</pubDate></item>'
+                ))
+            del items[self.feed_size:]
+            self._bodies[name] = self._render(name)
+
+    def body(self, feed_name: str) -> bytes:
+        """feed 当前的 RSS 文档。"""
+        return self._bodies[feed_name]
+
+    def _render(self, feed_name: str) -> bytes:
+        items = ''.join(self._items[feed_name])
+        return ('<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel>'
+                f'<title>NodeSeek {feed_name}</title><link>https://www.nodeseek.com/</link>'
+                f'<description>benchmark</description>{items}</channel></rss>').encode('utf-8')
+
+    def close(self):
+        self._server.shutdown()
+
+
+class FakeTelegramApi:
+    """
+    模拟 Telegram Bot API。telegram.Bot(token, base_url=api.base_url) 即可指向它。
+    error_rates 为 {'429': 比例, '403': 比例, '400': 比例}，按比例随机返回对应错误；
+    latency 为每个请求的模拟延迟 (秒)。
+    """
+
+    def __init__(self, error_rates: dict = None, latency: float = 0.0, retry_after: int = 1, seed: int = 0):
+        self.error_rates = error_rates or {}
+        self.latency = latency
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._message_id = 0
+        self._sent = 0
+        self.calls = []
+        self.errors = {'429': 0, '403': 0, '400': 0}
+        self._updates = []
+        self._updates_changed = threading.Condition(self._lock)
+
+        api = self
+
+        class Handler(_QuietHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                status, payload = api._handle(self.path.rsplit('/', 1)[-1], raw)
+                self._reply(status, 'application/json', json.dumps(payload).encode('utf-8'))
+
+        self._server = _serve(Handler)
+        self.base_url = f'http://127.0.0.1:{self._server.server_port}/bot'
+
+    def push_update(self, update: dict):
+        """放入一条更新，正在长轮询的 getUpdates 会立即返回。"""
+        with self._updates_changed:
+            self._updates.append(update)
+            self._updates_changed.notify_all()
+
+    def _get_updates(self, params: dict) -> list:
+        offset = int(params.get('offset') or 0)
+        deadline = time.monotonic() + min(float(params.get('timeout') or 0), 1.0)
+        with self._updates_changed:
+            # 与真实 API 相同，offset 确认之前的更新不再返回
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                self._updates_changed.wait(deadline - time.monotonic())
+            return list(self._updates)
+
+    def _pick_error(self, params: dict):
+        with self._lock:
+            roll = self._random.random()
+        # 纯文本重发 (没有 parse_mode) 不再注入 400，模拟 Markdown 解析失败后的后备发送成功
+        for code in ('429', '403', '400'):
+            rate = self.error_rates.get(code, 0)
+            if code == '400' and not params.get('parse_mode'):
+                continue
+            if roll < rate:
+                return code
+            roll -= rate
+        return None
+
+    def _handle(self, method: str, raw: bytes):
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            params = json.loads(raw) if raw else {}
+        except ValueError:
+            params = {}
+        error = self._pick_error(params) if method == 'sendMessage' else None
+        with self._lock:
+            self.calls.append((time.monotonic(), method, params.get('chat_id'), error))
+            if error:
+                self.errors[error] += 1
+            elif method == 'sendMessage':
+                self._sent += 1
+            self._message_id += 1
+            message_id = self._message_id
+
+        if error == '429':
+            return 429, {'ok': False, 'error_code': 429,
+                         'description': f'Too Many Requests: retry after {self.retry_after}',
+                         'parameters': {'retry_after': self.retry_after}}
+        if error == '403':
+            return 403, {'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'}
+        if error == '400':
+            return 400, {'ok': False, 'error_code': 400,
+                         'description': "Bad Request: can't parse entities: can't find end of the entity"}
+
+        if method == 'getUpdates':
+            return 200, {'ok': True, 'result': self._get_updates(params)}
+        if method in ('setWebhook', 'deleteWebhook'):
+            return 200, {'ok': True, 'result': True}
+        if method == 'getMe':
+            return 200, {'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}}
+        chat_id = params.get('chat_id', 0)
+        return 200, {'ok': True, 'result': {
+            'message_id': message_id, 'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', ''),
+        }}
+
+    def sent_messages(self) -> int:
+        with self._lock:
+            return self._sent
+
+    def close(self):
+        self._server.shutdown()
@@ -1,59 +1,187 @@
-import feedparser
 import telegram
 from telegram.ext import Updater, CommandHandler, MessageHandler, JobQueue, CallbackContext # Filters 已移除
 import telegram.utils.helpers # 确保导入
+from telegram.utils.request import Request
 import time
 import logging
-import os
 import json
+import os
+import re
+import sys
+import threading
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from broadcast import BroadcastManager, describe_progress
+from delivery import DeliveryJob, DeliveryQueue
+from delivery_history import (API_BUCKETS, DIGEST, DIGEST_SENT, FAILED, LATENCY_BUCKETS, SENT, DeliveryHistory,
+                              DeliveryRecord, ForwardingHistory, ForwardingStats, SendStats, describe_bound)
+from digest import DigestBuffer, describe_digest, parse_digest_args
+from entry_pipeline import (DEFAULT_MATCH_FIELDS, FIELD_LABELS, MATCH_FIELDS, NormalizedEntry, entry_fields,
+                            normalize_entry, parse_match_fields, user_match_fields)
+from feed_fetcher import FeedFetcher
+from feed_stream import FeedParseError
+from file_utils import atomic_write
+from fingerprint import FingerprintIndex, content_fingerprint
+from feed_registry import DEFAULT_FEED_NAME, FeedRegistry, load_feed_configs
+from keyword_matcher import KeywordMatcher
+from keyword_rules import (RULE_SYNTAX_VERSION, RuleCache, check_regex_rule_count, escape_legacy_keyword,
+                           parse_rule)
+from logging_setup import configure_logging
+from messages import (FILTER_TOGGLED_TEXT, KEYWORDS_HEADER, MAX_MESSAGE_LENGTH, NO_KEYWORDS_TEXT, NOTIFICATIONS_TEXT,
+                      START_HELP_BODY, STATUS_ENABLED_LINE, STATUS_FILTER_LINE, STATUS_HEADER,
+                      STATUS_HISTORY_HEADER, STATUS_KEYWORDS_HEADER, STATUS_NO_HISTORY, STATUS_NO_KEYWORDS,
+                      STATUS_NO_KEYWORDS_TIP, RenderedPost, history_line, md, numbered_keywords, render_digest)
+from metrics import Counter, Histogram, start_metrics_server
+from outbox import Outbox
+from sent_posts_store import SentPostStore, post_key
+from sharding import ShardPool, connect_to_coordinator, shard_for
+from sqlite_storage import (DeliveryLog, SqliteDatabase, SqliteOutbox, SqliteSentPostStore, SqliteSubscriptionStore,
+                            migrate_from_files)
+from subscription_store import SubscriptionStore
+from webhook import DEFAULT_HEALTH_PATH, default_url_path, join_webhook_url, start_webhook
 
 # --- 配置信息 ---
 # 从环境变量中获取 Telegram Bot Token
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
+# 可选: 自建 Bot API 服务器地址 (形如 http://host:8081/bot)，未设置时使用官方 API
+TELEGRAM_API_BASE_URL = os.environ.get('TELEGRAM_API_BASE_URL') or None
 # 可选: 管理员 Chat ID，用于接收机器人自身的管理通知和错误信息
 ADMIN_CHAT_ID = os.environ.get('ADMIN_CHAT_ID', None)
 # RSS Feed URL，如果环境变量未设置，则使用默认值
 RSS_URL = os.environ.get('RSS_URL', 'https://rss.nodeseek.com/')
 # RSS 检查间隔时间（秒），如果环境变量未设置，则使用默认值
 CHECK_INTERVAL_SECONDS = int(os.environ.get('CHECK_INTERVAL_SECONDS', 300))
+# 并发发送消息的工作线程数
+DELIVERY_WORKERS = int(os.environ.get('DELIVERY_WORKERS', 4))
+# 全局发送速率上限（条/秒），Telegram 对单个机器人的限制约为 30 条/秒
+GLOBAL_SEND_RATE = float(os.environ.get('GLOBAL_SEND_RATE', 30))
+# 单个聊天的发送速率上限（条/秒）
+PER_CHAT_SEND_RATE = float(os.environ.get('PER_CHAT_SEND_RATE', 1))
+# 订阅修改后延迟多少秒批量写回磁盘
+SUBSCRIPTIONS_FLUSH_DELAY_SECONDS = float(os.environ.get('SUBSCRIPTIONS_FLUSH_DELAY_SECONDS', 2))
+# 已处理帖子记录的保留窗口：最多条数与最长天数，超出的旧记录会被淘汰
+SENT_POSTS_MAX_ENTRIES = int(os.environ.get('SENT_POSTS_MAX_ENTRIES', 5000))
+SENT_POSTS_MAX_AGE_DAYS = float(os.environ.get('SENT_POSTS_MAX_AGE_DAYS', 30))
+# 是否使用从 NodeSeek 链接中解析出的帖子 ID 作为去重键 (同一帖子的不同链接形式只推送一次)
+SENT_POSTS_KEY_BY_POST_ID = os.environ.get('SENT_POSTS_KEY_BY_POST_ID', 'true').lower() in ('1', 'true', 'yes')
+# 可选: 以 JSON 列表配置多个 feed，例如 [{"name": "nodeseek", "url": "https://rss.nodeseek.com/", "interval": 120}]
+RSS_FEEDS = os.environ.get('RSS_FEEDS')
+# 调度任务检查是否有 feed 到期的频率（秒）
+FEED_SCHEDULER_TICK_SECONDS = float(os.environ.get('FEED_SCHEDULER_TICK_SECONDS', 5))
+# 并行抓取 feed 的线程数
+FEED_FETCH_WORKERS = int(os.environ.get('FEED_FETCH_WORKERS', 4))
+# feed 连续抓取失败时的最长退避时间（秒）
+FEED_MAX_BACKOFF_SECONDS = float(os.environ.get('FEED_MAX_BACKOFF_SECONDS', 3600))
+# 增量解析 feed：从最新的帖子开始解析，连续遇到 FEED_STOP_AFTER_SEEN 个已处理的帖子后停止；关闭时使用 feedparser 完整解析
+FEED_STREAMING_PARSER = os.environ.get('FEED_STREAMING_PARSER', 'true').lower() in ('1', 'true', 'yes')
+FEED_STOP_AFTER_SEEN = int(os.environ.get('FEED_STOP_AFTER_SEEN', 3))
+# 内容去重：最近 DUPLICATE_WINDOW_HOURS 小时内 (跨所有 feed) 与已处理帖子内容相近的新帖子，不再推送给订阅了原帖所在 feed 的用户，设为 0 关闭。
+# 相近指标题与正文开头的指纹相差不超过 DUPLICATE_MAX_DISTANCE 位 (共 64 位)，越大越容易把不同的帖子视为重复
+DUPLICATE_WINDOW_HOURS = float(os.environ.get('DUPLICATE_WINDOW_HOURS', 24))
+DUPLICATE_MAX_DISTANCE = int(os.environ.get('DUPLICATE_MAX_DISTANCE', 3))
+# 检查摘要模式用户的缓冲是否到期的频率（秒）
+DIGEST_CHECK_INTERVAL_SECONDS = float(os.environ.get('DIGEST_CHECK_INTERVAL_SECONDS', 30))
+# 自适应轮询：根据最近几轮发现的新帖子数量在上下限之间调整检查间隔，CHECK_INTERVAL_SECONDS 作为初始间隔
+ADAPTIVE_POLLING = os.environ.get('ADAPTIVE_POLLING', 'true').lower() in ('1', 'true', 'yes')
+POLL_MIN_INTERVAL_SECONDS = float(os.environ.get('POLL_MIN_INTERVAL_SECONDS', 60))
+POLL_MAX_INTERVAL_SECONDS = float(os.environ.get('POLL_MAX_INTERVAL_SECONDS', 900))
+# 自适应轮询期望每轮平均发现的新帖子数，越小则检查越频繁
+POLL_TARGET_NEW_ENTRIES = float(os.environ.get('POLL_TARGET_NEW_ENTRIES', 1))
+# 数据存储后端: json (默认，JSON / 文本文件) 或 sqlite
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json').lower()
+# 可选: Prometheus 指标 HTTP 端口，设置后在 http://<主机>:<端口>/metrics 提供运行指标，未设置或为 0 时不启动
+METRICS_PORT = int(os.environ.get('METRICS_PORT') or 0)
+# 可选: Webhook 模式。设置为机器人对外的 HTTPS 地址 (例如 https://bot.example.com) 后不再长轮询，
+# 由反向代理把 WEBHOOK_URL/WEBHOOK_PATH 转发到 WEBHOOK_LISTEN:WEBHOOK_PORT
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.environ.get('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', 8443))
+# 接收更新的路径，默认由 token 的哈希生成
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH')
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get('WEBHOOK_MAX_CONNECTIONS', 40))
+# Webhook 服务上的健康检查路径 (指标服务上固定为 /healthz)
+WEBHOOK_HEALTH_PATH = os.environ.get('WEBHOOK_HEALTH_PATH', DEFAULT_HEALTH_PATH)
+# 可选: 工作进程数。大于 0 时主进程只负责命令与抓取 feed，匹配与发送由 N 个工作进程按用户 ID 哈希分片完成
+WORKER_PROCESSES = int(os.environ.get('WORKER_PROCESSES', 0))
+# 分片模式下等待工作进程确认新帖子的最长时间（秒），未确认的帖子会在该 feed 下次检查时重新发布
+SHARD_ACK_TIMEOUT_SECONDS = float(os.environ.get('SHARD_ACK_TIMEOUT_SECONDS', 60))
+# 以下由主进程在启动工作进程时设置，无需手动配置
+SHARD_INDEX = int(os.environ['SHARD_INDEX']) if os.environ.get('SHARD_INDEX') else None
+SHARD_COUNT = int(os.environ.get('SHARD_COUNT') or 1)
+SHARD_SOCKET = os.environ.get('SHARD_SOCKET')
+SHARD_AUTHKEY = os.environ.get('SHARD_AUTHKEY')
+IS_SHARD_WORKER = SHARD_INDEX is not None
+# 发件箱：网络错误等临时错误的最大尝试次数，以及第一次重试前的等待时间和最长等待时间（秒），之后每次翻倍
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 8))
+OUTBOX_RETRY_BASE_SECONDS = float(os.environ.get('OUTBOX_RETRY_BASE_SECONDS', 30))
+OUTBOX_RETRY_MAX_SECONDS = float(os.environ.get('OUTBOX_RETRY_MAX_SECONDS', 3600))
+# 已完成的消息在发件箱中保留的天数，保留期内同一用户的同一帖子不会重复发送
+OUTBOX_RETENTION_DAYS = float(os.environ.get('OUTBOX_RETENTION_DAYS', 7))
+# 每个用户保留的最近推送记录条数，以及 /myrssstatus 中显示的条数
+DELIVERY_HISTORY_PER_USER = int(os.environ.get('DELIVERY_HISTORY_PER_USER', 20))
+DELIVERY_HISTORY_SHOWN = int(os.environ.get('DELIVERY_HISTORY_SHOWN', 5))
+# 管理员广播 (/broadcast)：每批写入发件箱的消息数，以及广播的发送速率上限（条/秒）。
+# 速率应低于 GLOBAL_SEND_RATE，为新帖子的推送留出余量
+BROADCAST_BATCH_SIZE = int(os.environ.get('BROADCAST_BATCH_SIZE', 50))
+BROADCAST_RATE = float(os.environ.get('BROADCAST_RATE', 10))
+# 广播进度消息的最短更新间隔（秒）
+BROADCAST_PROGRESS_INTERVAL_SECONDS = float(os.environ.get('BROADCAST_PROGRESS_INTERVAL_SECONDS', 30))
 
 # --- 数据持久化路径 ---
-# Docker 容器内的数据存储路径
-DATA_DIR = '/app/data'
-# 全局已处理（已发送或已检查）的帖子链接记录文件
+# Docker 容器内的数据存储路径 (可通过环境变量 DATA_DIR 修改，例如在本地运行或基准测试时)
+DATA_DIR = os.environ.get('DATA_DIR', '/app/data')
+# 全局已处理（已发送或已检查）的帖子链接记录文件 (默认 feed)，其他 feed 使用 sent_posts_<名称>.txt
 SENT_POSTS_FILE = os.path.join(DATA_DIR, 'sent_posts_global.txt')
+# 最近处理过的帖子的内容指纹，用于识别重发或出现在多个 feed 中的帖子
+FINGERPRINTS_FILE = os.path.join(DATA_DIR, 'post_fingerprints.txt')
+# 可选: 多 feed 配置文件，格式同 RSS_FEEDS 环境变量
+FEEDS_FILE = os.path.join(DATA_DIR, 'feeds.json')
 # 用户订阅信息（关键词、启用状态等）的 JSON 文件
 USER_SUBSCRIPTIONS_FILE = os.path.join(DATA_DIR, 'user_subscriptions.json')
+# RSS 条件请求状态 (ETag / Last-Modified / 正文哈希)
+FEED_STATE_FILE = os.path.join(DATA_DIR, 'feed_state.json')
+# SQLite 后端的数据库文件，首次使用时会自动导入上面的 JSON / 文本文件
+SQLITE_DB_FILE = os.path.join(DATA_DIR, 'bot.db')
+# 工作进程各自拥有摘要缓冲和发件箱，文件名带分片编号
+SHARD_FILE_SUFFIX = f'-{SHARD_INDEX}' if IS_SHARD_WORKER else ''
+# 摘要模式下已匹配、尚未合并发送的帖子
+DIGEST_BUFFER_FILE = os.path.join(DATA_DIR, f'digest_buffer{SHARD_FILE_SUFFIX}.json')
+# 发件箱 (JSON 后端)：尚未确认送达的消息及最近完成的消息的去重键
+OUTBOX_FILE = os.path.join(DATA_DIR, f'outbox{SHARD_FILE_SUFFIX}.jsonl')
+# 每个用户最近的推送记录 (只由主进程保存，工作进程把记录转发给主进程)
+DELIVERY_HISTORY_FILE = os.path.join(DATA_DIR, 'delivery_history.jsonl')
+# 管理员广播的内容、收件人与发送进度
+BROADCASTS_FILE = os.path.join(DATA_DIR, 'broadcasts.json')
+# 上次运行时的工作进程数，变化时重新分配各分片文件中未完成的消息和摘要
+SHARD_LAYOUT_FILE = os.path.join(DATA_DIR, 'shards.json')
+SHARD_FILE_RE = re.compile(r'^(?:outbox-\d+\.jsonl|digest_buffer-\d+\.json)$')
 
 # --- 日志配置 ---
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                    level=logging.INFO)
+# LOG_FORMAT=json 时每条日志输出为一行 JSON；LOG_LEVEL=DEBUG 时额外输出逐个用户的匹配和发送记录
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+# 发送结果汇总 (最近一段时间内的发送、失败和重试数) 的输出间隔（秒），0 表示不输出
+LOG_SUMMARY_INTERVAL_SECONDS = float(os.environ.get('LOG_SUMMARY_INTERVAL_SECONDS', 60))
+configure_logging(LOG_LEVEL, LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
-# --- 用户订阅管理函数 ---
-def load_user_subscriptions():
-    """从 JSON 文件加载用户订阅信息。"""
-    if not os.path.exists(DATA_DIR):
-        os.makedirs(DATA_DIR, exist_ok=True) # 如果目录不存在则创建
-    if not os.path.exists(USER_SUBSCRIPTIONS_FILE):
-        return {} # 如果文件不存在，返回空字典
-    try:
-        with open(USER_SUBSCRIPTIONS_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, IOError) as e:
-        logger.error(f"加载用户订阅失败 ({USER_SUBSCRIPTIONS_FILE}): {e}。将返回空配置。", exc_info=True)
-        return {}
-
-def save_user_subscriptions(subscriptions):
-    """将用户订阅信息保存到 JSON 文件。"""
-    if not os.path.exists(DATA_DIR):
-        os.makedirs(DATA_DIR, exist_ok=True) # 如果目录不存在则创建
-    try:
-        with open(USER_SUBSCRIPTIONS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(subscriptions, f, indent=4, ensure_ascii=False) # ensure_ascii=False 保证中文正确显示
-        logger.info(f"用户订阅信息已保存到 {USER_SUBSCRIPTIONS_FILE}")
-    except IOError as e:
-        logger.error(f"保存用户订阅失败 ({USER_SUBSCRIPTIONS_FILE}): {e}", exc_info=True)
+# --- 用户订阅管理 ---
+_keyword_matcher = None
+_keyword_matcher_version = -1
+# 各用户编译后的关键词规则，只有该用户的关键词变化时才重新编译
+keyword_rule_cache = RuleCache(
+    on_invalid=lambda keyword, error: logger.warning(f"忽略无效的关键词规则 '{keyword}': {error}"))
+
+def get_keyword_matcher(version: int, subscriptions: dict) -> KeywordMatcher:
+    """返回与当前订阅对应的关键词匹配器，仅在订阅版本变化后才重建。"""
+    global _keyword_matcher, _keyword_matcher_version
+    if _keyword_matcher is None or _keyword_matcher_version != version:
+        _keyword_matcher = KeywordMatcher(subscriptions, keyword_rule_cache)
+        _keyword_matcher_version = version
+        logger.info(f"关键词匹配器已重建: {_keyword_matcher.pattern_count} 个关键词, "
+                    f"{len(_keyword_matcher.match_all_users)} 个用户接收全部帖子。")
+    return _keyword_matcher
 
 def get_user_config_and_subscriptions(user_id_str: str, chat_id: int, current_subscriptions: dict):
     """
@@ -67,7 +195,8 @@ def get_user_config_and_subscriptions(user_id_str: str, chat_id: int, current_su
             "chat_id": chat_id,      # 存储用户的 chat_id，用于私聊推送
             "keywords": [],          # 用户订阅的关键词列表
             "enabled": True,         # 总体通知开关，默认为开
-            "keyword_filter_active": True # 新增：关键词过滤模式开关，默认为开 (只接收关键词匹配)
+            "keyword_filter_active": True, # 新增：关键词过滤模式开关，默认为开 (只接收关键词匹配)
+            "keyword_syntax": RULE_SYNTAX_VERSION # 关键词按规则语法解析 (见 migrate_legacy_keywords)
         }
         modified = True
     # 确保 chat_id 是最新的
@@ -85,132 +214,587 @@ def get_user_config_and_subscriptions(user_id_str: str, chat_id: int, current_su
 
     return current_subscriptions[user_id_str], current_subscriptions, modified
 
-# --- 全局已发送帖子管理函数 ---
-def load_sent_posts_global():
-    """加载全局已处理的帖子链接集合。"""
-    if not os.path.exists(DATA_DIR):
-        os.makedirs(DATA_DIR, exist_ok=True)
-    if not os.path.exists(SENT_POSTS_FILE):
-        return set()
+def migrate_legacy_keywords():
+    """
+    旧版本中所有关键词都是普通子串。升级后第一次启动时，为在规则语法下含义会改变的关键词
+    (例如 "-收" 会变成排除规则) 加上 lit: 前缀，保持原有的匹配结果，并在日志中列出受影响的用户。
+    """
+    migrated_users = 0
+    with subscription_store.edit() as subscriptions:
+        for user_id_str, config in subscriptions.items():
+            if config.get("keyword_syntax") == RULE_SYNTAX_VERSION:
+                continue
+            keywords = config.get("keywords", [])
+            escaped = [escape_legacy_keyword(keyword) for keyword in keywords]
+            changed = [keyword for keyword, new in zip(keywords, escaped) if keyword != new]
+            if changed:
+                config["keywords"] = escaped
+                migrated_users += 1
+                logger.warning(f"用户 {user_id_str} 的关键词 {changed} 在新的规则语法下含义不同，已加上 lit: 前缀保持原样匹配。")
+            config["keyword_syntax"] = RULE_SYNTAX_VERSION
+            subscription_store.mark_changed(user_id_str)
+    if migrated_users:
+        logger.warning(f"已为 {migrated_users} 个用户转换旧版本的关键词。")
+
+def reshard_pending_files():
+    """
+    工作进程数 (WORKER_PROCESSES) 与上次运行时不同时，在启动工作进程前把各分片文件
+    (outbox-<编号>.jsonl、digest_buffer-<编号>.json) 中未完成的消息和缓冲的摘要帖子按新的分片数重新分配；
+    工作进程数变为 0 时并入主进程的发件箱和摘要缓冲。新文件全部写好后才删除或替换旧文件，中途退出时
+    下次启动会重新分配，消息可能重复发送但不会丢失。已完成消息的去重键不迁移。
+    """
     try:
-        with open(SENT_POSTS_FILE, 'r', encoding='utf-8') as f:
-            return set(line.strip() for line in f if line.strip())
-    except IOError as e:
-        logger.error(f"加载全局已发送帖子记录失败 ({SENT_POSTS_FILE}): {e}。将返回空集合。", exc_info=True)
-        return set()
-
-def save_sent_post_global(post_link):
-    """将一个已处理的帖子链接追加到全局记录文件。"""
-    if not os.path.exists(DATA_DIR):
-        os.makedirs(DATA_DIR, exist_ok=True)
+        with open(SHARD_LAYOUT_FILE, 'r', encoding='utf-8') as f:
+            previous = json.load(f).get('worker_processes')
+    except FileNotFoundError:
+        previous = None
+    except (json.JSONDecodeError, IOError) as e:
+        logger.error(f"读取分片记录失败 ({SHARD_LAYOUT_FILE}): {e}。将按工作进程数已变化处理。")
+        previous = None
+    if previous == WORKER_PROCESSES:
+        return
+    sources = {'outbox': [], 'digest_buffer': []}
+    for name in os.listdir(DATA_DIR) if os.path.isdir(DATA_DIR) else []:
+        if SHARD_FILE_RE.match(name):
+            sources['outbox' if name.startswith('outbox') else 'digest_buffer'].append(os.path.join(DATA_DIR, name))
+
+    jobs = []
+    for path in sources['outbox']:
+        source_outbox = Outbox(path)
+        jobs += source_outbox.pending_jobs()
+        source_outbox.close()
+    digest_items = {}
+    for path in sources['digest_buffer']:
+        for user_id_str, items in DigestBuffer(path).items().items():
+            digest_items.setdefault(user_id_str, []).extend(items)
+
+    def target(user_id_str: str):
+        return shard_for(user_id_str, WORKER_PROCESSES) if WORKER_PROCESSES > 0 else None
+
+    # 新文件先写到 <文件名>.reshard，全部写好后再替换
+    def staging_path(path: str) -> str:
+        staging = path + '.reshard'
+        if os.path.exists(staging):
+            os.remove(staging)
+        return staging
+
+    # SQLite 后端的发件箱为所有进程共用的表；工作进程数为 0 时写入主进程自己的发件箱和摘要缓冲
+    job_targets = {}
+    for job in jobs:
+        job_targets.setdefault(None if database else target(job.user_id_str), []).append(job)
+    replaced = []
+    for index, target_jobs in job_targets.items():
+        if index is None:
+            outbox.write(target_jobs)
+            continue
+        path = os.path.join(DATA_DIR, f'outbox-{index}.jsonl')
+        shard_outbox = Outbox(staging_path(path))
+        shard_outbox.write(target_jobs)
+        shard_outbox.close()
+        replaced.append(path)
+    digest_targets = {}
+    for user_id_str, items in digest_items.items():
+        digest_targets.setdefault(target(user_id_str), {})[user_id_str] = items
+    for index, items_by_user in digest_targets.items():
+        if index is None:
+            digest_buffer.merge(items_by_user)
+            digest_buffer.flush()
+            continue
+        path = os.path.join(DATA_DIR, f'digest_buffer-{index}.json')
+        shard_buffer = DigestBuffer(staging_path(path))
+        shard_buffer.merge(items_by_user)
+        shard_buffer.flush()
+        replaced.append(path)
+
+    for path in replaced:
+        os.replace(path + '.reshard', path)
+    for path in sources['outbox'] + sources['digest_buffer']:
+        if path not in replaced:
+            os.remove(path)
+    atomic_write(SHARD_LAYOUT_FILE, json.dumps({'worker_processes': WORKER_PROCESSES}))
+    if jobs or digest_items:
+        logger.warning(f"工作进程数由 {previous if previous is not None else '未知'} 变为 {WORKER_PROCESSES}，"
+                       f"已重新分配 {len(jobs)} 条未完成的消息和 {sum(len(items) for items in digest_items.values())} "
+                       f"条缓冲的摘要帖子。")
+
+# --- Feed 注册表 ---
+feed_registry = FeedRegistry(load_feed_configs(RSS_URL, CHECK_INTERVAL_SECONDS, RSS_FEEDS, FEEDS_FILE),
+                             max_backoff_seconds=FEED_MAX_BACKOFF_SECONDS,
+                             adaptive=ADAPTIVE_POLLING,
+                             min_interval=POLL_MIN_INTERVAL_SECONDS,
+                             max_interval=POLL_MAX_INTERVAL_SECONDS,
+                             target_new_entries=POLL_TARGET_NEW_ENTRIES)
+
+def sent_posts_file_for(feed_name: str) -> str:
+    """每个 feed 拥有独立的去重记录文件，默认 feed 沿用原来的 sent_posts_global.txt。"""
+    if feed_name == DEFAULT_FEED_NAME:
+        return SENT_POSTS_FILE
+    return os.path.join(DATA_DIR, f'sent_posts_{feed_name}.txt')
+
+# --- 数据存储 ---
+# subscription_store: 订阅数据常驻内存，修改后延迟批量写回
+# sent_posts_stores: 每个 feed 的已处理帖子记录，只保留最近的窗口，新记录每轮检查批量写入一次
+# delivery_log: 每个用户收到的推送记录 (仅 SQLite 后端)
+# outbox: 待发送消息先写入发件箱，确认送达后才标记完成，重启后重新投递未完成的消息
+# delivery_history: 每个用户最近的推送结果 (固定大小的环形缓冲)，send_stats: 最近一小时的发送统计，供 /stats 使用
+# 工作进程只处理主进程发布的新帖子，不读写已处理帖子记录
+# JSON 后端的已处理帖子记录在后台加载 (第一次检查 RSS 前才需要)，不阻塞启动
+sent_posts_feed_names = [] if IS_SHARD_WORKER else feed_registry.names()
+if STORAGE_BACKEND == 'sqlite':
+    database = SqliteDatabase(SQLITE_DB_FILE)
+    migrate_from_files(database, USER_SUBSCRIPTIONS_FILE,
+                       {feed_name: sent_posts_file_for(feed_name) for feed_name in feed_registry.names()},
+                       key_by_post_id=SENT_POSTS_KEY_BY_POST_ID)
+    subscription_store = SqliteSubscriptionStore(database, flush_delay=SUBSCRIPTIONS_FLUSH_DELAY_SECONDS)
+    sent_posts_stores = {
+        feed_name: SqliteSentPostStore(database, feed_name,
+                                       max_entries=SENT_POSTS_MAX_ENTRIES,
+                                       max_age_seconds=SENT_POSTS_MAX_AGE_DAYS * 86400,
+                                       key_by_post_id=SENT_POSTS_KEY_BY_POST_ID)
+        for feed_name in sent_posts_feed_names
+    }
+    delivery_log = DeliveryLog(database)
+    outbox = SqliteOutbox(database, retention_seconds=OUTBOX_RETENTION_DAYS * 86400,
+                          shard=(SHARD_INDEX, SHARD_COUNT) if IS_SHARD_WORKER else None)
+else:
+    database = None
+    subscription_store = SubscriptionStore(USER_SUBSCRIPTIONS_FILE,
+                                           flush_delay=SUBSCRIPTIONS_FLUSH_DELAY_SECONDS)
+    sent_posts_stores = {
+        feed_name: SentPostStore(sent_posts_file_for(feed_name),
+                                 max_entries=SENT_POSTS_MAX_ENTRIES,
+                                 max_age_seconds=SENT_POSTS_MAX_AGE_DAYS * 86400,
+                                 key_by_post_id=SENT_POSTS_KEY_BY_POST_ID,
+                                 background_load=True)
+        for feed_name in sent_posts_feed_names
+    }
+    delivery_log = None
+    outbox = Outbox(OUTBOX_FILE, retention_seconds=OUTBOX_RETENTION_DAYS * 86400)
+# content_index: 最近一段时间内新帖子的内容指纹 (两种后端都使用文件)，由主进程在分发新帖子前检查
+content_index = (FingerprintIndex(FINGERPRINTS_FILE, window_seconds=DUPLICATE_WINDOW_HOURS * 3600,
+                                  max_distance=DUPLICATE_MAX_DISTANCE)
+                 if DUPLICATE_WINDOW_HOURS > 0 and not IS_SHARD_WORKER else None)
+
+# 工作进程在 run_shard_worker() 中改为转发给主进程
+delivery_history = None if IS_SHARD_WORKER else DeliveryHistory(DELIVERY_HISTORY_FILE,
+                                                                  per_user=DELIVERY_HISTORY_PER_USER)
+send_stats = SendStats()
+# 广播只由主进程发送
+broadcasts = None if IS_SHARD_WORKER else BroadcastManager(BROADCASTS_FILE)
+
+# --- 消息投递 ---
+# 在 main() 中创建，RSS 检查任务只负责将消息放入队列
+delivery_queue = None
+# 分片模式下主进程中的工作进程管理 (见 sharding)
+shard_pool = None
+digest_buffer = DigestBuffer(DIGEST_BUFFER_FILE)
+
+def on_chat_migrated(user_id_str: str, new_chat_id: int):
+    """投递时发现聊天已迁移，更新用户的 chat_id。"""
+    with subscription_store.edit() as subscriptions:
+        if user_id_str in subscriptions:
+            subscriptions[user_id_str]['chat_id'] = new_chat_id
+            subscription_store.mark_changed(user_id_str)
+
+def record_outcome(job: DeliveryJob, outcome: str, reason: str = None):
+    """把消息的发送结果记入用户的推送记录，摘要消息为其中的每个帖子各记一条。"""
+    now = time.time()
+    if job.post_key:
+        delivery_history.add(job.user_id_str, DeliveryRecord(now, job.feed_name, job.post_key, job.title,
+                                                             job.keyword, outcome, reason))
+    for feed_name, key in job.posts or ():
+        delivery_history.add(job.user_id_str, DeliveryRecord(now, feed_name, key, None, None,
+                                                             DIGEST_SENT if outcome == SENT else outcome, reason))
+
+def on_delivered(job: DeliveryJob):
+    """消息发送成功后记录推送。"""
+    if job.broadcast_id is not None:
+        if broadcasts is not None:
+            broadcasts.record_result(job.broadcast_id, delivered=True)
+        return
+    record_outcome(job, SENT)
+    if not delivery_log:
+        return
+    if job.post_key:
+        delivery_log.record(job.user_id_str, job.feed_name, job.post_key)
+    for feed_name, key in job.posts or ():
+        delivery_log.record(job.user_id_str, feed_name, key)
+
+def on_failed(job: DeliveryJob, reason: str):
+    """消息被放弃发送 (用户屏蔽了机器人、消息格式错误或多次重试失败)。"""
+    if job.broadcast_id is not None:
+        if broadcasts is not None:
+            broadcasts.record_result(job.broadcast_id, delivered=False)
+        return
+    record_outcome(job, FAILED, reason)
+
+def on_forbidden(user_id_str: str):
+    """用户屏蔽了机器人或账户已停用，禁用其通知。"""
+    with subscription_store.edit() as subscriptions:
+        if user_id_str in subscriptions:
+            subscriptions[user_id_str]['enabled'] = False
+            subscription_store.mark_changed(user_id_str)
+
+# 摘要检查任务与 RSS 检查 (及分片模式下工作进程的摘要线程) 可能同时发送摘要
+digest_send_lock = threading.Lock()
+
+def send_due_digests(user_subscriptions: dict) -> int:
+    """将到期的摘要合并为消息放入发送队列，返回发送的摘要数。"""
+    with digest_send_lock:
+        due = digest_buffer.due(user_subscriptions)
+        jobs = []
+        for user_id_str, items in due.items():
+            chat_id = user_subscriptions[user_id_str]["chat_id"]
+            for markdown, plain, chunk in render_digest(items):
+                jobs.append(DeliveryJob(user_id_str, chat_id, markdown, plain_text=plain,
+                                        parse_mode=telegram.ParseMode.MARKDOWN_V2,
+                                        description=f"包含 {len(chunk)} 个帖子的摘要",
+                                        posts=[(item['feed'], item['key']) for item in chunk if item['key']]))
+        # 摘要先写入发件箱，再从缓冲区中移除
+        written_jobs = outbox.write(jobs)
+        digest_buffer.remove(due)
+        digest_buffer.flush()
+    for job in written_jobs:
+        delivery_queue.submit(job)
+    # 推送记录在发送线程中产生，随摘要检查 (每 DIGEST_CHECK_INTERVAL_SECONDS 秒及每轮 RSS 检查后) 批量写入
+    delivery_history.flush()
+    if due:
+        logger.info(f"已为 {len(due)} 个用户发送摘要，共 {sum(len(items) for items in due.values())} 个帖子。")
+    return len(due)
+
+def send_due_digests_job(context: CallbackContext):
+    """调度任务：发送按时间条件到期的摘要。"""
+    _, user_subscriptions = subscription_store.snapshot()
+    send_due_digests(user_subscriptions)
+
+# 上次输出发送结果汇总时 send_stats 的累计数
+last_logged_send_totals = {}
+
+def log_send_summary(context: CallbackContext):
+    """调度任务：输出上次汇总以来的发送、失败和重试数 (代替逐条的发送成功记录)，期间没有发送时不输出。"""
+    totals = dict(send_stats.totals)
+    sent, failed, retried = (totals[name] - last_logged_send_totals.get(name, 0) for name in ('sent', 'failed', 'retried'))
+    last_logged_send_totals.update(totals)
+    if not (sent or failed or retried):
+        return
+    pending = delivery_queue.pending()
+    logger.info("最近 %.0f 秒发送 %d 条消息，放弃 %d 条，重试 %d 次，队列中还有 %d 条待发送。",
+                LOG_SUMMARY_INTERVAL_SECONDS, sent, failed, retried, pending,
+                extra={'sent': sent, 'failed': failed, 'retried': retried, 'queue_pending': pending,
+                       'interval_seconds': LOG_SUMMARY_INTERVAL_SECONDS})
+
+# --- 管理员广播 ---
+# 广播编号 -> 上次更新进度消息的时间
+broadcast_reported_at = {}
+
+def report_broadcast_progress(bot, broadcast: dict, final: bool = False):
+    """编辑广播开始时回复的进度消息；广播结束时另发一条消息通知管理员。"""
+    now = time.time()
+    if not final and now - broadcast_reported_at.get(broadcast['id'], 0) < BROADCAST_PROGRESS_INTERVAL_SECONDS:
+        return
+    broadcast_reported_at[broadcast['id']] = now
+    text = describe_progress(broadcast)
     try:
-        with open(SENT_POSTS_FILE, 'a', encoding='utf-8') as f:
-            f.write(post_link + '\n')
-    except IOError as e:
-        logger.error(f"保存全局已发送帖子记录失败 ({SENT_POSTS_FILE}): {e}", exc_info=True)
-
-globally_sent_posts_links = load_sent_posts_global()
+        if final or not broadcast['status_message_id']:
+            message = bot.send_message(chat_id=broadcast['admin_chat_id'], text=text)
+            broadcasts.set_status_message(broadcast['id'], message.message_id)
+        else:
+            bot.edit_message_text(chat_id=broadcast['admin_chat_id'], message_id=broadcast['status_message_id'],
+                                  text=text)
+    except telegram.error.BadRequest as e:
+        # 进度没有变化时 Telegram 拒绝编辑 (message is not modified)
+        if 'not modified' not in str(e).lower():
+            logger.warning(f"更新广播 #{broadcast['id']} 的进度消息失败: {e}")
+    except telegram.error.TelegramError as e:
+        logger.warning(f"更新广播 #{broadcast['id']} 的进度消息失败: {e}")
+
+def send_broadcast_batch(context: CallbackContext):
+    """
+    调度任务：投递队列中的消息基本发完时，把正在进行的广播的下一批消息写入发件箱并放入队列，
+    每次最多 BROADCAST_BATCH_SIZE 条，新帖子的推送不会被大量广播消息堵在后面。
+    """
+    if delivery_queue.pending() < BROADCAST_BATCH_SIZE:
+        _, user_subscriptions = subscription_store.snapshot()
+        broadcast, batch = broadcasts.next_batch(user_subscriptions, BROADCAST_BATCH_SIZE)
+        if broadcast is not None:
+            jobs = [DeliveryJob(user_id_str, chat_id, broadcast['text'], description=f"广播 #{broadcast['id']}",
+                                broadcast_id=broadcast['id'])
+                    for user_id_str, chat_id in batch]
+            # 先写入发件箱再保存进度：中途退出时这一批会被重新取出，发件箱按广播编号与用户去重
+            for job in outbox.write(jobs):
+                delivery_queue.submit(job)
+            broadcasts.save()
+    if delivery_queue.pending() == 0:
+        for broadcast in broadcasts.finish_drained():
+            logger.info(f"广播 #{broadcast['id']} 已结束: 发送 {broadcast['sent']}，失败 {broadcast['failed']}，"
+                        f"跳过 {broadcast['skipped']}。")
+            report_broadcast_progress(context.bot, broadcast, final=True)
+            broadcast_reported_at.pop(broadcast['id'], None)
+    for broadcast in broadcasts.unfinished():
+        report_broadcast_progress(context.bot, broadcast)
+    broadcasts.save()
 
 # --- RSS 检查与推送逻辑 ---
-def check_rss_and_send_to_users(context: CallbackContext):
-    global globally_sent_posts_links
-    user_subscriptions = load_user_subscriptions()
-
-    logger.info(f"正在检查 RSS feed: {RSS_URL}，准备向订阅用户推送。")
-
+# 抓取时带上条件请求头，内容未变化时跳过解析
+feed_fetcher = FeedFetcher(FEED_STATE_FILE, streaming=FEED_STREAMING_PARSER)
+feed_fetch_executor = ThreadPoolExecutor(max_workers=FEED_FETCH_WORKERS, thread_name_prefix='feed-fetch')
+
+CHECK_CYCLE_SECONDS = Histogram('rss_check_cycle_seconds', '一轮 RSS 检查 (抓取、匹配、入队) 的耗时 (秒)')
+NEW_ENTRIES = Histogram('rss_new_entries_per_check', '每轮检查发现的新帖子数', ('feed',),
+                        buckets=(0, 1, 2, 5, 10, 20, 50, 100))
+MATCH_SECONDS = Histogram('rss_keyword_match_seconds', '单个帖子关键词匹配耗时 (秒)',
+                          buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1))
+POSTS_QUEUED = Counter('rss_pushes_queued_total', '进入发送队列的推送数', ('feed',))
+FEED_ERRORS = Counter('rss_feed_errors_total', 'feed 检查失败次数', ('feed',))
+DUPLICATE_ENTRIES = Counter('rss_duplicate_entries_total', '与最近的帖子内容相近的新帖子数 (不再推送给订阅了原帖所在 feed 的用户)', ('feed',))
+
+# 调度任务最近一次运行的时间，用于健康检查判断任务线程是否仍在运行
+started_at = time.time()
+last_scheduler_tick = None
+
+def health_status() -> tuple:
+    """健康检查：调度任务在预期时间内运行过即为健康。返回 (是否健康, 详情)。"""
+    now = time.time()
+    stale_after = max(60.0, 6 * FEED_SCHEDULER_TICK_SECONDS)
+    # 第一次检查在启动 10 秒后运行
+    reference = last_scheduler_tick or started_at + 10
+    healthy = now - reference <= stale_after
+    return healthy, {
+        'mode': 'webhook' if WEBHOOK_URL else 'polling',
+        'uptime_seconds': round(now - started_at),
+        'last_check_seconds_ago': round(now - last_scheduler_tick, 1) if last_scheduler_tick else None,
+        'delivery_queue': delivery_queue.pending() if delivery_queue else 0,
+        'outbox_pending': outbox.pending_count(),
+    }
+
+class FeedError(Exception):
+    """feed 抓取或解析失败，该 feed 将按退避时间稍后重试。"""
+
+def notify_admin(context: CallbackContext, text: str):
+    """向管理员发送通知 (若已配置 ADMIN_CHAT_ID)。"""
+    if not ADMIN_CHAT_ID:
+        return
     try:
-        feed = feedparser.parse(RSS_URL)
-        if feed.bozo:
-            error_message = f"解析 RSS feed ({RSS_URL}) 时出错: {feed.bozo_exception}"
-            logger.error(error_message)
-            if ADMIN_CHAT_ID:
-                try:
-                    context.bot.send_message(chat_id=ADMIN_CHAT_ID, text=f"RSS 机器人警告: {error_message}")
-                except Exception as e_admin:
-                    logger.error(f"向管理员发送 RSS 解析错误通知失败: {e_admin}", exc_info=True)
-            return
+        context.bot.send_message(chat_id=ADMIN_CHAT_ID, text=text)
+    except Exception as e_admin:
+        logger.error(f"向管理员发送通知失败: {e_admin}", exc_info=True)
 
-        new_posts_pushed_this_cycle = 0
-        subscriptions_modified_due_to_send_failure = False
-
-        for entry in reversed(feed.entries):
-            post_title = entry.title
-            post_link = entry.link
-
-            if post_link in globally_sent_posts_links:
-                continue
+def user_wants_feed(config: dict, feed_name: str) -> bool:
+    """用户未设置 feeds 列表时订阅所有 feed。"""
+    feeds = config.get("feeds")
+    return not feeds or feed_name in feeds
 
-            for user_id_str, config in user_subscriptions.items():
-                if not config.get("enabled", False):
-                    continue
-
-                user_chat_id = config.get("chat_id")
-                if not user_chat_id:
-                    logger.warning(f"用户 {user_id_str} 的配置中缺少 chat_id，无法推送。")
-                    continue
+def dispatch_entry(feed_name: str, entry: NormalizedEntry, entry_key: str, matcher: KeywordMatcher,
+                   user_subscriptions: dict, jobs: list, skip_feeds=()) -> tuple:
+    """
+    匹配一个新帖子，为匹配的用户生成推送 (追加到 jobs) 或加入摘要缓冲，返回 (推送数, 加入摘要数)。
+    订阅了 skip_feeds 中任一 feed 的用户 (已收到内容相近的帖子，见 duplicate_feeds()) 被跳过。
+    调用方随后需调用 persist_dispatched(jobs)。
+    """
+    # 同一 feed 中重发的帖子：所有收件人都订阅了原帖所在的 feed
+    if feed_name in skip_feeds:
+        return 0, 0
+    match_started = time.perf_counter()
+    matches = matcher.match(entry)
+    MATCH_SECONDS.observe(time.perf_counter() - match_started)
+
+    pushed = 0
+    digested = 0
+    rendered_post = None
+    # 逐个用户的匹配记录只在 DEBUG 级别输出，每轮的汇总见 log_dispatch_summary()
+    log_matches = logger.isEnabledFor(logging.DEBUG)
+    for user_id_str, matched_keyword in matches.items():
+        config = user_subscriptions[user_id_str]
+        if not user_wants_feed(config, feed_name):
+            continue
+        if any(user_wants_feed(config, other_feed) for other_feed in skip_feeds):
+            continue
+        user_chat_id = config["chat_id"]
+
+        if log_matches:
+            if matched_keyword is None:
+                logger.debug("用户 %s 接收全部帖子 (关键词过滤已关闭或只设置了排除规则)。准备发送帖子 '%s'。",
+                             user_id_str, entry.title)
+            else:
+                logger.debug("帖子 '%s' 匹配到用户 %s 的关键词 '%s'。", entry.title, user_id_str, matched_keyword)
+
+        if config.get("digest"):
+            digest_buffer.add(user_id_str, feed_name, entry.title, entry.link, entry_key)
+            delivery_history.add(user_id_str, DeliveryRecord(time.time(), feed_name, entry_key, entry.title,
+                                                             matched_keyword, DIGEST))
+            digested += 1
+            continue
+
+        # 每个帖子只渲染一次，所有收件人共享同一份消息文本
+        if rendered_post is None:
+            rendered_post = RenderedPost(entry.title, entry.link)
+        jobs.append(DeliveryJob(user_id_str, user_chat_id, rendered_post.markdown,
+                                plain_text=rendered_post.plain,
+                                parse_mode=telegram.ParseMode.MARKDOWN_V2,
+                                description=rendered_post.description,
+                                feed_name=feed_name,
+                                post_key=entry_key,
+                                title=entry.title,
+                                keyword=matched_keyword))
+        pushed += 1
+    return pushed, digested
+
+def duplicate_feeds(feed_name: str, entry: NormalizedEntry, entry_key: str) -> set:
+    """
+    记录新帖子的内容指纹，返回窗口内内容相近的其他帖子 (重发或出现在多个 feed 中) 所在的 feed。
+    订阅了其中任一 feed 的用户已经有机会收到原帖，dispatch_entry() 不再向他们推送；
+    只订阅了当前 feed 的用户仍会收到。
+    """
+    if content_index is None:
+        return set()
+    fingerprint = content_fingerprint(entry)
+    if fingerprint is None:
+        return set()
+    duplicates = content_index.find_duplicates(fingerprint, feed_name, entry_key)
+    content_index.add(fingerprint, feed_name, entry_key)
+    if not duplicates:
+        return set()
+    DUPLICATE_ENTRIES.labels(feed_name).inc()
+    feeds = {other_feed for other_feed, _ in duplicates}
+    logger.info("帖子 '%s' 与 feed %s 中的帖子 %s 内容相近，订阅了这些 feed 的用户不再收到推送。",
+                entry.title, ', '.join(sorted(feeds)), ', '.join(other_key for _, other_key in duplicates),
+                extra={'feed': feed_name, 'post_key': entry_key, 'duplicate_of': [list(item) for item in duplicates]})
+    return feeds
+
+def flush_processed(sent_posts_store):
+    """记录本轮处理过的帖子及其内容指纹。"""
+    sent_posts_store.flush()
+    if content_index is not None:
+        content_index.flush()
+
+def persist_dispatched(jobs: list, mark_processed=None):
+    """
+    先保存摘要缓冲并把本轮的推送 jobs 写入发件箱，再调用 mark_processed() 记录帖子已处理，最后才开始发送：
+    中途退出时已匹配的帖子不会丢失，重新处理同一帖子时发件箱会忽略重复的推送。
+    """
+    digest_buffer.flush()
+    written_jobs = outbox.write(jobs)
+    if mark_processed:
+        mark_processed()
+    for job in written_jobs:
+        delivery_queue.submit(job)
+    if delivery_log:
+        delivery_log.flush()
+
+def log_dispatch_summary(feed_name: str, new_entries: int, new_posts_pushed: int, new_posts_digested: int):
+    """每个 feed 每轮一条汇总记录 (代替逐个用户的匹配记录)，JSON 日志中各数量为独立字段。"""
+    NEW_ENTRIES.labels(feed_name).observe(new_entries)
+    POSTS_QUEUED.labels(feed_name).inc(new_posts_pushed)
+    pending = delivery_queue.pending()
+    logger.info("feed %s 本轮有 %d 个新帖子，%d 条推送进入发送队列，%d 条加入摘要缓冲，当前队列中共 %d 条待发送。",
+                feed_name, new_entries, new_posts_pushed, new_posts_digested, pending,
+                extra={'feed': feed_name, 'new_entries': new_entries, 'pushed': new_posts_pushed,
+                       'digested': new_posts_digested, 'queue_pending': pending})
+
+def process_feed(context: CallbackContext, feed_config, fetch_result, subscriptions_version: int,
+                 user_subscriptions: dict) -> int:
+    """处理一个 feed 的抓取结果，将匹配的帖子放入发送队列。返回本轮的新帖子数量。"""
+    if fetch_result.not_modified:
+        feed_fetcher.commit(fetch_result)
+        return 0
+
+    sent_posts_store = sent_posts_stores[feed_config.name]
+    try:
+        new_entries = fetch_result.new_entries(lambda link: link in sent_posts_store,
+                                               stop_after_seen=FEED_STOP_AFTER_SEEN)
+    except FeedParseError as e:
+        raise FeedError(f"解析 RSS feed {feed_config.name} ({feed_config.url}) 时出错: {e}")
+
+    if shard_pool is not None:
+        # 分片模式：匹配与发送由工作进程完成，所有工作进程确认后才记录帖子已处理
+        published = []
+        for entry in new_entries:
+            fields = entry_fields(entry)
+            key = post_key(entry.link, SENT_POSTS_KEY_BY_POST_ID)
+            skip_feeds = duplicate_feeds(feed_config.name, NormalizedEntry(**fields), key)
+            if feed_config.name not in skip_feeds:
+                published.append(dict(fields, key=key, skip_feeds=sorted(skip_feeds)))
+        if published and not shard_pool.publish(feed_config.name, published):
+            raise FeedError(f"feed {feed_config.name} 的 {len(published)} 个新帖子未被所有工作进程确认，将重新发布")
+        for entry in new_entries:
+            sent_posts_store.add(entry.link)
+        flush_processed(sent_posts_store)
+        feed_fetcher.commit(fetch_result)
+        NEW_ENTRIES.labels(feed_config.name).observe(len(new_entries))
+        if new_entries:
+            logger.info(f"feed {feed_config.name} 本轮有 {len(new_entries)} 个新帖子，已交给 {shard_pool.count} 个工作进程处理。")
+        return len(new_entries)
+
+    matcher = get_keyword_matcher(subscriptions_version, user_subscriptions)
+    new_posts_pushed = 0
+    new_posts_digested = 0
+    jobs = []
+    try:
+        for entry in new_entries:
+            normalized = normalize_entry(entry)
+            entry_key = post_key(entry.link, SENT_POSTS_KEY_BY_POST_ID)
+            pushed, digested = dispatch_entry(feed_config.name, normalized, entry_key, matcher, user_subscriptions,
+                                              jobs, duplicate_feeds(feed_config.name, normalized, entry_key))
+            new_posts_pushed += pushed
+            new_posts_digested += digested
+            sent_posts_store.add(entry.link)
+    finally:
+        persist_dispatched(jobs, lambda: flush_processed(sent_posts_store))
+
+    feed_fetcher.commit(fetch_result)
+    log_dispatch_summary(feed_config.name, len(new_entries), new_posts_pushed, new_posts_digested)
+    return len(new_entries)
 
-                send_this_post = False
-                keyword_filter_is_active = config.get("keyword_filter_active", True)
+def check_rss_and_send_to_users(context: CallbackContext):
+    """调度任务：并行抓取所有已到检查时间的 feed，再依次匹配并推送。"""
+    global last_scheduler_tick
+    last_scheduler_tick = time.time()
+    due_feeds = feed_registry.claim_due_feeds()
+    if not due_feeds:
+        return
 
-                if not keyword_filter_is_active:
-                    send_this_post = True
-                    logger.info(f"关键词过滤已为用户 {user_id_str} 关闭。准备发送帖子 '{post_title}'。")
-                else:
-                    if not config.get("keywords"):
-                        logger.info(f"关键词过滤为用户 {user_id_str} 开启，但其没有设置关键词。跳过帖子 '{post_title}'。")
-                    else:
-                        for keyword in config["keywords"]:
-                            if keyword.lower() in post_title.lower():
-                                send_this_post = True
-                                logger.info(f"帖子 '{post_title}' 匹配到用户 {user_id_str} 的关键词 '{keyword}'。")
-                                break
-
-                if send_this_post:
-                    escaped_post_title = telegram.utils.helpers.escape_markdown(post_title, version=2)
-                    message_text = f"*{escaped_post_title}*\n\n{post_link}"
-                    try:
-                        context.bot.send_message(chat_id=user_chat_id,
-                                                 text=message_text,
-                                                 parse_mode=telegram.ParseMode.MARKDOWN_V2)
-                        logger.info(f"成功发送帖子 '{post_title}' 给用户 {user_id_str}")
-                        new_posts_pushed_this_cycle += 1
-                        time.sleep(1)
-                    except telegram.error.BadRequest as e_badreq:
-                        logger.error(f"发送给用户 {user_id_str} 的帖子 '{post_title}' 失败 (BadRequest): {e_badreq}")
-                        if "can't parse entities" in str(e_badreq).lower():
-                            logger.info(f"尝试为用户 {user_id_str} 发送纯文本版本的帖子 '{post_title}'")
-                            try:
-                                context.bot.send_message(chat_id=user_chat_id, text=f"{post_title}\n\n{post_link}")
-                                new_posts_pushed_this_cycle += 1
-                            except Exception as e_plain:
-                                 logger.error(f"向用户 {user_id_str} 发送纯文本帖子 '{post_title}' 也失败: {e_plain}", exc_info=True)
-                    except telegram.error.ChatMigrated as e_mig:
-                        logger.warning(f"用户 {user_id_str} 的聊天已迁移。旧 chat_id: {user_chat_id}, 新 chat_id: {e_mig.new_chat_id}。")
-                        user_subscriptions[user_id_str]['chat_id'] = e_mig.new_chat_id
-                        subscriptions_modified_due_to_send_failure = True
-                    except (telegram.error.Forbidden, telegram.error.Unauthorized) as e_auth:
-                        logger.warning(f"用户 {user_id_str} (chat_id: {user_chat_id}) 已屏蔽机器人或账户已停用: {e_auth}。将禁用其通知。")
-                        user_subscriptions[user_id_str]['enabled'] = False
-                        subscriptions_modified_due_to_send_failure = True
-                    except Exception as e_send:
-                        logger.error(f"向用户 {user_id_str} 发送帖子 '{post_title}' 时发生未知错误: {e_send}", exc_info=True)
-
-            globally_sent_posts_links.add(post_link)
-            save_sent_post_global(post_link)
-
-        if subscriptions_modified_due_to_send_failure:
-            save_user_subscriptions(user_subscriptions)
-
-        if new_posts_pushed_this_cycle == 0:
-            logger.info("本轮检查没有发现符合任何用户条件的新帖子。")
-
-    except Exception as e:
-        logger.error(f"RSS 检查/发送循环中发生一般性错误: {e}", exc_info=True)
-        if ADMIN_CHAT_ID:
+    cycle_started = time.perf_counter()
+    subscriptions_version, user_subscriptions = subscription_store.snapshot()
+    if shard_pool is not None:
+        shard_pool.ensure_running()
+        shard_pool.update_subscriptions(subscriptions_version, user_subscriptions)
+    logger.info(f"正在检查 RSS feed: {', '.join(feed.name for feed in due_feeds)}，准备向订阅用户推送。")
+
+    futures = {feed_fetch_executor.submit(feed_fetcher.fetch, feed.url): feed for feed in due_feeds}
+    total_new_entries = 0
+    failed_feeds = 0
+    for future in as_completed(futures):
+        feed_config = futures[future]
+        try:
             try:
-                context.bot.send_message(chat_id=ADMIN_CHAT_ID, text=f"RSS 机器人严重错误 (主循环): {e}")
-            except Exception as e_admin_crit:
-                logger.error(f"向管理员发送严重错误通知失败: {e_admin_crit}", exc_info=True)
+                fetch_result = future.result()
+            except (urllib.error.URLError, OSError, ValueError) as e_fetch:
+                raise FeedError(f"获取 RSS feed {feed_config.name} ({feed_config.url}) 时出错: {e_fetch}")
+            new_entries = process_feed(context, feed_config, fetch_result, subscriptions_version, user_subscriptions)
+            total_new_entries += new_entries
+            delay = feed_registry.record_success(feed_config.name, new_entries)
+            if ADAPTIVE_POLLING:
+                logger.info(f"feed {feed_config.name} 下次检查将在 {delay:.0f} 秒后。")
+        except FeedError as e_feed:
+            failed_feeds += 1
+            FEED_ERRORS.labels(feed_config.name).inc()
+            delay = feed_registry.record_failure(feed_config.name)
+            logger.error(f"{e_feed}。{delay:.0f} 秒后重试。")
+            notify_admin(context, f"RSS 机器人警告: {e_feed}")
+        except Exception as e:
+            failed_feeds += 1
+            FEED_ERRORS.labels(feed_config.name).inc()
+            feed_registry.record_failure(feed_config.name)
+            logger.error(f"RSS 检查/发送循环中发生一般性错误 (feed {feed_config.name}): {e}", exc_info=True)
+            notify_admin(context, f"RSS 机器人严重错误 (主循环): {e}")
+    # 按条数触发的摘要无需等待定时任务
+    send_due_digests(user_subscriptions)
+    cycle_seconds = time.perf_counter() - cycle_started
+    CHECK_CYCLE_SECONDS.observe(cycle_seconds)
+    logger.info("本轮检查了 %d 个 feed (%d 个出错)，共 %d 个新帖子，用时 %.2f 秒。",
+                len(due_feeds), failed_feeds, total_new_entries, cycle_seconds,
+                extra={'feeds': len(due_feeds), 'failed_feeds': failed_feeds, 'new_entries': total_new_entries,
+                       'cycle_seconds': round(cycle_seconds, 3)})
 
 # --- Telegram 命令处理函数 ---
 def get_command_args_as_string(args: list) -> str:
@@ -228,36 +812,16 @@ def start_command(update: telegram.Update, context: CallbackContext):
         logger.info(f"用户 {user.username} ({user_id_str}) 尝试从非私聊 ({chat_id}) 执行 /start 命令。")
         return
 
-    subscriptions = load_user_subscriptions()
-    _, subscriptions, modified = get_user_config_and_subscriptions(user_id_str, chat_id, subscriptions)
+    with subscription_store.edit() as subscriptions:
+        _, subscriptions, modified = get_user_config_and_subscriptions(user_id_str, chat_id, subscriptions)
+        if modified:
+            subscription_store.mark_changed(user_id_str)
 
     if modified:
-        save_user_subscriptions(subscriptions)
         logger.info(f"用户 {user.username} ({user_id_str}) 初始化配置或更新了 chat_id 为 {chat_id}。")
 
-    escaped_first_name = telegram.utils.helpers.escape_markdown(user.first_name or "用户", version=2)
-
-    line1 = f"👋 您好, {escaped_first_name}\\!" # 转义感叹号
-    line2 = telegram.utils.helpers.escape_markdown("\n我可以根据您设置的关键词，在 RSS 有新帖子时通知您。\n", version=2)
-    line3 = telegram.utils.helpers.escape_markdown("可用命令:", version=2)
-    
-    # 修正命令描述中的尖括号转义
-    commands_descriptions = [
-        f"/start \\- {telegram.utils.helpers.escape_markdown('显示此帮助信息', version=2)}",
-        f"/addkeyword \\<关键词或短语\\> \\- {telegram.utils.helpers.escape_markdown('添加关键词。', version=2)}", # 转义 < >
-        f"/delkeyword \\<关键词或短语 或 序号\\> \\- {telegram.utils.helpers.escape_markdown('删除关键词。', version=2)}", # 转义 < >
-        f"/editkeyword \\<序号\\> \\<新的关键词或短语\\> \\- {telegram.utils.helpers.escape_markdown('修改关键词。', version=2)}", # 转义 < >
-        f"/listkeywords \\- {telegram.utils.helpers.escape_markdown('显示您订阅的关键词。', version=2)}",
-        f"/togglefilter \\- {telegram.utils.helpers.escape_markdown('切换关键词过滤模式 (开/关)。', version=2)}",
-        f"/enablenotifications \\- {telegram.utils.helpers.escape_markdown('开启所有来自此机器人的通知。', version=2)}",
-        f"/disablenotifications \\- {telegram.utils.helpers.escape_markdown('关闭所有来自此机器人的通知。', version=2)}",
-        f"/myrssstatus \\- {telegram.utils.helpers.escape_markdown('查看您当前的订阅状态。', version=2)}"
-    ]
-    
-    line_last = telegram.utils.helpers.escape_markdown("\n我会定期检查新帖子！", version=2) # 转义感叹号
-
-    help_message_parts = [line1, line2, line3] + commands_descriptions + [line_last]
-    final_message = "\n".join(help_message_parts)
+    escaped_first_name = md(user.first_name or "用户")
+    final_message = f"👋 您好, {escaped_first_name}\\!\n{START_HELP_BODY}" # 转义感叹号
 
     update.message.reply_text(final_message, parse_mode=telegram.ParseMode.MARKDOWN_V2)
 
@@ -272,20 +836,36 @@ def add_keyword_command(update: telegram.Update, context: CallbackContext):
     if not keyword_to_add:
         update.message.reply_text("使用方法: /addkeyword <关键词或短语>")
         return
+    try:
+        parse_rule(keyword_to_add)
+    except ValueError as e:
+        update.message.reply_text(f"⚠️ 关键词规则无效: {e}")
+        return
 
-    subscriptions = load_user_subscriptions()
-    user_config, subscriptions, modified_by_get = get_user_config_and_subscriptions(user_id_str, chat_id, subscriptions)
+    rejected = None
+    with subscription_store.edit() as subscriptions:
+        user_config, subscriptions, modified_by_get = get_user_config_and_subscriptions(user_id_str, chat_id, subscriptions)
+        keyword_added = keyword_to_add.lower() not in [kw.lower() for kw in user_config['keywords']]
+        if keyword_added:
+            try:
+                check_regex_rule_count(user_config['keywords'] + [keyword_to_add])
+            except ValueError as e:
+                rejected = e
+                keyword_added = False
+        if keyword_added:
+            user_config['keywords'].append(keyword_to_add)
+            user_config['keywords'].sort()
+        if keyword_added or modified_by_get:
+            subscription_store.mark_changed(user_id_str)
+
+    if rejected is not None:
+        update.message.reply_text(f"⚠️ 关键词规则无效: {rejected}")
+        return
 
-    if keyword_to_add.lower() not in [kw.lower() for kw in user_config['keywords']]:
-        user_config['keywords'].append(keyword_to_add)
-        user_config['keywords'].sort()
-        subscriptions[user_id_str] = user_config
-        save_user_subscriptions(subscriptions)
-        escaped_keyword_to_add = telegram.utils.helpers.escape_markdown(keyword_to_add, version=2)
+    escaped_keyword_to_add = md(keyword_to_add)
+    if keyword_added:
         update.message.reply_text(f"✅ 关键词 '{escaped_keyword_to_add}' 已添加到您的列表。", parse_mode=telegram.ParseMode.MARKDOWN_V2)
     else:
-        if modified_by_get: save_user_subscriptions(subscriptions)
-        escaped_keyword_to_add = telegram.utils.helpers.escape_markdown(keyword_to_add, version=2)
         update.message.reply_text(f"⚠️ 关键词 '{escaped_keyword_to_add}' 已经存在于您的列表中。", parse_mode=telegram.ParseMode.MARKDOWN_V2)
 
 def list_keywords_command(update: telegram.Update, context: CallbackContext):
@@ -294,16 +874,15 @@ def list_keywords_command(update: telegram.Update, context: CallbackContext):
     chat_id = update.effective_chat.id
     if chat_id != user.id: return
 
-    subscriptions = load_user_subscriptions()
-    user_config, subscriptions, modified_by_get = get_user_config_and_subscriptions(user_id_str, chat_id, subscriptions)
-    if modified_by_get: save_user_subscriptions(subscriptions)
+    with subscription_store.edit() as subscriptions:
+        user_config, subscriptions, modified_by_get = get_user_config_and_subscriptions(user_id_str, chat_id, subscriptions)
+        if modified_by_get: subscription_store.mark_changed(user_id_str)
+        keywords = list(user_config['keywords'])
 
-    if not user_config['keywords']:
-        update.message.reply_text(telegram.utils.helpers.escape_markdown("您还没有设置任何关键词。使用 /addkeyword 命令来添加吧！", version=2), parse_mode=telegram.ParseMode.MARKDOWN_V2)
+    if not keywords:
+        update.message.reply_text(NO_KEYWORDS_TEXT, parse_mode=telegram.ParseMode.MARKDOWN_V2)
     else:
-        message_parts = [telegram.utils.helpers.escape_markdown("您当前订阅的关键词 (匹配时不区分大小写):", version=2)]
-        for i, kw in enumerate(user_config['keywords']):
-            message_parts.append(f"  {i+1}\\. {telegram.utils.helpers.escape_markdown(kw, version=2)}")
+        message_parts = [KEYWORDS_HEADER] + numbered_keywords(keywords)
         update.message.reply_text("\n".join(message_parts), parse_mode=telegram.ParseMode.MARKDOWN_V2)
 
 def del_keyword_command(update: telegram.Update, context: CallbackContext):
@@ -317,56 +896,44 @@ def del_keyword_command(update: telegram.Update, context: CallbackContext):
         update.message.reply_text("使用方法: /delkeyword <关键词或短语 或 /listkeywords 显示的序号>")
         return
 
-    subscriptions = load_user_subscriptions()
-    user_config, subscriptions, modified_by_get = get_user_config_and_subscriptions(user_id_str, chat_id, subscriptions)
-
-    if not user_config['keywords']:
-        if modified_by_get: save_user_subscriptions(subscriptions)
-        update.message.reply_text("您没有任何关键词可以删除。")
-        return
+    deleted_keyword_value = None
+    invalid_index = False
 
-    keyword_deleted = False
-    deleted_keyword_value = "" 
-    display_deleted_keyword_value = "" 
+    with subscription_store.edit() as subscriptions:
+        user_config, subscriptions, modified_by_get = get_user_config_and_subscriptions(user_id_str, chat_id, subscriptions)
+        if modified_by_get: subscription_store.mark_changed(user_id_str)
+        has_keywords = bool(user_config['keywords'])
 
-    if arg_input.isdigit():
-        try:
+        if has_keywords and arg_input.isdigit():
             index_to_delete = int(arg_input) - 1
             if 0 <= index_to_delete < len(user_config['keywords']):
                 deleted_keyword_value = user_config['keywords'].pop(index_to_delete)
-                display_deleted_keyword_value = telegram.utils.helpers.escape_markdown(deleted_keyword_value, version=2)
-                keyword_deleted = True
             else:
-                update.message.reply_text(f"⚠️ 无效的序号。请使用 /listkeywords 查看可用的关键词序号。")
-                if modified_by_get: save_user_subscriptions(subscriptions)
-                return
-        except ValueError:
-            pass
-    
-    if not keyword_deleted:
-        keyword_to_delete_lower = arg_input.lower()
-        temp_keywords = []
-        found_kw_original_case = None
-        for kw_val in user_config['keywords']:
-            if kw_val.lower() == keyword_to_delete_lower and found_kw_original_case is None:
-                found_kw_original_case = kw_val
-            else:
-                temp_keywords.append(kw_val)
-        
-        if found_kw_original_case:
-            user_config['keywords'] = temp_keywords
-            keyword_deleted = True
-            deleted_keyword_value = found_kw_original_case
-            display_deleted_keyword_value = telegram.utils.helpers.escape_markdown(deleted_keyword_value, version=2)
-        else:
-            escaped_arg_input = telegram.utils.helpers.escape_markdown(arg_input, version=2)
-            update.message.reply_text(f"⚠️ 未在您的订阅列表中找到关键词 '{escaped_arg_input}'。", parse_mode=telegram.ParseMode.MARKDOWN_V2)
-            if modified_by_get: save_user_subscriptions(subscriptions)
-            return
+                invalid_index = True
+
+        if has_keywords and deleted_keyword_value is None and not invalid_index:
+            keyword_to_delete_lower = arg_input.lower()
+            temp_keywords = []
+            for kw_val in user_config['keywords']:
+                if kw_val.lower() == keyword_to_delete_lower and deleted_keyword_value is None:
+                    deleted_keyword_value = kw_val
+                else:
+                    temp_keywords.append(kw_val)
+            if deleted_keyword_value is not None:
+                user_config['keywords'] = temp_keywords
+
+        if deleted_keyword_value is not None:
+            subscription_store.mark_changed(user_id_str)
 
-    if keyword_deleted:
-        subscriptions[user_id_str] = user_config
-        save_user_subscriptions(subscriptions)
+    if not has_keywords:
+        update.message.reply_text("您没有任何关键词可以删除。")
+    elif invalid_index:
+        update.message.reply_text(f"⚠️ 无效的序号。请使用 /listkeywords 查看可用的关键词序号。")
+    elif deleted_keyword_value is None:
+        escaped_arg_input = md(arg_input)
+        update.message.reply_text(f"⚠️ 未在您的订阅列表中找到关键词 '{escaped_arg_input}'。", parse_mode=telegram.ParseMode.MARKDOWN_V2)
+    else:
+        display_deleted_keyword_value = md(deleted_keyword_value)
         update.message.reply_text(f"🗑️ 关键词 '{display_deleted_keyword_value}' 已从您的订阅列表中移除。", parse_mode=telegram.ParseMode.MARKDOWN_V2)
 
 
@@ -381,43 +948,51 @@ def edit_keyword_command(update: telegram.Update, context: CallbackContext):
         update.message.reply_text("使用方法: /editkeyword <序号> <新的关键词或短语>\n(序号来自 /listkeywords 命令)")
         return
 
-    subscriptions = load_user_subscriptions()
-    user_config, subscriptions, modified_by_get = get_user_config_and_subscriptions(user_id_str, chat_id, subscriptions)
-
-    if not user_config['keywords']:
-        if modified_by_get: save_user_subscriptions(subscriptions)
-        update.message.reply_text("您没有任何关键词可以修改。")
+    try:
+        index_to_edit = int(args[0]) - 1
+    except ValueError:
+        update.message.reply_text("⚠️ 第一个参数 (序号) 必须是 /listkeywords 命令显示的有效数字。")
         return
 
+    new_keyword_phrase = " ".join(args[1:]).strip()
+    if not new_keyword_phrase:
+        update.message.reply_text("⚠️ 新的关键词或短语不能为空。")
+        return
     try:
-        index_to_edit = int(args[0]) - 1
-        new_keyword_phrase = " ".join(args[1:]).strip()
+        parse_rule(new_keyword_phrase)
+    except ValueError as e:
+        update.message.reply_text(f"⚠️ 关键词规则无效: {e}")
+        return
 
-        if not new_keyword_phrase:
-            update.message.reply_text("⚠️ 新的关键词或短语不能为空。")
-            if modified_by_get: save_user_subscriptions(subscriptions)
-            return
+    old_keyword = None
+    rejected = None
+    with subscription_store.edit() as subscriptions:
+        user_config, subscriptions, modified_by_get = get_user_config_and_subscriptions(user_id_str, chat_id, subscriptions)
+        if modified_by_get: subscription_store.mark_changed(user_id_str)
+        has_keywords = bool(user_config['keywords'])
 
         if 0 <= index_to_edit < len(user_config['keywords']):
-            old_keyword = user_config['keywords'][index_to_edit]
-            user_config['keywords'][index_to_edit] = new_keyword_phrase
-            user_config['keywords'].sort()
-            subscriptions[user_id_str] = user_config
-            save_user_subscriptions(subscriptions)
-            
-            escaped_old_keyword = telegram.utils.helpers.escape_markdown(old_keyword, version=2)
-            escaped_new_keyword = telegram.utils.helpers.escape_markdown(new_keyword_phrase, version=2)
-            update.message.reply_text(f"🔄 关键词 '{escaped_old_keyword}' (序号 {index_to_edit + 1}) 已成功修改为 '{escaped_new_keyword}'。", parse_mode=telegram.ParseMode.MARKDOWN_V2)
-        else:
-            update.message.reply_text(f"⚠️ 无效的序号。请使用 /listkeywords 查看可用的关键词序号。")
-            if modified_by_get: save_user_subscriptions(subscriptions)
-    except ValueError:
-        update.message.reply_text("⚠️ 第一个参数 (序号) 必须是 /listkeywords 命令显示的有效数字。")
-        if modified_by_get: save_user_subscriptions(subscriptions)
-    except Exception as e:
-        logger.error(f"用户 {user_id_str} 执行 /editkeyword 时发生错误: {e}", exc_info=True)
-        update.message.reply_text("修改关键词时发生了一个预期之外的错误，请稍后再试。")
-        if modified_by_get: save_user_subscriptions(subscriptions)
+            edited = list(user_config['keywords'])
+            edited[index_to_edit] = new_keyword_phrase
+            try:
+                check_regex_rule_count(edited)
+            except ValueError as e:
+                rejected = e
+            else:
+                old_keyword = user_config['keywords'][index_to_edit]
+                user_config['keywords'] = sorted(edited)
+                subscription_store.mark_changed(user_id_str)
+
+    if rejected is not None:
+        update.message.reply_text(f"⚠️ 关键词规则无效: {rejected}")
+    elif not has_keywords:
+        update.message.reply_text("您没有任何关键词可以修改。")
+    elif old_keyword is None:
+        update.message.reply_text(f"⚠️ 无效的序号。请使用 /listkeywords 查看可用的关键词序号。")
+    else:
+        escaped_old_keyword = md(old_keyword)
+        escaped_new_keyword = md(new_keyword_phrase)
+        update.message.reply_text(f"🔄 关键词 '{escaped_old_keyword}' (序号 {index_to_edit + 1}) 已成功修改为 '{escaped_new_keyword}'。", parse_mode=telegram.ParseMode.MARKDOWN_V2)
 
 def toggle_notifications_command(update: telegram.Update, context: CallbackContext, enable: bool):
     """通用函数，用于开启或关闭用户的通知 (已修正转义)。"""
@@ -426,21 +1001,14 @@ def toggle_notifications_command(update: telegram.Update, context: CallbackConte
     chat_id = update.effective_chat.id
     if chat_id != user.id: return
 
-    subscriptions = load_user_subscriptions()
-    user_config, subscriptions, _ = get_user_config_and_subscriptions(user_id_str, chat_id, subscriptions)
-
-    user_config['enabled'] = enable
-    subscriptions[user_id_str] = user_config
-    save_user_subscriptions(subscriptions)
+    with subscription_store.edit() as subscriptions:
+        user_config, subscriptions, _ = get_user_config_and_subscriptions(user_id_str, chat_id, subscriptions)
+        user_config['enabled'] = enable
+        subscription_store.mark_changed(user_id_str)
+    if enable and delivery_queue:
+        delivery_queue.unblock_chat(chat_id)
 
-    status_message_unescaped = "开启" if enable else "关闭"
-    escaped_status_message = telegram.utils.helpers.escape_markdown(status_message_unescaped, version=2)
-    icon = "🔔" if enable else "🔕"
-
-    prefix_text_unescaped = "您(来自此机器人的)所有通知已设为 "
-    escaped_prefix_text = telegram.utils.helpers.escape_markdown(prefix_text_unescaped, version=2)
-    
-    update.message.reply_text(f"{icon} {escaped_prefix_text}**{escaped_status_message}**。", parse_mode=telegram.ParseMode.MARKDOWN_V2)
+    update.message.reply_text(NOTIFICATIONS_TEXT[enable], parse_mode=telegram.ParseMode.MARKDOWN_V2)
 
 
 def enable_notifications_command(update: telegram.Update, context: CallbackContext):
@@ -456,75 +1024,278 @@ def toggle_filter_command(update: telegram.Update, context: CallbackContext):
     chat_id = update.effective_chat.id
     if chat_id != user.id: return
 
-    subscriptions = load_user_subscriptions()
-    user_config, subscriptions, modified_by_get = get_user_config_and_subscriptions(user_id_str, chat_id, subscriptions)
-
-    current_filter_state = user_config.get("keyword_filter_active", True)
-    user_config["keyword_filter_active"] = not current_filter_state
-    
-    subscriptions[user_id_str] = user_config
-    save_user_subscriptions(subscriptions)
+    with subscription_store.edit() as subscriptions:
+        user_config, subscriptions, modified_by_get = get_user_config_and_subscriptions(user_id_str, chat_id, subscriptions)
+        filter_active = not user_config.get("keyword_filter_active", True)
+        user_config["keyword_filter_active"] = filter_active
+        subscription_store.mark_changed(user_id_str)
 
-    if user_config["keyword_filter_active"]:
-        state_description_unescaped = "开启 (仅推送匹配关键词的帖子)"
-    else:
-        state_description_unescaped = "关闭 (推送所有帖子)"
-    
-    escaped_state_description = telegram.utils.helpers.escape_markdown(state_description_unescaped, version=2)
-    icon = "🔎" if user_config["keyword_filter_active"] else "📢"
-    
-    note_unescaped = "（请注意：总体通知开关 /enablenotifications 必须也为开启状态才会收到推送。）"
-    note_standard_parentheses = note_unescaped.replace("（", "(").replace("）", ")")
-    escaped_note = telegram.utils.helpers.escape_markdown(note_standard_parentheses, version=2)
-
-    message_to_send = (f"{icon} 您的关键词过滤模式已更新为: **{escaped_state_description}**。\n"
-                       f"{escaped_note}")
-
-    update.message.reply_text(message_to_send,
+    update.message.reply_text(FILTER_TOGGLED_TEXT[filter_active],
                               parse_mode=telegram.ParseMode.MARKDOWN_V2)
 
+def post_status_lines(user_id_str: str, user_config: dict, query: str) -> list:
+    """/myrssstatus <帖子 ID 或链接>：说明该帖子是否推送给了用户。"""
+    key = post_key(query, SENT_POSTS_KEY_BY_POST_ID)
+    records = delivery_history.find(user_id_str, key)
+    if records:
+        return [md(f"🧾 帖子 {key} 的推送记录:")] + [history_line(record) for record in records]
+    if any(key in store for store in sent_posts_stores.values()):
+        lines = [md(f"🧾 帖子 {key} 已被检查过，但没有推送给您: 它没有匹配您的关键词、匹配范围或订阅的 feed，"
+                    f"或者推送记录已超出保留范围 (最近 {DELIVERY_HISTORY_PER_USER} 条)。")]
+        if not user_config.get('enabled', True):
+            lines.append(md("您的总体通知当前为关闭状态，关闭期间的帖子不会推送。"))
+        return lines
+    return [md(f"🧾 还没有检查到帖子 {key}。新帖子会在下一次检查 RSS 时处理，请稍后再试。")]
+
 def my_rss_status_command(update: telegram.Update, context: CallbackContext):
-    """处理 /myrssstatus 命令，显示用户的当前订阅状态和关键词 (已修正转义)。"""
+    """
+    处理 /myrssstatus 命令，显示用户的当前订阅状态、关键词和最近的推送记录 (已修正转义)。
+    带参数时只说明指定的帖子是否推送给了用户。
+    """
     user = update.effective_user
     user_id_str = str(user.id)
     chat_id = update.effective_chat.id
     if chat_id != user.id: return
 
-    subscriptions = load_user_subscriptions()
-    user_config, subscriptions, modified_by_get = get_user_config_and_subscriptions(user_id_str, chat_id, subscriptions)
-    if modified_by_get: save_user_subscriptions(subscriptions)
+    with subscription_store.edit() as subscriptions:
+        user_config, subscriptions, modified_by_get = get_user_config_and_subscriptions(user_id_str, chat_id, subscriptions)
+        if modified_by_get: subscription_store.mark_changed(user_id_str)
+        user_config = subscription_store.get_user(user_id_str)
+
+    query = get_command_args_as_string(context.args)
+    if query:
+        update.message.reply_text("\n".join(post_status_lines(user_id_str, user_config, query)),
+                                  parse_mode=telegram.ParseMode.MARKDOWN_V2)
+        return
 
-    enabled_status_text_unescaped = "开启" if user_config.get('enabled', True) else "关闭"
-    escaped_enabled_status_text = telegram.utils.helpers.escape_markdown(enabled_status_text_unescaped, version=2)
-    enabled_icon = "🔔" if user_config.get('enabled', True) else "🔕"
-    
     filter_active = user_config.get('keyword_filter_active', True)
-    filter_status_text_part_unescaped = "开启 (仅关键词)" if filter_active else "关闭 (所有帖子)"
-    escaped_filter_status_text_part = telegram.utils.helpers.escape_markdown(filter_status_text_part_unescaped, version=2)
-    filter_icon = "🔎" if filter_active else "📢"
-    
     message_parts = [
-        telegram.utils.helpers.escape_markdown("ℹ️ 您当前的 RSS 订阅状态:", version=2),
-        f"{enabled_icon} {telegram.utils.helpers.escape_markdown('总体通知: ', version=2)}**{escaped_enabled_status_text}**",
-        f"{filter_icon} {telegram.utils.helpers.escape_markdown('关键词过滤: ', version=2)}**{escaped_filter_status_text_part}**",
-        "" 
+        STATUS_HEADER,
+        STATUS_ENABLED_LINE[user_config.get('enabled', True)],
+        STATUS_FILTER_LINE[filter_active],
     ]
-    
+    if len(feed_registry.feeds) > 1:
+        subscribed_feeds = [name for name in feed_registry.names() if user_wants_feed(user_config, name)]
+        feeds_text = ", ".join(subscribed_feeds) if subscribed_feeds else "无"
+        message_parts.append(f"📡 {md('订阅的 feed: ' + feeds_text)}")
+    fields_text = ", ".join(FIELD_LABELS[field] for field in user_match_fields(user_config))
+    message_parts.append(f"🔍 {md('匹配范围: ' + fields_text)}")
+    message_parts.append(f"🗞 {md('摘要模式: ' + describe_digest(user_config.get('digest')))}")
+    message_parts.append("")
+
     if not user_config['keywords']:
-        message_parts.append(telegram.utils.helpers.escape_markdown("📜 关键词列表: 您还没有设置任何关键词。", version=2))
+        message_parts.append(STATUS_NO_KEYWORDS)
     else:
-        keywords_list_str = telegram.utils.helpers.escape_markdown("📜 您已设置的关键词 (匹配时不区分大小写):", version=2) + "\n"
-        for i, kw in enumerate(user_config['keywords']):
-            keywords_list_str += f"  {i+1}\\. {telegram.utils.helpers.escape_markdown(kw, version=2)}\n"
-        message_parts.append(keywords_list_str.strip())
-    
+        message_parts.append("\n".join([STATUS_KEYWORDS_HEADER] + numbered_keywords(user_config['keywords'])))
+
     if filter_active and not user_config['keywords']:
-        tip_unescaped = "提示: 当前关键词过滤已开启，但您没有设置任何关键词，因此不会收到任何帖子。请添加关键词或使用 /togglefilter 关闭过滤以接收所有帖子。"
-        escaped_tip = telegram.utils.helpers.escape_markdown(tip_unescaped, version=2)
-        message_parts.append(f"\n**⚠️** {escaped_tip}")
-        
+        message_parts.append(STATUS_NO_KEYWORDS_TIP)
+
+    history = delivery_history.recent(user_id_str, DELIVERY_HISTORY_SHOWN)
+    message_parts.append("")
+    message_parts.append("\n".join([STATUS_HISTORY_HEADER] + [history_line(record) for record in history])
+                         if history else STATUS_NO_HISTORY)
+
     update.message.reply_text("\n".join(message_parts), parse_mode=telegram.ParseMode.MARKDOWN_V2)
 
+def broadcast_command(update: telegram.Update, context: CallbackContext):
+    """
+    处理 /broadcast 命令 (仅管理员)：/broadcast <消息> 向所有开启通知的用户发送消息 (保留换行，按纯文本发送)；
+    /broadcast status 查看最近一次广播的进度；/broadcast cancel 停止正在进行的广播。
+    """
+    if not ADMIN_CHAT_ID or str(update.effective_chat.id) != str(ADMIN_CHAT_ID): return
+
+    parts = (update.message.text or '').split(None, 1)
+    text = parts[1].strip() if len(parts) > 1 else ''
+    if not text:
+        update.message.reply_text("用法: /broadcast <消息>，向所有开启通知的用户发送消息。\n"
+                                  "/broadcast status 查看进度，/broadcast cancel 停止正在进行的广播。")
+        return
+    if text.lower() == 'status':
+        broadcast = broadcasts.latest()
+        update.message.reply_text(describe_progress(broadcast) if broadcast else "还没有发送过广播。")
+        return
+    if text.lower() == 'cancel':
+        broadcast = broadcasts.cancel()
+        broadcasts.save()
+        update.message.reply_text(describe_progress(broadcast) if broadcast else "没有正在进行的广播。")
+        return
+    if len(text) > MAX_MESSAGE_LENGTH:
+        update.message.reply_text(f"消息过长 ({len(text)} 个字符)，Telegram 单条消息最多 {MAX_MESSAGE_LENGTH} 个字符。")
+        return
+
+    _, user_subscriptions = subscription_store.snapshot()
+    user_ids = [user_id_str for user_id_str, config in user_subscriptions.items()
+                if config.get('enabled', True) and config.get('chat_id')]
+    broadcast = broadcasts.start(text, user_ids, update.effective_chat.id)
+    broadcasts.save()
+    logger.info(f"管理员开始了广播 #{broadcast['id']}，共 {len(user_ids)} 个用户。")
+    message = update.message.reply_text(describe_progress(broadcast))
+    broadcasts.set_status_message(broadcast['id'], message.message_id)
+    broadcast_reported_at[broadcast['id']] = time.time()
+    broadcasts.save()
+
+def stats_command(update: telegram.Update, context: CallbackContext):
+    """处理 /stats 命令 (仅管理员)：显示用户数、队列长度，以及最近的发送速率与耗时。"""
+    if not ADMIN_CHAT_ID or str(update.effective_chat.id) != str(ADMIN_CHAT_ID): return
+
+    _, user_subscriptions = subscription_store.snapshot()
+    enabled = sum(1 for config in user_subscriptions.values() if config.get('enabled', True))
+    digest_users = sum(1 for config in user_subscriptions.values() if config.get('digest'))
+    message_parts = [
+        "📊 推送统计",
+        f"用户: 共 {len(user_subscriptions)} 个，开启通知 {enabled} 个，摘要模式 {digest_users} 个",
+        f"发送队列: {delivery_queue.pending() if delivery_queue else 0} 条待发送，发件箱中 {outbox.pending_count()} 条未确认",
+        "",
+    ]
+    for minutes in (1, 5, 60):
+        summary = send_stats.summary(minutes)
+        message_parts.append(f"最近 {minutes} 分钟: 发送 {summary['sent']} 条 ({summary['per_minute']:.1f} 条/分钟)，"
+                             f"失败 {summary['failed']}，重试 {summary['retried']}")
+    summary = send_stats.summary(60)
+    message_parts.append("")
+    message_parts.append(f"Telegram 请求耗时 (最近 60 分钟): p50 {describe_bound(summary['api_p50'], API_BUCKETS)}，"
+                         f"p95 {describe_bound(summary['api_p95'], API_BUCKETS)}")
+    message_parts.append(f"从匹配到送达: p50 {describe_bound(summary['latency_p50'], LATENCY_BUCKETS)}，"
+                         f"p95 {describe_bound(summary['latency_p95'], LATENCY_BUCKETS)}")
+    totals = send_stats.totals
+    uptime_minutes = (time.time() - send_stats.started_at) // 60
+    message_parts.append(f"启动以来 ({uptime_minutes // 60:.0f} 小时 {uptime_minutes % 60:.0f} 分钟): "
+                         f"发送 {totals['sent']} 条，失败 {totals['failed']}，重试 {totals['retried']}")
+    for broadcast in broadcasts.unfinished():
+        message_parts.append(describe_progress(broadcast))
+    update.message.reply_text("\n".join(message_parts))
+
+
+def list_feeds_command(update: telegram.Update, context: CallbackContext):
+    """处理 /feeds 命令，列出所有可订阅的 feed 及用户的订阅状态。"""
+    user = update.effective_user
+    user_id_str = str(user.id)
+    chat_id = update.effective_chat.id
+    if chat_id != user.id: return
+
+    user_config = subscription_store.get_user(user_id_str) or {}
+    message_parts = ["可订阅的 feed (未单独设置时默认订阅全部):"]
+    for feed_config in feed_registry.feeds.values():
+        icon = "✅" if user_wants_feed(user_config, feed_config.name) else "⬜"
+        message_parts.append(f"{icon} {feed_config.name} - {feed_config.title}")
+    message_parts.append("\n使用 /subscribefeed <名称> 或 /unsubscribefeed <名称> 修改订阅。")
+    update.message.reply_text("\n".join(message_parts))
+
+def set_feed_subscription_command(update: telegram.Update, context: CallbackContext, subscribe: bool):
+    """通用函数，用于订阅或退订单个 feed。"""
+    user = update.effective_user
+    user_id_str = str(user.id)
+    chat_id = update.effective_chat.id
+    if chat_id != user.id: return
+
+    feed_name = get_command_args_as_string(context.args)
+    command_name = "subscribefeed" if subscribe else "unsubscribefeed"
+    if not feed_name:
+        update.message.reply_text(f"使用方法: /{command_name} <feed 名称>\n(名称来自 /feeds 命令)")
+        return
+    if feed_registry.get(feed_name) is None:
+        update.message.reply_text(f"⚠️ 未知的 feed '{feed_name}'。请使用 /feeds 查看可用的 feed。")
+        return
+
+    with subscription_store.edit() as subscriptions:
+        user_config, subscriptions, _ = get_user_config_and_subscriptions(user_id_str, chat_id, subscriptions)
+        subscribed = [name for name in feed_registry.names() if user_wants_feed(user_config, name)]
+        if subscribe and feed_name not in subscribed:
+            subscribed.append(feed_name)
+        elif not subscribe and feed_name in subscribed:
+            subscribed.remove(feed_name)
+        # 订阅全部 feed 时不保存列表，这样以后新增的 feed 也会自动订阅
+        if len(subscribed) == len(feed_registry.feeds):
+            user_config.pop("feeds", None)
+        else:
+            user_config["feeds"] = subscribed
+        subscription_store.mark_changed(user_id_str)
+
+    if subscribe:
+        update.message.reply_text(f"✅ 已订阅 feed '{feed_name}'。")
+    elif not subscribed:
+        update.message.reply_text(f"🗑️ 已退订 feed '{feed_name}'。您当前没有订阅任何 feed，将不会收到推送。")
+    else:
+        update.message.reply_text(f"🗑️ 已退订 feed '{feed_name}'。")
+
+def subscribe_feed_command(update: telegram.Update, context: CallbackContext):
+    set_feed_subscription_command(update, context, True)
+
+def unsubscribe_feed_command(update: telegram.Update, context: CallbackContext):
+    set_feed_subscription_command(update, context, False)
+
+
+def match_fields_command(update: telegram.Update, context: CallbackContext):
+    """处理 /matchfields 命令：查看或设置关键词在哪些字段中匹配。"""
+    user = update.effective_user
+    user_id_str = str(user.id)
+    chat_id = update.effective_chat.id
+    if chat_id != user.id: return
+
+    available = ", ".join(f"{field} ({FIELD_LABELS[field]})" for field in MATCH_FIELDS)
+    new_fields = None
+    if context.args:
+        try:
+            new_fields = parse_match_fields(context.args)
+        except ValueError as e:
+            update.message.reply_text(f"⚠️ {e}")
+            return
+
+    with subscription_store.edit() as subscriptions:
+        user_config, subscriptions, modified_by_get = get_user_config_and_subscriptions(user_id_str, chat_id, subscriptions)
+        if new_fields is not None:
+            if new_fields == DEFAULT_MATCH_FIELDS:
+                user_config.pop("match_fields", None)
+            else:
+                user_config["match_fields"] = list(new_fields)
+        if modified_by_get or new_fields is not None:
+            subscription_store.mark_changed(user_id_str)
+        current_fields = user_match_fields(user_config)
+
+    fields_text = ", ".join(FIELD_LABELS[field] for field in current_fields)
+    if new_fields is None:
+        update.message.reply_text(f"🔍 您的关键词当前在以下字段中匹配: {fields_text}\n"
+                                  f"使用方法: /matchfields <字段...>，可用字段: {available}")
+    else:
+        update.message.reply_text(f"✅ 关键词匹配范围已更新为: {fields_text}")
+
+def digest_command(update: telegram.Update, context: CallbackContext):
+    """处理 /digest 命令：查看或设置摘要模式。"""
+    user = update.effective_user
+    user_id_str = str(user.id)
+    chat_id = update.effective_chat.id
+    if chat_id != user.id: return
+
+    usage = ("使用方法:\n"
+             "/digest off - 每个帖子单独推送\n"
+             "/digest count <N> - 累积 N 个帖子后合并推送\n"
+             "/digest every <时长> - 最早的帖子等待指定时长 (如 30m、2h) 后合并推送\n"
+             "/digest daily <HH:MM> - 每天在固定时间合并推送\n"
+             "count 与 every 可以同时使用，例如 /digest count 10 every 1h")
+    changed = bool(context.args)
+    if changed:
+        try:
+            new_settings = parse_digest_args(context.args)
+        except ValueError as e:
+            update.message.reply_text(f"⚠️ {e}\n{usage}")
+            return
+
+    with subscription_store.edit() as subscriptions:
+        user_config, subscriptions, modified_by_get = get_user_config_and_subscriptions(user_id_str, chat_id, subscriptions)
+        if changed:
+            if new_settings is None:
+                user_config.pop("digest", None)
+            else:
+                user_config["digest"] = new_settings
+        if modified_by_get or changed:
+            subscription_store.mark_changed(user_id_str)
+        current_settings = user_config.get("digest")
+
+    if not changed:
+        update.message.reply_text(f"🗞 摘要模式: {describe_digest(current_settings)}\n\n{usage}")
+    else:
+        update.message.reply_text(f"✅ 摘要模式已更新: {describe_digest(current_settings)}")
 
 def error_handler(update: object, context: CallbackContext) -> None:
     logger.error(f'Update "{update}" 造成错误 "{context.error}"', exc_info=context.error)
@@ -539,22 +1310,125 @@ def error_handler(update: object, context: CallbackContext) -> None:
         except Exception as e_admin_send:
             logger.error(f"向管理员 ({ADMIN_CHAT_ID}) 发送错误详情失败: {e_admin_send}", exc_info=True)
 
-# --- 主函数 ---
-def main():
-    if not TELEGRAM_BOT_TOKEN:
-        logger.critical("严重错误: 环境变量 TELEGRAM_BOT_TOKEN 未设置。机器人无法启动。")
-        return
-
-    logger.info("机器人正在启动...")
-    if ADMIN_CHAT_ID:
-        logger.info(f"管理员通知将发送到 Chat ID: {ADMIN_CHAT_ID}")
-    else:
-        logger.info("环境变量 ADMIN_CHAT_ID 未设置。管理员通知将仅记录到日志。")
+# --- 分片工作进程 ---
+def on_shard_event(event: tuple):
+    """主进程：处理工作进程上报的订阅变更 (订阅数据只由主进程修改)、推送记录与发送统计。"""
+    if event[0] == 'forbidden':
+        on_forbidden(event[1])
+    elif event[0] == 'chat_migrated':
+        on_chat_migrated(event[1], event[2])
+    elif event[0] == 'history':
+        delivery_history.add(event[1], DeliveryRecord.from_list(event[2]))
+    elif event[0] == 'stats' and event[1] in ForwardingStats.FORWARDED:
+        getattr(send_stats, event[1])(*event[2])
+
+def process_published_entries(feed_name: str, entries: list, subscriptions_version: int, user_subscriptions: dict):
+    """工作进程：匹配主进程发布的新帖子 (user_subscriptions 只包含本分片的用户) 并放入发送队列。"""
+    matcher = get_keyword_matcher(subscriptions_version, user_subscriptions)
+    new_posts_pushed = 0
+    new_posts_digested = 0
+    jobs = []
+    try:
+        for fields in entries:
+            entry = NormalizedEntry(fields['title'], fields['link'], fields['summary'], fields['categories'])
+            pushed, digested = dispatch_entry(feed_name, entry, fields['key'], matcher, user_subscriptions, jobs,
+                                              set(fields.get('skip_feeds', ())))
+            new_posts_pushed += pushed
+            new_posts_digested += digested
+    finally:
+        persist_dispatched(jobs)
+    log_dispatch_summary(feed_name, len(entries), new_posts_pushed, new_posts_digested)
+
+def run_shard_worker():
+    """工作进程入口：接收主进程发布的订阅与新帖子，负责本分片用户的匹配、摘要与发送。"""
+    logger.info(f"工作进程 {SHARD_INDEX}/{SHARD_COUNT} 正在启动...")
+    conn = connect_to_coordinator(SHARD_SOCKET, SHARD_AUTHKEY, SHARD_INDEX)
+    send_lock = threading.Lock()
+
+    def emit(*event):
+        with send_lock:
+            conn.send(event)
+
+    global delivery_queue, delivery_history
+    # 推送记录与发送统计由主进程汇总，/myrssstatus 和 /stats 在主进程中处理
+    delivery_history = ForwardingHistory(emit)
+    request = Request(con_pool_size=DELIVERY_WORKERS + 2)
+    # Telegram 的全局发送速率限制针对整个机器人，由各工作进程平分
+    tg_bot = telegram.Bot(TELEGRAM_BOT_TOKEN, base_url=TELEGRAM_API_BASE_URL, request=request)
+    delivery_queue = DeliveryQueue(tg_bot, workers=DELIVERY_WORKERS,
+                                   global_rate=GLOBAL_SEND_RATE / SHARD_COUNT, per_chat_rate=PER_CHAT_SEND_RATE,
+                                   on_chat_migrated=lambda user_id_str, chat_id: emit('chat_migrated', user_id_str, chat_id),
+                                   on_forbidden=lambda user_id_str: emit('forbidden', user_id_str),
+                                   on_delivered=on_delivered, on_failed=on_failed, outbox=outbox,
+                                   stats=ForwardingStats(emit),
+                                   max_attempts=OUTBOX_MAX_ATTEMPTS,
+                                   retry_base_delay=OUTBOX_RETRY_BASE_SECONDS,
+                                   retry_max_delay=OUTBOX_RETRY_MAX_SECONDS)
+    replayed = outbox.pending_jobs()
+    for job in replayed:
+        delivery_queue.submit(job, delay=max(0.0, job.next_attempt_at - time.time()))
+    if replayed:
+        logger.info(f"工作进程 {SHARD_INDEX} 已从发件箱重新投递 {len(replayed)} 条上次未确认送达的消息。")
+
+    # 处理新帖子与发送摘要都会写入摘要缓冲和发件箱，串行执行以保证确认前数据已经持久化
+    work_lock = threading.Lock()
+    state = {'version': None, 'subscriptions': {}}
+    stopped = threading.Event()
+
+    def digest_loop():
+        while not stopped.wait(DIGEST_CHECK_INTERVAL_SECONDS):
+            try:
+                with work_lock:
+                    send_due_digests(state['subscriptions'])
+            except Exception as e:
+                logger.error(f"工作进程 {SHARD_INDEX} 发送摘要时出错: {e}", exc_info=True)
 
-    updater = Updater(TELEGRAM_BOT_TOKEN, use_context=True)
-    dp = updater.dispatcher
-    jq = updater.job_queue
+    threading.Thread(target=digest_loop, name='digest', daemon=True).start()
+    try:
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                logger.warning(f"工作进程 {SHARD_INDEX} 与主进程的连接已断开，准备退出。")
+                break
+            if message[0] == 'subscriptions':
+                _, version, subscriptions = message
+                with work_lock:
+                    previous = state['subscriptions']
+                    state['version'], state['subscriptions'] = version, subscriptions
+                # 用户重新开启通知后，允许再次向其聊天发送消息
+                for user_id_str, config in subscriptions.items():
+                    if config.get('enabled') and not previous.get(user_id_str, {}).get('enabled'):
+                        delivery_queue.unblock_chat(config.get('chat_id'))
+            elif message[0] == 'entries':
+                _, batch_id, feed_name, entries = message
+                try:
+                    with work_lock:
+                        process_published_entries(feed_name, entries, state['version'], state['subscriptions'])
+                except Exception as e:
+                    logger.error(f"工作进程 {SHARD_INDEX} 处理 feed {feed_name} 的新帖子时出错: {e}", exc_info=True)
+                    emit('nack', batch_id)
+                else:
+                    emit('ack', batch_id)
+            elif message[0] == 'stop':
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stopped.set()
+        delivery_queue.stop()
+        outbox.close()
+        digest_buffer.flush()
+        if delivery_log:
+            delivery_log.flush()
+        if database:
+            database.close()
+        conn.close()
+        logger.info(f"工作进程 {SHARD_INDEX} 已停止。")
 
+# --- 主函数 ---
+def register_handlers(dp):
+    """注册所有命令处理函数。"""
     dp.add_handler(CommandHandler("start", start_command))
     dp.add_handler(CommandHandler("addkeyword", add_keyword_command))
     dp.add_handler(CommandHandler("listkeywords", list_keywords_command))
@@ -564,14 +1438,89 @@ def main():
     dp.add_handler(CommandHandler("enablenotifications", enable_notifications_command))
     dp.add_handler(CommandHandler("disablenotifications", disable_notifications_command))
     dp.add_handler(CommandHandler("myrssstatus", my_rss_status_command))
+    dp.add_handler(CommandHandler("feeds", list_feeds_command))
+    dp.add_handler(CommandHandler("subscribefeed", subscribe_feed_command))
+    dp.add_handler(CommandHandler("unsubscribefeed", unsubscribe_feed_command))
+    dp.add_handler(CommandHandler("matchfields", match_fields_command))
+    dp.add_handler(CommandHandler("digest", digest_command))
+    dp.add_handler(CommandHandler("stats", stats_command))
+    dp.add_handler(CommandHandler("broadcast", broadcast_command))
 
     dp.add_error_handler(error_handler)
 
-    jq.run_repeating(check_rss_and_send_to_users, interval=CHECK_INTERVAL_SECONDS, first=10)
-    logger.info(f"RSS 检查任务已安排。间隔时间: {CHECK_INTERVAL_SECONDS} 秒。")
+def main():
+    if not TELEGRAM_BOT_TOKEN:
+        logger.critical("严重错误: 环境变量 TELEGRAM_BOT_TOKEN 未设置。机器人无法启动。")
+        return
+
+    logger.info("机器人正在启动...")
+    if ADMIN_CHAT_ID:
+        logger.info(f"管理员通知将发送到 Chat ID: {ADMIN_CHAT_ID}")
+    else:
+        logger.info("环境变量 ADMIN_CHAT_ID 未设置。管理员通知将仅记录到日志。")
+    migrate_legacy_keywords()
+    reshard_pending_files()
 
-    updater.start_polling()
-    logger.info("机器人已启动并开始轮询更新。")
+    # 连接池需额外容纳投递线程 (默认 4 个 dispatcher 线程 + 4 个内部线程)
+    updater = Updater(TELEGRAM_BOT_TOKEN, base_url=TELEGRAM_API_BASE_URL, use_context=True,
+                      request_kwargs={'con_pool_size': 8 + DELIVERY_WORKERS})
+    dp = updater.dispatcher
+    jq = updater.job_queue
+
+    global delivery_queue
+    delivery_queue = DeliveryQueue(updater.bot, workers=DELIVERY_WORKERS,
+                                   global_rate=GLOBAL_SEND_RATE, per_chat_rate=PER_CHAT_SEND_RATE,
+                                   on_chat_migrated=on_chat_migrated, on_forbidden=on_forbidden,
+                                   on_delivered=on_delivered, on_failed=on_failed, outbox=outbox,
+                                   stats=send_stats,
+                                   max_attempts=OUTBOX_MAX_ATTEMPTS,
+                                   retry_base_delay=OUTBOX_RETRY_BASE_SECONDS,
+                                   retry_max_delay=OUTBOX_RETRY_MAX_SECONDS)
+    global shard_pool
+    if WORKER_PROCESSES > 0:
+        shard_pool = ShardPool(WORKER_PROCESSES, [sys.executable, os.path.abspath(__file__)],
+                               on_event=on_shard_event, ack_timeout=SHARD_ACK_TIMEOUT_SECONDS)
+        shard_pool.start()
+
+    register_handlers(dp)
+
+    jq.run_repeating(check_rss_and_send_to_users, interval=FEED_SCHEDULER_TICK_SECONDS, first=10)
+    jq.run_repeating(send_due_digests_job, interval=DIGEST_CHECK_INTERVAL_SECONDS, first=DIGEST_CHECK_INTERVAL_SECONDS)
+    if LOG_SUMMARY_INTERVAL_SECONDS > 0:
+        jq.run_repeating(log_send_summary, interval=LOG_SUMMARY_INTERVAL_SECONDS, first=LOG_SUMMARY_INTERVAL_SECONDS)
+    # 每轮最多 BROADCAST_BATCH_SIZE 条，间隔决定广播的最高速率；第一次运行在重新投递发件箱中的消息之后
+    jq.run_repeating(send_broadcast_batch, interval=max(1.0, BROADCAST_BATCH_SIZE / BROADCAST_RATE), first=15)
+    for broadcast in broadcasts.unfinished():
+        logger.info(f"将继续发送上次未完成的广播 #{broadcast['id']} (已处理 {broadcast['cursor']}/{len(broadcast['recipients'])} 个用户)。")
+    for feed_config in feed_registry.feeds.values():
+        logger.info(f"RSS 检查任务已安排: {feed_config.name} ({feed_config.url})，间隔时间: {feed_config.interval:.0f} 秒。")
+
+    metrics_server = None
+    if METRICS_PORT:
+        try:
+            metrics_server = start_metrics_server(METRICS_PORT, health_check=health_status)
+        except OSError as e:
+            logger.error(f"无法在端口 {METRICS_PORT} 启动指标服务: {e}")
+
+    if WEBHOOK_URL:
+        url_path = (WEBHOOK_PATH or default_url_path(TELEGRAM_BOT_TOKEN)).strip('/')
+        start_webhook(updater, WEBHOOK_LISTEN, WEBHOOK_PORT, url_path, join_webhook_url(WEBHOOK_URL, url_path),
+                      health_check=health_status, health_path=WEBHOOK_HEALTH_PATH,
+                      max_connections=WEBHOOK_MAX_CONNECTIONS)
+        logger.info("机器人已启动并通过 webhook 接收更新。")
+    else:
+        updater.start_polling()
+        logger.info("机器人已启动并开始轮询更新。")
+
+    # 开始接收命令后再重新投递上次运行时未确认送达的消息。分片模式下共用的 SQLite 发件箱中的推送由各工作进程
+    # 按分片重新投递，主进程只重新投递广播 (广播的结果只在主进程中统计)
+    replayed = outbox.pending_jobs()
+    if WORKER_PROCESSES > 0 and database:
+        replayed = [job for job in replayed if job.broadcast_id is not None]
+    for job in replayed:
+        delivery_queue.submit(job, delay=max(0.0, job.next_attempt_at - time.time()))
+    if replayed:
+        logger.info(f"已从发件箱重新投递 {len(replayed)} 条上次未确认送达的消息。")
 
     if ADMIN_CHAT_ID:
         try:
@@ -581,7 +1530,25 @@ def main():
             logger.warning(f"无法向管理员 ({ADMIN_CHAT_ID}) 发送启动成功消息: {e}")
 
     updater.idle()
+    if metrics_server:
+        metrics_server.shutdown()
+    feed_fetch_executor.shutdown(wait=False)
+    if shard_pool:
+        shard_pool.stop()
+    delivery_queue.stop()
+    outbox.close()
+    subscription_store.close()
+    digest_buffer.flush()
+    delivery_history.flush()
+    broadcasts.save()
+    if delivery_log:
+        delivery_log.flush()
+    if database:
+        database.close()
     logger.info("机器人已停止。")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    if IS_SHARD_WORKER:
+        run_shard_worker()
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,174 @@
+"""
+管理员广播。
+
+/broadcast 向所有开启通知的用户发送同一条消息。开始时记下收件人列表，之后由调度任务每次取出
+一批 (batch_size 个) 写入发件箱并交给投递队列，只有队列中的消息基本发完时才取下一批，
+因此广播期间新帖子的推送最多只需排在一批广播消息之后，RSS 检查和命令处理不受影响。
+发送进度 (下一批的位置与已发送、失败、跳过的人数) 保存在数据目录中，重启后从中断处继续；
+已写入发件箱的消息由发件箱负责重新投递，并按广播编号与用户去重，不会重复发送。
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from file_utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# 保留的已结束广播数 (供 /broadcast status 查看)
+MAX_FINISHED = 5
+
+
+class BroadcastManager:
+    """广播任务及其进度，修改后由 save() 写回磁盘。同一时间只发送最早开始的一个广播。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._dirty = False
+        data = self._load()
+        self._next_id = data.get('next_id', 1)
+        self._broadcasts = data.get('broadcasts', [])
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            logger.error(f"加载广播进度失败 ({self.path}): {e}。未完成的广播将不再继续。", exc_info=True)
+            return {}
+
+    def start(self, text: str, user_ids: list, admin_chat_id) -> dict:
+        """创建广播，返回其记录 (副本)。"""
+        with self._lock:
+            broadcast = {
+                'id': self._next_id, 'text': text, 'recipients': list(user_ids), 'cursor': 0,
+                'sent': 0, 'failed': 0, 'skipped': 0,
+                'admin_chat_id': admin_chat_id, 'status_message_id': None,
+                'started_at': time.time(), 'finished_at': None, 'cancelled': False,
+            }
+            self._next_id += 1
+            self._broadcasts.append(broadcast)
+            self._dirty = True
+            return dict(broadcast)
+
+    def set_status_message(self, broadcast_id: int, message_id: int):
+        """记录显示进度的消息，之后的进度通过编辑该消息更新。"""
+        with self._lock:
+            broadcast = self._find(broadcast_id)
+            if broadcast:
+                broadcast['status_message_id'] = message_id
+                self._dirty = True
+
+    def cancel(self) -> dict:
+        """停止正在发送的广播 (已交给投递队列的消息仍会发出)，返回其记录，没有时返回 None。"""
+        with self._lock:
+            broadcast = self._active()
+            if broadcast is None:
+                return None
+            broadcast['cancelled'] = True
+            broadcast['recipients'] = broadcast['recipients'][:broadcast['cursor']]
+            self._dirty = True
+            return dict(broadcast)
+
+    def next_batch(self, subscriptions: dict, limit: int) -> tuple:
+        """
+        取出当前广播的下一批收件人，返回 (广播记录副本, [(user_id_str, chat_id), ...])，没有待发送的广播时
+        返回 (None, [])。已关闭通知或不再存在的用户被跳过。调用方把消息写入发件箱后再调用 save()。
+        """
+        with self._lock:
+            broadcast = self._active()
+            if broadcast is None:
+                return None, []
+            batch = []
+            recipients = broadcast['recipients']
+            while broadcast['cursor'] < len(recipients) and len(batch) < limit:
+                user_id_str = recipients[broadcast['cursor']]
+                broadcast['cursor'] += 1
+                config = subscriptions.get(user_id_str)
+                if not config or not config.get('enabled', True) or not config.get('chat_id'):
+                    broadcast['skipped'] += 1
+                    continue
+                batch.append((user_id_str, config['chat_id']))
+            self._dirty = True
+            return dict(broadcast), batch
+
+    def record_result(self, broadcast_id: int, delivered: bool):
+        """投递线程中调用：一条广播消息发送成功或被放弃。"""
+        with self._lock:
+            broadcast = self._find(broadcast_id)
+            if broadcast is None:
+                return
+            broadcast['sent' if delivered else 'failed'] += 1
+            self._dirty = True
+
+    def finish_drained(self) -> list:
+        """
+        收件人都已取出且投递队列已清空的广播标记为结束，返回这些广播的记录 (副本)。
+        由调用方在投递队列为空时调用。
+        """
+        finished = []
+        with self._lock:
+            for broadcast in self._broadcasts:
+                if broadcast['finished_at'] is None and broadcast['cursor'] >= len(broadcast['recipients']):
+                    broadcast['finished_at'] = time.time()
+                    finished.append(dict(broadcast))
+            if finished:
+                done = [broadcast for broadcast in self._broadcasts if broadcast['finished_at'] is not None]
+                for broadcast in done[:-MAX_FINISHED]:
+                    self._broadcasts.remove(broadcast)
+                self._dirty = True
+        return finished
+
+    def unfinished(self) -> list:
+        """尚未结束的广播 (副本)，包括收件人已全部取出、正在等待发送完成的广播。"""
+        with self._lock:
+            return [dict(broadcast) for broadcast in self._broadcasts if broadcast['finished_at'] is None]
+
+    def latest(self) -> dict:
+        """最近开始的广播 (副本)，没有时返回 None。"""
+        with self._lock:
+            return dict(self._broadcasts[-1]) if self._broadcasts else None
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                atomic_write(self.path, json.dumps({'next_id': self._next_id, 'broadcasts': self._broadcasts},
+                                                   ensure_ascii=False))
+                self._dirty = False
+            except OSError as e:
+                logger.error(f"保存广播进度失败 ({self.path}): {e}", exc_info=True)
+
+    def _find(self, broadcast_id: int):
+        for broadcast in self._broadcasts:
+            if broadcast['id'] == broadcast_id:
+                return broadcast
+        return None
+
+    def _active(self):
+        for broadcast in self._broadcasts:
+            if broadcast['finished_at'] is None and broadcast['cursor'] < len(broadcast['recipients']):
+                return broadcast
+        return None
+
+
+def describe_progress(broadcast: dict) -> str:
+    """广播进度的纯文本描述。"""
+    total = len(broadcast['recipients'])
+    if broadcast['finished_at'] is not None:
+        state = "已取消" if broadcast['cancelled'] else "已完成"
+    elif broadcast['cancelled']:
+        state = "已取消，正在发送已排队的消息"
+    elif broadcast['cursor'] >= total:
+        state = "正在发送最后一批"
+    else:
+        state = "发送中"
+    return (f"📣 广播 #{broadcast['id']} ({state}): 共 {total} 个用户，已发送 {broadcast['sent']}，"
+            f"失败 {broadcast['failed']}，跳过 {broadcast['skipped']} (已关闭通知)，"
+            f"待发送 {max(0, total - broadcast['skipped'] - broadcast['sent'] - broadcast['failed'])}")
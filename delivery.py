@@ -0,0 +1,362 @@
+"""
+Telegram 消息投递队列。
+
+由一组工作线程从队列中取出待发送消息，通过令牌桶限制全局发送速率 (默认约 30 条/秒)
+以及每个聊天的发送速率 (默认 1 条/秒)，并处理 RetryAfter、BadRequest、ChatMigrated
+和 Forbidden 等错误，使 RSS 检查任务无需等待消息逐条发出。
+配置了发件箱 (见 outbox) 时，消息在 Telegram 确认后才标记为完成，网络错误等临时错误按指数退避重试。
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+import telegram
+
+from metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# python-telegram-bot v13 中用户屏蔽机器人时抛出 Unauthorized，新版本中为 Forbidden
+FORBIDDEN_ERRORS = tuple(getattr(telegram.error, name) for name in ('Forbidden', 'Unauthorized')
+                         if hasattr(telegram.error, name))
+
+SEND_SECONDS = Histogram('telegram_send_seconds', 'Telegram sendMessage 请求耗时 (秒)')
+MESSAGES_SENT = Counter('telegram_messages_sent_total', '成功发送的消息数')
+SEND_ERRORS = Counter('telegram_send_errors_total', '发送失败次数 (按错误类型)', ('error',))
+QUEUE_DEPTH = Gauge('delivery_queue_depth', '排队中和正在发送的消息数')
+DELIVERY_RETRIES = Counter('delivery_retries_total', '因临时错误安排重试的次数')
+DELIVERY_FAILURES = Counter('delivery_failures_total', '最终放弃发送的消息数 (按原因)', ('reason',))
+
+
+class TokenBucket:
+    """简单的令牌桶，rate 为每秒补充的令牌数，capacity 为桶容量。"""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self) -> float:
+        """尝试取出一个令牌。成功返回 0，否则返回需要等待的秒数。"""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def is_idle(self) -> bool:
+        """桶已满，说明该聊天最近没有发送，可以被回收。"""
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class DeliveryJob:
+    """一条待发送的消息。text 按 parse_mode 发送，解析失败时改用 plain_text 重发。"""
+
+    def __init__(self, user_id_str: str, chat_id, text: str, plain_text: str = None,
+                 parse_mode: str = None, description: str = "", feed_name: str = None, post_key: str = None,
+                 posts: list = None, title: str = None, keyword: str = None, created_at: float = None,
+                 broadcast_id: int = None):
+        self.user_id_str = user_id_str
+        self.chat_id = chat_id
+        self.text = text
+        self.plain_text = plain_text
+        self.parse_mode = parse_mode
+        self.description = description
+        # 推送帖子时记录来源 feed 与帖子去重键，供推送记录使用
+        self.feed_name = feed_name
+        self.post_key = post_key
+        # 摘要消息包含的多个帖子: [(feed 名称, 帖子去重键), ...]
+        self.posts = posts
+        # 帖子标题与匹配到的关键词 (关键词过滤关闭时为 None)，供推送记录使用
+        self.title = title
+        self.keyword = keyword
+        # 生成消息的时间，用于统计从匹配到送达的延迟
+        self.created_at = created_at or time.time()
+        # 管理员广播的编号 (见 broadcast)，普通推送为 None
+        self.broadcast_id = broadcast_id
+        # 发件箱中的编号、已尝试次数与下次尝试时间 (时间戳)，未使用发件箱时 outbox_id 为 None
+        self.outbox_id = None
+        self.attempts = 0
+        self.next_attempt_at = 0.0
+
+    def to_dict(self) -> dict:
+        return {'user_id_str': self.user_id_str, 'chat_id': self.chat_id, 'text': self.text,
+                'plain_text': self.plain_text, 'parse_mode': self.parse_mode, 'description': self.description,
+                'feed_name': self.feed_name, 'post_key': self.post_key, 'posts': self.posts,
+                'title': self.title, 'keyword': self.keyword, 'created_at': self.created_at,
+                'broadcast_id': self.broadcast_id}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'DeliveryJob':
+        return cls(data['user_id_str'], data['chat_id'], data['text'], data.get('plain_text'),
+                   data.get('parse_mode'), data.get('description', ''), data.get('feed_name'), data.get('post_key'),
+                   [tuple(post) for post in data['posts']] if data.get('posts') else None,
+                   data.get('title'), data.get('keyword'), data.get('created_at'), data.get('broadcast_id'))
+
+
+class DeliveryQueue:
+    """带速率限制的并发发送队列。"""
+
+    def __init__(self, bot, workers: int = 4, global_rate: float = 30.0, per_chat_rate: float = 1.0,
+                 on_chat_migrated=None, on_forbidden=None, on_delivered=None, on_failed=None,
+                 outbox=None, stats=None, max_attempts: int = 8, retry_base_delay: float = 30.0, retry_max_delay: float = 3600.0):
+        """
+        on_chat_migrated(user_id_str, new_chat_id) 与 on_forbidden(user_id_str) 在对应错误发生时
+        于工作线程中被调用，用于更新用户订阅。on_delivered(job) 在消息成功发送后被调用，
+        on_failed(job, reason) 在放弃发送时被调用。stats 为 delivery_history.SendStats 时记录发送统计。
+        outbox 为 outbox.Outbox 时，发送结果会写回发件箱；临时错误的第 n 次重试等待
+        retry_base_delay * 2^(n-1) 秒 (不超过 retry_max_delay)，尝试 max_attempts 次后放弃。
+        """
+        self.bot = bot
+        self.per_chat_rate = per_chat_rate
+        self.on_chat_migrated = on_chat_migrated
+        self.on_forbidden = on_forbidden
+        self.on_delivered = on_delivered
+        self.on_failed = on_failed
+        self.outbox = outbox
+        self.stats = stats
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+
+        self._global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self._chat_buckets = {}
+        self._blocked_chats = set()
+        self._paused_until = 0.0
+
+        # 堆中元素为 (可发送时间, 序号, job)，序号保证同一时间的任务按提交顺序发送
+        self._heap = []
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._stopping = False
+        QUEUE_DEPTH.set_function(self.pending)
+
+        self._workers = [threading.Thread(target=self._worker_loop, name=f"delivery-{i}", daemon=True)
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, job: DeliveryJob, delay: float = 0.0):
+        self._push(job, time.monotonic() + delay)
+
+    def pending(self) -> int:
+        """排队中和正在发送的消息数量。"""
+        with self._cond:
+            return len(self._heap) + self._in_flight
+
+    def join(self, timeout: float = None) -> bool:
+        """等待队列清空。超时返回 False。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._heap or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stop(self, timeout: float = 10.0):
+        """尽量发送完剩余消息后停止工作线程。"""
+        self.join(timeout)
+        with self._cond:
+            self._stopping = True
+            dropped = len(self._heap)
+            self._heap.clear()
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join(timeout=1)
+        if dropped and self.outbox is not None:
+            logger.info(f"投递队列停止时仍有 {dropped} 条消息未发送，将在下次启动时从发件箱重新发送。")
+        elif dropped:
+            logger.warning(f"投递队列停止时仍有 {dropped} 条消息未发送。")
+
+    def unblock_chat(self, chat_id):
+        """用户重新开启通知后，允许再次向其聊天发送消息。"""
+        with self._cond:
+            self._blocked_chats.discard(chat_id)
+
+    def _push(self, job: DeliveryJob, ready_at: float):
+        with self._cond:
+            heapq.heappush(self._heap, (ready_at, next(self._seq), job))
+            self._cond.notify()
+
+    def _next_job(self):
+        """取出下一条已到发送时间的消息，队列停止时返回 None。"""
+        with self._cond:
+            while not self._stopping:
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now and self._paused_until <= now:
+                    job = heapq.heappop(self._heap)[2]
+                    self._in_flight += 1
+                    return job
+                if self._heap:
+                    self._cond.wait(max(self._heap[0][0], self._paused_until) - now)
+                else:
+                    self._cond.wait()
+            return None
+
+    def _job_done(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _acquire_chat_slot(self, chat_id) -> float:
+        with self._cond:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                if len(self._chat_buckets) > 10000:
+                    self._chat_buckets = {cid: b for cid, b in self._chat_buckets.items() if not b.is_idle()}
+                bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate)
+            return bucket.try_acquire()
+
+    def _acquire_global_slot(self):
+        while True:
+            with self._cond:
+                wait = self._global_bucket.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def _worker_loop(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            try:
+                if job.chat_id in self._blocked_chats:
+                    self._failed(job, 'blocked')
+                    continue
+                wait = self._acquire_chat_slot(job.chat_id)
+                if wait:
+                    self._push(job, time.monotonic() + wait)
+                    continue
+                self._acquire_global_slot()
+                self._send(job)
+            except Exception as e:
+                logger.error(f"投递线程处理发给用户 {job.user_id_str} 的消息时出错: {e}", exc_info=True)
+            finally:
+                self._job_done()
+
+    def _send_message(self, chat_id, text: str, parse_mode: str = None):
+        started = time.perf_counter()
+        try:
+            self.bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+        finally:
+            elapsed = time.perf_counter() - started
+            SEND_SECONDS.observe(elapsed)
+        MESSAGES_SENT.inc()
+        if self.stats is not None:
+            self.stats.record_api(elapsed)
+
+    def _send(self, job: DeliveryJob, plain: bool = False):
+        """发送消息；plain 为 True 时发送纯文本版本 (Markdown 解析失败后的回退)。"""
+        try:
+            if plain:
+                self._acquire_global_slot()
+                self._send_message(job.chat_id, job.plain_text)
+            else:
+                self._send_message(job.chat_id, job.text, job.parse_mode)
+        except Exception as e:
+            self._handle_send_error(job, e, plain)
+            return
+        # 逐条的发送记录只在 DEBUG 级别输出，汇总见 bot.log_send_summary()
+        logger.debug("成功发送 %s 给用户 %s", job.description, job.user_id_str)
+        self._delivered(job)
+
+    def _handle_send_error(self, job: DeliveryJob, error: Exception, plain: bool):
+        """按错误类型处理一次失败的发送 (原消息与纯文本回退共用)：限流后暂停、重试、更新订阅或放弃。"""
+        version = "纯文本 " if plain else ""
+        if isinstance(error, telegram.error.RetryAfter):
+            # 触发 Telegram 的 429 限流时，暂停所有发送直到限制解除，然后重发
+            SEND_ERRORS.labels('RetryAfter').inc()
+            logger.warning(f"发送给用户 {job.user_id_str} 时触发限流，{error.retry_after} 秒后重试。")
+            resume_at = time.monotonic() + float(error.retry_after)
+            with self._cond:
+                self._paused_until = max(self._paused_until, resume_at)
+            self._push(job, resume_at)
+        elif isinstance(error, telegram.error.BadRequest):
+            SEND_ERRORS.labels('BadRequest').inc()
+            logger.error(f"发送给用户 {job.user_id_str} 的 {version}{job.description} 失败 (BadRequest): {error}")
+            if not plain and job.plain_text and "can't parse entities" in str(error).lower():
+                logger.info(f"尝试为用户 {job.user_id_str} 发送纯文本版本的 {job.description}")
+                self._send(job, plain=True)
+            else:
+                self._failed(job, 'bad_request')
+        elif isinstance(error, telegram.error.ChatMigrated):
+            SEND_ERRORS.labels('ChatMigrated').inc()
+            logger.warning(f"用户 {job.user_id_str} 的聊天已迁移。旧 chat_id: {job.chat_id}, 新 chat_id: {error.new_chat_id}。")
+            if self.on_chat_migrated:
+                self.on_chat_migrated(job.user_id_str, error.new_chat_id)
+            job.chat_id = error.new_chat_id
+            if self.outbox is not None:
+                self.outbox.retry(job, time.time())
+            self._push(job, time.monotonic())
+        elif isinstance(error, FORBIDDEN_ERRORS):
+            SEND_ERRORS.labels('Forbidden').inc()
+            logger.warning(f"用户 {job.user_id_str} (chat_id: {job.chat_id}) 已屏蔽机器人或账户已停用: {error}。将禁用其通知。")
+            with self._cond:
+                first_time = job.chat_id not in self._blocked_chats
+                self._blocked_chats.add(job.chat_id)
+            self._failed(job, 'forbidden')
+            if first_time and self.on_forbidden:
+                self.on_forbidden(job.user_id_str)
+        elif isinstance(error, telegram.error.NetworkError):
+            # 超时、连接中断等临时错误 (BadRequest 也是 NetworkError 的子类，已在上面处理)
+            SEND_ERRORS.labels(type(error).__name__).inc()
+            logger.warning(f"向用户 {job.user_id_str} 发送 {version}{job.description} 时出现网络错误: {error}")
+            self._retry_later(job)
+        else:
+            SEND_ERRORS.labels(type(error).__name__).inc()
+            logger.error(f"向用户 {job.user_id_str} 发送 {version}{job.description} 时发生未知错误: {error}",
+                         exc_info=error)
+            self._retry_later(job)
+
+    def _retry_later(self, job: DeliveryJob):
+        """临时错误后按指数退避重新排队，超过最大尝试次数后放弃。未使用发件箱时不重试。"""
+        if self.outbox is None:
+            return
+        job.attempts += 1
+        if job.attempts >= self.max_attempts:
+            logger.error(f"发给用户 {job.user_id_str} 的 {job.description} 已尝试 {job.attempts} 次，放弃发送。")
+            self._failed(job, 'max_attempts')
+            return
+        delay = min(self.retry_base_delay * 2 ** (job.attempts - 1), self.retry_max_delay)
+        DELIVERY_RETRIES.inc()
+        if self.stats is not None:
+            self.stats.record_retry()
+        logger.info(f"将在 {delay:g} 秒后第 {job.attempts + 1} 次尝试发送 {job.description} 给用户 {job.user_id_str}。")
+        self.outbox.retry(job, time.time() + delay)
+        self._push(job, time.monotonic() + delay)
+
+    def _failed(self, job: DeliveryJob, reason: str):
+        DELIVERY_FAILURES.labels(reason).inc()
+        if self.outbox is not None:
+            self.outbox.fail(job, reason)
+        if self.stats is not None:
+            self.stats.record_failed(reason)
+        if self.on_failed:
+            try:
+                self.on_failed(job, reason)
+            except Exception as e:
+                logger.error(f"记录发给用户 {job.user_id_str} 的失败推送时出错: {e}", exc_info=True)
+
+    def _delivered(self, job: DeliveryJob):
+        if self.outbox is not None:
+            self.outbox.ack(job)
+        if self.stats is not None:
+            self.stats.record_sent(time.time() - job.created_at)
+        if self.on_delivered:
+            try:
+                self.on_delivered(job)
+            except Exception as e:
+                logger.error(f"记录发给用户 {job.user_id_str} 的推送时出错: {e}", exc_info=True)
@@ -0,0 +1,301 @@
+"""
+每个用户最近的推送记录与全局发送统计。
+
+DeliveryHistory 为每个用户保存最近 N 条推送结果 (帖子、匹配的关键词、时间、结果)，用于回答
+“为什么没有收到某个帖子”。每个用户一个固定大小的环形缓冲，记录使用 __slots__，内存占用有上限；
+新记录追加到 JSON Lines 日志，批量写入，日志过长时按缓冲内容重写压缩。
+
+SendStats 按分钟汇总最近一小时的发送数、失败数、重试数和耗时分布，/stats 命令直接读取，无需扫描日志。
+"""
+import bisect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from file_utils import AppendLog
+
+logger = logging.getLogger(__name__)
+
+# 推送结果：已发送、已加入摘要缓冲、已随摘要发送、放弃发送
+SENT = 'sent'
+DIGEST = 'digest'
+DIGEST_SENT = 'digest_sent'
+FAILED = 'failed'
+TITLE_MAX_LENGTH = 60
+
+
+class DeliveryRecord:
+    """一条推送结果。outcome 为上面的推送结果之一，失败时 reason 为原因。"""
+    __slots__ = ('at', 'feed_name', 'post_key', 'title', 'keyword', 'outcome', 'reason')
+
+    def __init__(self, at: float, feed_name: str, post_key: str, title: str = None, keyword: str = None,
+                 outcome: str = SENT, reason: str = None):
+        self.at = at
+        # feed 名称、关键词和结果在大量记录之间重复，驻留后共享同一个字符串对象
+        self.feed_name = sys.intern(feed_name) if feed_name else feed_name
+        self.post_key = post_key
+        # 只保存标题的开头，用于在 /myrssstatus 中辨认帖子
+        self.title = title[:TITLE_MAX_LENGTH] if title else title
+        self.keyword = sys.intern(keyword) if keyword else keyword
+        self.outcome = sys.intern(outcome)
+        self.reason = sys.intern(reason) if reason else reason
+
+    def to_list(self) -> list:
+        return [round(self.at), self.feed_name, self.post_key, self.title, self.keyword, self.outcome, self.reason]
+
+    @classmethod
+    def from_list(cls, values: list) -> 'DeliveryRecord':
+        return cls(*values)
+
+
+class RingBuffer:
+    """固定容量的环形缓冲，写满后覆盖最旧的元素。"""
+    __slots__ = ('_items', '_next', '_count')
+
+    def __init__(self, capacity: int):
+        self._items = [None] * capacity
+        self._next = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, item):
+        self._items[self._next] = item
+        self._next = (self._next + 1) % len(self._items)
+        self._count = min(self._count + 1, len(self._items))
+
+    def latest(self, limit: int = None) -> list:
+        """按从新到旧的顺序返回最多 limit 个元素。"""
+        capacity = len(self._items)
+        count = self._count if limit is None else min(limit, self._count)
+        return [self._items[(self._next - 1 - i) % capacity] for i in range(count)]
+
+
+class DeliveryHistory:
+    """每个用户最近 per_user 条推送记录，持久化到 path (JSON Lines)。加载在后台线程中进行。"""
+
+    def __init__(self, path: str, per_user: int = 20):
+        self.path = path
+        self.per_user = per_user
+        self._lock = threading.Lock()
+        self._buffers = {}
+        self._log = AppendLog(path, "推送记录")
+        self._loaded = threading.Event()
+        threading.Thread(target=self._load, name='history-load', daemon=True).start()
+
+    def _load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        self._log.lines += 1
+                        try:
+                            user_id_str, *values = json.loads(line)
+                            self._append(user_id_str, DeliveryRecord.from_list(values))
+                        except (ValueError, TypeError):
+                            # 进程在写入过程中退出时，最后一行可能不完整
+                            continue
+                logger.info(f"已加载 {len(self._buffers)} 个用户的推送记录。")
+        except IOError as e:
+            logger.error(f"加载推送记录失败 ({self.path}): {e}", exc_info=True)
+        finally:
+            self._loaded.set()
+
+    def _append(self, user_id_str: str, record: DeliveryRecord):
+        buffer = self._buffers.get(user_id_str)
+        if buffer is None:
+            buffer = self._buffers[user_id_str] = RingBuffer(self.per_user)
+        buffer.append(record)
+
+    def add(self, user_id_str: str, record: DeliveryRecord):
+        """记录一条推送结果。写入磁盘推迟到 flush()。"""
+        self._loaded.wait()
+        with self._lock:
+            self._append(user_id_str, record)
+            self._log.append(json.dumps([user_id_str] + record.to_list(), ensure_ascii=False) + '\n')
+
+    def recent(self, user_id_str: str, limit: int = None) -> list:
+        """用户最近的推送记录，从新到旧。"""
+        self._loaded.wait()
+        with self._lock:
+            buffer = self._buffers.get(user_id_str)
+            return buffer.latest(limit) if buffer else []
+
+    def find(self, user_id_str: str, post_key: str) -> list:
+        """用户关于某个帖子的全部记录，从新到旧。"""
+        return [record for record in self.recent(user_id_str) if record.post_key == post_key]
+
+    def flush(self):
+        """追加本轮新增的记录；日志行数超过缓冲内容两倍时重写压缩。"""
+        self._loaded.wait()
+        with self._lock:
+            retained = sum(len(buffer) for buffer in self._buffers.values())
+            self._log.flush(2 * retained + 1000, self._snapshot)
+
+    def _snapshot(self) -> list:
+        lines = []
+        for user_id_str, buffer in self._buffers.items():
+            lines.extend(json.dumps([user_id_str] + record.to_list(), ensure_ascii=False) + '\n'
+                         for record in reversed(buffer.latest()))
+        return lines
+
+
+# 耗时分桶 (秒)：Telegram 请求耗时与从匹配到送达的总延迟
+API_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LATENCY_BUCKETS = (1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 3 * 3600, 12 * 3600)
+
+
+class _MinuteStats:
+    __slots__ = ('minute', 'sent', 'failed', 'retried', 'api', 'latency')
+
+    def __init__(self, minute: int):
+        self.minute = minute
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.api = [0] * (len(API_BUCKETS) + 1)
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+
+
+def _percentile(counts: list, bounds: tuple, q: float):
+    """按分桶计数估算分位数，返回所在分桶的上界；没有数据时为 None，超过最大分桶时为 inf。"""
+    total = sum(counts)
+    if not total:
+        return None
+    threshold = q * total
+    running = 0
+    for index, count in enumerate(counts):
+        running += count
+        if running >= threshold:
+            return bounds[index] if index < len(bounds) else float('inf')
+    return None
+
+
+def describe_bound(value, bounds: tuple) -> str:
+    """把 _percentile 的结果写成 “≤ 0.5 秒” / “≤ 5 分钟” 这样的文字。"""
+    if value is None:
+        return "无数据"
+    if value == float('inf'):
+        return f"> {describe_seconds(bounds[-1])}"
+    return f"≤ {describe_seconds(value)}"
+
+
+def describe_seconds(seconds: float) -> str:
+    if seconds < 60:
+        return f"{seconds:g} 秒"
+    if seconds < 3600:
+        return f"{seconds / 60:g} 分钟"
+    return f"{seconds / 3600:g} 小时"
+
+
+class SendStats:
+    """最近 window_minutes 分钟内按分钟汇总的发送统计，外加启动以来的累计数。"""
+
+    def __init__(self, window_minutes: int = 60):
+        self.window_minutes = window_minutes
+        self._lock = threading.Lock()
+        self._minutes = [None] * window_minutes
+        self.started_at = time.time()
+        self.totals = {'sent': 0, 'failed': 0, 'retried': 0}
+
+    def _current(self, now: float) -> _MinuteStats:
+        minute = int(now // 60)
+        slot = minute % self.window_minutes
+        stats = self._minutes[slot]
+        if stats is None or stats.minute != minute:
+            stats = self._minutes[slot] = _MinuteStats(minute)
+        return stats
+
+    def record_api(self, seconds: float):
+        """一次成功的 sendMessage 请求耗时。"""
+        with self._lock:
+            self._current(time.time()).api[bisect.bisect_left(API_BUCKETS, seconds)] += 1
+
+    def record_sent(self, latency_seconds: float):
+        """一条消息送达，latency_seconds 为从进入发件箱到送达的时间。"""
+        with self._lock:
+            stats = self._current(time.time())
+            stats.sent += 1
+            stats.latency[bisect.bisect_left(LATENCY_BUCKETS, max(0.0, latency_seconds))] += 1
+            self.totals['sent'] += 1
+
+    def record_failed(self, reason: str = None):
+        """一条消息被放弃发送。"""
+        with self._lock:
+            self._current(time.time()).failed += 1
+            self.totals['failed'] += 1
+
+    def record_retry(self):
+        """一次临时错误后安排的重试。"""
+        with self._lock:
+            self._current(time.time()).retried += 1
+            self.totals['retried'] += 1
+
+    def summary(self, minutes: int) -> dict:
+        """最近 minutes 分钟 (含当前分钟) 的汇总。"""
+        now_minute = int(time.time() // 60)
+        result = {'sent': 0, 'failed': 0, 'retried': 0}
+        api = [0] * (len(API_BUCKETS) + 1)
+        latency = [0] * (len(LATENCY_BUCKETS) + 1)
+        with self._lock:
+            for stats in self._minutes:
+                if stats is None or now_minute - stats.minute >= min(minutes, self.window_minutes):
+                    continue
+                result['sent'] += stats.sent
+                result['failed'] += stats.failed
+                result['retried'] += stats.retried
+                api = [a + b for a, b in zip(api, stats.api)]
+                latency = [a + b for a, b in zip(latency, stats.latency)]
+        # 窗口不足 minutes 分钟 (刚启动) 时按实际运行时间计算速率
+        seconds = max(1.0, min(minutes * 60, time.time() - self.started_at))
+        result['per_minute'] = result['sent'] * 60 / seconds
+        result['api_p50'] = _percentile(api, API_BUCKETS, 0.5)
+        result['api_p95'] = _percentile(api, API_BUCKETS, 0.95)
+        result['latency_p50'] = _percentile(latency, LATENCY_BUCKETS, 0.5)
+        result['latency_p95'] = _percentile(latency, LATENCY_BUCKETS, 0.95)
+        return result
+
+
+def _forward(emit, *event):
+    # 与主进程的连接断开时 (正在退出) 丢弃统计，不能让记录失败影响已经完成的发送
+    try:
+        emit(*event)
+    except (OSError, ValueError) as e:
+        logger.warning(f"无法把推送记录转发给主进程: {e}")
+
+
+class ForwardingHistory:
+    """多进程模式的工作进程中代替 DeliveryHistory：记录通过 emit('history', ...) 转发给主进程保存。"""
+
+    def __init__(self, emit):
+        self.emit = emit
+
+    def add(self, user_id_str: str, record: DeliveryRecord):
+        _forward(self.emit, 'history', user_id_str, record.to_list())
+
+    def flush(self):
+        pass
+
+
+class ForwardingStats:
+    """多进程模式的工作进程中代替 SendStats：统计通过 emit('stats', 方法名, 参数) 转发给主进程汇总。"""
+    FORWARDED = ('record_api', 'record_sent', 'record_failed', 'record_retry')
+
+    def __init__(self, emit):
+        self.emit = emit
+
+    def record_api(self, seconds: float):
+        _forward(self.emit, 'stats', 'record_api', (seconds,))
+
+    def record_sent(self, latency_seconds: float):
+        _forward(self.emit, 'stats', 'record_sent', (latency_seconds,))
+
+    def record_failed(self, reason: str = None):
+        _forward(self.emit, 'stats', 'record_failed', (reason,))
+
+    def record_retry(self):
+        _forward(self.emit, 'stats', 'record_retry', ())
@@ -0,0 +1,212 @@
+"""
+按用户合并推送的摘要模式。
+
+开启摘要模式的用户，匹配到的帖子先放入缓冲区，满足以下任一条件时合并为一条消息发送:
+    - 缓冲的帖子数达到 max_items
+    - 最早缓冲的帖子已等待 max_delay 秒
+    - 到达每天的固定时间 daily_at (HH:MM，服务器本地时区)
+缓冲区保存在数据目录中，重启后不会丢失已匹配但尚未发送的帖子。
+"""
+import datetime
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from file_utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# 单个用户最多缓冲的帖子数，超出时丢弃最早的帖子
+MAX_BUFFERED_ITEMS = 500
+
+_DURATION_RE = re.compile(r'^(\d+(?:\.\d+)?)([smhd]?)$')
+_DURATION_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+_DAILY_RE = re.compile(r'^([01]?\d|2[0-3]):([0-5]\d)$')
+
+
+def parse_duration(text: str) -> float:
+    """解析 90、90s、30m、2h、1d 这样的时长，返回秒数。"""
+    match = _DURATION_RE.match(text.strip().lower())
+    if not match or float(match.group(1)) <= 0:
+        raise ValueError(f"无效的时长 '{text}'，例如 90s、30m、2h。")
+    return float(match.group(1)) * _DURATION_UNITS[match.group(2)]
+
+
+def format_duration(seconds: float) -> str:
+    for size, label in ((86400, '天'), (3600, '小时'), (60, '分钟')):
+        if seconds >= size and seconds % size == 0:
+            return f"{int(seconds // size)} {label}"
+    return f"{seconds:g} 秒"
+
+
+def parse_digest_args(args: list):
+    """
+    解析 /digest 命令参数，返回摘要设置 (dict)，关闭摘要时返回 None。格式无效时抛出 ValueError。
+        off | count N [every T] | every T | daily HH:MM
+    """
+    words = [arg.strip().lower() for arg in args if arg.strip()]
+    if words == ['off']:
+        return None
+    settings = {}
+    i = 0
+    while i < len(words):
+        word = words[i]
+        if i + 1 >= len(words):
+            raise ValueError(f"'{word}' 后面缺少参数。")
+        value = words[i + 1]
+        if word == 'count':
+            if not value.isdigit() or int(value) < 2:
+                raise ValueError("count 需要一个不小于 2 的整数。")
+            settings['max_items'] = int(value)
+        elif word == 'every':
+            settings['max_delay'] = parse_duration(value)
+        elif word == 'daily':
+            if not _DAILY_RE.match(value):
+                raise ValueError("daily 需要 HH:MM 格式的时间，例如 08:30。")
+            hour, minute = value.split(':')
+            settings['daily_at'] = f"{int(hour):02d}:{minute}"
+        else:
+            raise ValueError(f"未知的参数 '{word}'。")
+        i += 2
+    if not settings:
+        raise ValueError("缺少摘要设置。")
+    return settings
+
+
+def describe_digest(settings) -> str:
+    if not settings:
+        return "关闭 (每个帖子单独推送)"
+    parts = []
+    if settings.get('max_items'):
+        parts.append(f"累积 {settings['max_items']} 条")
+    if settings.get('max_delay'):
+        parts.append(f"最早的帖子等待 {format_duration(settings['max_delay'])}")
+    if settings.get('daily_at'):
+        parts.append(f"每天 {settings['daily_at']}")
+    return "开启，" + " 或 ".join(parts) + " 时合并发送"
+
+
+def _last_daily_occurrence(daily_at: str, now: float) -> float:
+    """返回不晚于 now 的最近一次 daily_at 时刻 (本地时区) 的时间戳。"""
+    hour, minute = (int(part) for part in daily_at.split(':'))
+    current = datetime.datetime.fromtimestamp(now)
+    occurrence = current.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if occurrence > current:
+        occurrence -= datetime.timedelta(days=1)
+    return occurrence.timestamp()
+
+
+def digest_due(settings, items: list, now: float) -> bool:
+    """根据摘要设置判断缓冲的帖子是否应当发送。settings 为空 (已关闭摘要) 时立即发送。"""
+    if not items:
+        return False
+    if not settings:
+        return True
+    oldest = items[0]['added_at']
+    if settings.get('max_items') and len(items) >= settings['max_items']:
+        return True
+    if settings.get('max_delay') and now - oldest >= settings['max_delay']:
+        return True
+    if settings.get('daily_at') and _last_daily_occurrence(settings['daily_at'], now) > oldest:
+        return True
+    return False
+
+
+class DigestBuffer:
+    """每个用户待合并发送的帖子，修改后由 flush() 写回磁盘。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._items = self._load()
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            logger.error(f"加载摘要缓冲区失败 ({self.path}): {e}。缓冲的帖子将丢失。", exc_info=True)
+            return {}
+
+    def add(self, user_id_str: str, feed_name: str, title: str, link: str, post_key: str = None):
+        with self._lock:
+            items = self._items.setdefault(user_id_str, [])
+            # 同一帖子可能被重新处理 (例如分片模式下未确认的帖子被重新发布)，不重复缓冲
+            if post_key and any(item['key'] == post_key and item['feed'] == feed_name for item in items):
+                return
+            items.append({'feed': feed_name, 'title': title, 'link': link, 'key': post_key, 'added_at': time.time()})
+            if len(items) > MAX_BUFFERED_ITEMS:
+                del items[:len(items) - MAX_BUFFERED_ITEMS]
+            self._dirty = True
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(items) for items in self._items.values())
+
+    def items(self) -> dict:
+        """返回所有缓冲的帖子 {user_id_str: [帖子, ...]} 的副本。"""
+        with self._lock:
+            return {user_id_str: list(items) for user_id_str, items in self._items.items()}
+
+    def merge(self, items_by_user: dict):
+        """并入另一个缓冲区中的帖子 (例如工作进程数变化后重新分配)，保留原来的加入时间，重复的帖子只保留一份。"""
+        with self._lock:
+            for user_id_str, new_items in items_by_user.items():
+                items = self._items.setdefault(user_id_str, [])
+                known = {(item['feed'], item['key']) for item in items if item.get('key')}
+                for item in new_items:
+                    if item.get('key') and (item['feed'], item['key']) in known:
+                        continue
+                    items.append(item)
+                items.sort(key=lambda item: item['added_at'])
+                if len(items) > MAX_BUFFERED_ITEMS:
+                    del items[:len(items) - MAX_BUFFERED_ITEMS]
+                self._dirty = True
+
+    def due(self, subscriptions: dict, now: float = None) -> dict:
+        """
+        返回所有应当发送的摘要 {user_id_str: [帖子, ...]}，帖子仍留在缓冲中，调用方把摘要写入发件箱后
+        再调用 remove()，这样写入完成前退出时摘要不会丢失。已停用通知或不再存在的用户的缓冲会被丢弃。
+        """
+        now = time.time() if now is None else now
+        due = {}
+        with self._lock:
+            for user_id_str in list(self._items):
+                config = subscriptions.get(user_id_str)
+                if not config or not config.get('enabled', False) or not config.get('chat_id'):
+                    del self._items[user_id_str]
+                    self._dirty = True
+                elif digest_due(config.get('digest'), self._items[user_id_str], now):
+                    due[user_id_str] = list(self._items[user_id_str])
+        return due
+
+    def remove(self, taken: dict):
+        """从缓冲中移除 due() 返回的帖子，其间新加入的帖子保留。"""
+        with self._lock:
+            for user_id_str, items in taken.items():
+                current = self._items.get(user_id_str)
+                if not current:
+                    continue
+                taken_ids = {id(item) for item in items}
+                remaining = [item for item in current if id(item) not in taken_ids]
+                if remaining:
+                    self._items[user_id_str] = remaining
+                else:
+                    del self._items[user_id_str]
+                self._dirty = True
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                atomic_write(self.path, json.dumps(self._items, ensure_ascii=False))
+                self._dirty = False
+            except OSError as e:
+                logger.error(f"保存摘要缓冲区失败 ({self.path}): {e}", exc_info=True)
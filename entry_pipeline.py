@@ -0,0 +1,133 @@
+"""
+新帖子的预处理。
+
+每个新帖子只规范化一次：Unicode NFKC (全角/半角统一) 与 casefold、去除 HTML 标签、
+分词，然后所有用户的关键词规则都在这份共享的规范化结果上匹配。
+用户可以选择在哪些字段中匹配 (标题、正文摘要、分类)，默认只匹配标题。
+"""
+import re
+import unicodedata
+from html.parser import HTMLParser
+
+MATCH_FIELDS = ('title', 'summary', 'category')
+DEFAULT_MATCH_FIELDS = ('title',)
+FIELD_LABELS = {'title': '标题', 'summary': '正文', 'category': '分类'}
+# /matchfields 命令接受的字段别名
+FIELD_ALIASES = {
+    'title': 'title', '标题': 'title',
+    'summary': 'summary', 'content': 'summary', 'body': 'summary', '正文': 'summary', '摘要': 'summary',
+    'category': 'category', 'categories': 'category', 'tag': 'category', 'tags': 'category', '分类': 'category',
+}
+
+_WHITESPACE_RE = re.compile(r'\s+')
+# 整词匹配只考虑 ASCII 字母、数字和下划线组成的词 (见 keyword_rules)
+_TOKEN_RE = re.compile(r'[0-9a-z_]+')
+
+
+def normalize_text(text: str) -> str:
+    """NFKC 规范化 (全角字母数字与标点转为半角) 后 casefold，并合并连续空白。"""
+    if not text:
+        return ''
+    return _WHITESPACE_RE.sub(' ', unicodedata.normalize('NFKC', text).casefold()).strip()
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+
+    def handle_data(self, data):
+        self.parts.append(data)
+
+    def handle_starttag(self, tag, attrs):
+        # 块级标签和换行视为词语分隔，避免相邻段落的文字粘连
+        self.parts.append(' ')
+
+
+def strip_html(html: str) -> str:
+    """去除 HTML 标签并还原字符实体。"""
+    if not html or '<' not in html and '&' not in html:
+        return html or ''
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return ''.join(extractor.parts)
+
+
+def parse_match_fields(names: list) -> tuple:
+    """把用户输入的字段名 (可用别名) 转换为按 MATCH_FIELDS 顺序排列的字段元组。无效时抛出 ValueError。"""
+    fields = set()
+    for name in names:
+        field = FIELD_ALIASES.get(name.strip().lower())
+        if field is None:
+            raise ValueError(f"未知的字段 '{name}'。可用字段: {', '.join(MATCH_FIELDS)}")
+        fields.add(field)
+    if not fields:
+        raise ValueError("至少需要选择一个字段。")
+    return tuple(field for field in MATCH_FIELDS if field in fields)
+
+
+def user_match_fields(config: dict) -> tuple:
+    """返回用户设置的匹配字段，未设置或设置无效时为 DEFAULT_MATCH_FIELDS。"""
+    fields = config.get('match_fields')
+    if not fields:
+        return DEFAULT_MATCH_FIELDS
+    fields = tuple(field for field in MATCH_FIELDS if field in fields)
+    return fields or DEFAULT_MATCH_FIELDS
+
+
+class TextView:
+    """若干字段合并后的规范化文本，tokens 为其中的 ASCII 词集合 (首次使用时计算)。"""
+    __slots__ = ('text', '_tokens')
+
+    def __init__(self, text: str):
+        self.text = text
+        self._tokens = None
+
+    @property
+    def tokens(self) -> frozenset:
+        if self._tokens is None:
+            self._tokens = frozenset(_TOKEN_RE.findall(self.text))
+        return self._tokens
+
+
+class NormalizedEntry:
+    """一个帖子各字段的规范化文本。title / link 保留原始值用于渲染推送消息。"""
+    __slots__ = ('title', 'link', 'fields', '_views')
+
+    def __init__(self, title: str, link: str = None, summary: str = '', categories: list = ()):
+        self.title = title
+        self.link = link
+        self.fields = {
+            'title': normalize_text(title),
+            'summary': normalize_text(strip_html(summary)),
+            'category': normalize_text(' '.join(categories)),
+        }
+        self._views = {}
+
+    def view(self, fields: tuple) -> TextView:
+        """返回指定字段合并后的文本视图，同一组字段只合并一次。"""
+        view = self._views.get(fields)
+        if view is None:
+            view = self._views[fields] = TextView('\n'.join(self.fields[field] for field in fields))
+        return view
+
+
+def entry_fields(entry) -> dict:
+    """
+    提取 feedparser 解析出的帖子中参与匹配的原始字段，可作为 NormalizedEntry 的参数，也便于在进程间传递。
+    正文优先使用 content，其次为 summary。
+    """
+    summary = ''
+    content = entry.get('content')
+    if content:
+        summary = ' '.join(part.get('value', '') for part in content)
+    if not summary:
+        summary = entry.get('summary', '')
+    return {'title': entry.title, 'link': entry.get('link'), 'summary': summary,
+            'categories': [tag.get('term') or '' for tag in entry.get('tags') or []]}
+
+
+def normalize_entry(entry) -> NormalizedEntry:
+    """规范化 feedparser 解析出的帖子。"""
+    return NormalizedEntry(**entry_fields(entry))
@@ -0,0 +1,197 @@
+"""
+带条件请求的 RSS 抓取。
+
+每次请求都带上上次响应的 ETag / Last-Modified，服务器返回 304 时直接跳过本轮。
+服务器不支持这些校验头时，对响应正文计算哈希，正文未变化时同样跳过解析。
+校验信息只有在本轮处理成功后才通过 commit() 持久化，处理失败的内容下次会重新处理。
+默认使用 feed_stream 增量解析，只解析到已处理过的帖子为止；无法增量解析的文档退回 feedparser。
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+import zlib
+
+from feed_stream import FeedParseError, iter_entries
+from file_utils import atomic_write
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+FETCH_SECONDS = Histogram('rss_feed_fetch_seconds', 'RSS feed 下载耗时 (秒)', ('url',))
+PARSE_SECONDS = Histogram('rss_feed_parse_seconds', 'RSS feed 解析耗时 (秒)', ('url',))
+FETCH_RESULTS = Counter('rss_feed_fetch_total', 'RSS feed 抓取次数 (按结果)', ('url', 'result'))
+PARSED_ENTRIES = Counter('rss_feed_parsed_entries_total', '解析的帖子数 (增量解析时在已处理的帖子处停止)', ('url',))
+
+
+class FeedFetchResult:
+    """
+    一次抓取的结果。not_modified 为 True 时没有内容。
+    增量解析模式下 feed 为 None，body / response_headers 保留原始响应，由 new_entries() 按需解析。
+    """
+
+    def __init__(self, url: str, not_modified: bool, feed=None, etag: str = None,
+                 last_modified: str = None, body_hash: str = None, status: int = None,
+                 body: bytes = None, response_headers: dict = None):
+        self.url = url
+        self.not_modified = not_modified
+        self.feed = feed
+        self.body = body
+        self.response_headers = response_headers
+        self.etag = etag
+        self.last_modified = last_modified
+        self.body_hash = body_hash
+        self.status = status
+
+    def new_entries(self, is_seen, stop_after_seen: int = 3) -> list:
+        """
+        返回尚未处理的帖子 (按从旧到新的顺序，同一链接只保留一个)，is_seen(link) 判断帖子是否已处理。
+        增量解析时帖子按文档顺序 (从新到旧) 逐个解析，连续遇到 stop_after_seen 个已处理的帖子后停止，
+        不再解析更旧的帖子。解析失败时抛出 FeedParseError。
+        """
+        if self.feed is None:
+            try:
+                return self._select(iter_entries(self.body), is_seen, stop_after_seen)
+            except FeedParseError as e:
+                logger.warning(f"无法增量解析 RSS feed ({self.url}): {e}。改用 feedparser 完整解析。")
+                self.feed = _parse_with_feedparser(self.url, self.body, self.response_headers)
+        if self.feed.bozo:
+            raise FeedParseError(str(self.feed.bozo_exception))
+        # feedparser 已经解析了整个文档，检查全部帖子
+        return self._select(self.feed.entries, is_seen, 0)
+
+    def _select(self, entries, is_seen, stop_after_seen: int) -> list:
+        started = time.perf_counter()
+        new_entries = []
+        new_links = set()
+        parsed = 0
+        consecutive_seen = 0
+        for entry in entries:
+            parsed += 1
+            if is_seen(entry.link):
+                consecutive_seen += 1
+                # 只看到一个已处理的帖子时不立即停止，避免置顶或重新排序的旧帖子挡住后面的新帖子
+                if stop_after_seen and consecutive_seen >= stop_after_seen:
+                    break
+                continue
+            consecutive_seen = 0
+            if entry.link not in new_links:
+                new_links.add(entry.link)
+                new_entries.append(entry)
+        if self.feed is None:
+            PARSE_SECONDS.labels(self.url).observe(time.perf_counter() - started)
+        PARSED_ENTRIES.labels(self.url).inc(parsed)
+        new_entries.reverse()
+        return new_entries
+
+
+def _parse_with_feedparser(url: str, body: bytes, response_headers: dict):
+    import feedparser
+
+    started = time.perf_counter()
+    # 响应头交给 feedparser 用于判断字符编码
+    feed = feedparser.parse(body, response_headers=response_headers)
+    PARSE_SECONDS.labels(url).observe(time.perf_counter() - started)
+    return feed
+
+
+class FeedFetcher:
+    """抓取 RSS feed 并维护每个 URL 的条件请求状态。"""
+
+    def __init__(self, state_path: str, timeout: float = 30, streaming: bool = True):
+        self.state_path = state_path
+        self.timeout = timeout
+        self.streaming = streaming
+        self._lock = threading.Lock()
+        self._state = self._load_state()
+
+    def _load_state(self) -> dict:
+        if not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            logger.error(f"加载 RSS 抓取状态失败 ({self.state_path}): {e}。将重新完整抓取。", exc_info=True)
+            return {}
+
+    def fetch(self, url: str) -> FeedFetchResult:
+        """抓取 feed。内容未变化时返回 not_modified=True 的结果。网络或 HTTP 错误会抛出异常。"""
+        # feedparser 导入较慢，推迟到第一次抓取时，不拖慢启动 (请求头与其保持一致)
+        import feedparser
+
+        with self._lock:
+            state = dict(self._state.get(url, {}))
+
+        headers = {
+            'User-Agent': feedparser.USER_AGENT,
+            'Accept': feedparser.http.ACCEPT_HEADER,
+            'Accept-Encoding': 'gzip, deflate',
+        }
+        if state.get('etag'):
+            headers['If-None-Match'] = state['etag']
+        if state.get('last_modified'):
+            headers['If-Modified-Since'] = state['last_modified']
+
+        request = urllib.request.Request(url, headers=headers)
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                status = response.status
+                response_headers = {k.lower(): v for k, v in response.headers.items()}
+                body = response.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                FETCH_SECONDS.labels(url).observe(time.perf_counter() - started)
+                FETCH_RESULTS.labels(url, 'not_modified').inc()
+                logger.info(f"RSS feed ({url}) 未更新 (304 Not Modified)，跳过本轮。")
+                return FeedFetchResult(url, not_modified=True, status=304)
+            FETCH_RESULTS.labels(url, 'error').inc()
+            raise
+        except Exception:
+            FETCH_RESULTS.labels(url, 'error').inc()
+            raise
+        FETCH_SECONDS.labels(url).observe(time.perf_counter() - started)
+
+        encoding = response_headers.get('content-encoding', '')
+        if encoding == 'gzip':
+            body = gzip.decompress(body)
+        elif encoding == 'deflate':
+            body = zlib.decompress(body, -zlib.MAX_WBITS)
+
+        body_hash = hashlib.sha256(body).hexdigest()
+        etag = response_headers.get('etag')
+        last_modified = response_headers.get('last-modified')
+        if body_hash == state.get('body_hash'):
+            FETCH_RESULTS.labels(url, 'unchanged').inc()
+            logger.info(f"RSS feed ({url}) 内容与上次相同，跳过解析。")
+            return FeedFetchResult(url, not_modified=True, etag=etag, last_modified=last_modified,
+                                   body_hash=body_hash, status=status)
+
+        FETCH_RESULTS.labels(url, 'changed').inc()
+        if self.streaming:
+            return FeedFetchResult(url, not_modified=False, etag=etag, last_modified=last_modified,
+                                   body_hash=body_hash, status=status, body=body, response_headers=response_headers)
+        feed = _parse_with_feedparser(url, body, response_headers)
+        return FeedFetchResult(url, not_modified=False, feed=feed, etag=etag, last_modified=last_modified,
+                               body_hash=body_hash, status=status)
+
+    def commit(self, result: FeedFetchResult):
+        """本轮处理成功后保存校验信息，下次请求将据此判断内容是否变化。"""
+        if result.body_hash is None:
+            return
+        with self._lock:
+            self._state[result.url] = {
+                'etag': result.etag,
+                'last_modified': result.last_modified,
+                'body_hash': result.body_hash,
+            }
+            try:
+                atomic_write(self.state_path, json.dumps(self._state, indent=4, ensure_ascii=False))
+            except OSError as e:
+                logger.error(f"保存 RSS 抓取状态失败 ({self.state_path}): {e}", exc_info=True)
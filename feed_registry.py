@@ -0,0 +1,186 @@
+"""
+RSS feed 注册表与调度状态。
+
+每个 feed 拥有独立的名称 (同时作为去重记录的命名空间)、检查间隔以及失败退避状态。
+feed 列表可以通过环境变量 RSS_FEEDS 或数据目录下的 feeds.json 配置，
+两者都未设置时只包含由 RSS_URL 指定的默认 feed。
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FEED_NAME = 'default'
+FEED_NAME_RE = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+class FeedConfig:
+    """单个 feed 的配置。"""
+
+    def __init__(self, name: str, url: str, interval: float, title: str = None,
+                 min_interval: float = None, max_interval: float = None):
+        self.name = name
+        self.url = url
+        self.interval = interval
+        self.title = title or name
+        # 自适应轮询的间隔上下限，为 None 时使用注册表的默认值
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+
+class AdaptiveInterval:
+    """
+    根据最近几轮检查发现的新帖子数量调整检查间隔。
+
+    用最近 window 轮的 (新帖子数, 距上轮的秒数) 估算发帖速率，使每轮平均发现约
+    target_new_entries 个新帖子：发帖频繁时缩短间隔，无新帖时逐步放宽，并限制在上下限之间。
+    """
+
+    def __init__(self, initial: float, min_interval: float, max_interval: float,
+                 target_new_entries: float = 1.0, window: int = 5):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_new_entries = target_new_entries
+        self.current = min(max(initial, min_interval), max_interval)
+        self._history = deque(maxlen=window)
+
+    def observe(self, new_entries: int, elapsed: float) -> float:
+        """记录一轮检查的结果并返回新的检查间隔。"""
+        if elapsed > 0:
+            self._history.append((new_entries, elapsed))
+        total_entries = sum(entries for entries, _ in self._history)
+        total_elapsed = sum(seconds for _, seconds in self._history)
+        if total_entries and total_elapsed:
+            target = self.target_new_entries * total_elapsed / total_entries
+        else:
+            target = self.current * 1.5
+        # 与当前间隔取平均，避免单轮的偶然波动造成间隔剧烈变化
+        self.current = min(max((self.current + target) / 2, self.min_interval), self.max_interval)
+        return self.current
+
+
+class FeedState:
+    """单个 feed 的调度状态。"""
+
+    def __init__(self, adaptive: AdaptiveInterval = None):
+        # 未开启自适应轮询时为 None
+        self.adaptive = adaptive
+        self.next_due = 0.0
+        self.last_success_at = None
+        self.consecutive_failures = 0
+        self.running = False
+
+
+def parse_feed_configs(raw: str, default_interval: float) -> list:
+    """
+    解析 JSON 格式的 feed 列表，例如:
+    [{"name": "nodeseek", "url": "https://rss.nodeseek.com/", "interval": 120, "title": "NodeSeek"}]
+    """
+    feeds = []
+    for item in json.loads(raw):
+        name = str(item['name'])
+        if not FEED_NAME_RE.match(name):
+            raise ValueError(f"feed 名称 '{name}' 无效，只能包含字母、数字、下划线和连字符。")
+        if any(feed.name == name for feed in feeds):
+            raise ValueError(f"feed 名称 '{name}' 重复。")
+        feeds.append(FeedConfig(name, item['url'], float(item.get('interval', default_interval)), item.get('title'),
+                                min_interval=_optional_float(item.get('min_interval')),
+                                max_interval=_optional_float(item.get('max_interval'))))
+    return feeds
+
+
+def _optional_float(value):
+    return None if value is None else float(value)
+
+
+def load_feed_configs(default_url: str, default_interval: float, feeds_env: str = None,
+                      feeds_file: str = None) -> list:
+    """按 环境变量 > feeds.json > RSS_URL 的优先级加载 feed 列表。"""
+    raw = feeds_env
+    if not raw and feeds_file and os.path.exists(feeds_file):
+        with open(feeds_file, 'r', encoding='utf-8') as f:
+            raw = f.read()
+    if raw:
+        feeds = parse_feed_configs(raw, default_interval)
+        if feeds:
+            return feeds
+    return [FeedConfig(DEFAULT_FEED_NAME, default_url, default_interval)]
+
+
+class FeedRegistry:
+    """
+    记录每个 feed 的下次检查时间。
+    开启自适应轮询时，检查间隔随发帖速率在上下限之间变化；失败时按指数退避推迟检查。
+    """
+
+    def __init__(self, feeds: list, max_backoff_seconds: float = 3600, adaptive: bool = False,
+                 min_interval: float = 60, max_interval: float = 900, target_new_entries: float = 1.0):
+        self.feeds = {feed.name: feed for feed in feeds}
+        self.max_backoff_seconds = max_backoff_seconds
+        self._states = {}
+        for feed in feeds:
+            if adaptive:
+                adaptive_interval = AdaptiveInterval(feed.interval,
+                                            feed.min_interval if feed.min_interval is not None else min_interval,
+                                            feed.max_interval if feed.max_interval is not None else max_interval,
+                                            target_new_entries)
+            else:
+                adaptive_interval = None
+            self._states[feed.name] = FeedState(adaptive_interval)
+        self._lock = threading.Lock()
+
+    def get(self, name: str):
+        return self.feeds.get(name)
+
+    def names(self) -> list:
+        return list(self.feeds)
+
+    def current_interval(self, name: str) -> float:
+        """返回 feed 当前的检查间隔 (未开启自适应轮询时即配置的间隔)。"""
+        state = self._states[name]
+        return state.adaptive.current if state.adaptive else self.feeds[name].interval
+
+    def claim_due_feeds(self, now: float = None) -> list:
+        """返回所有已到检查时间且未在检查中的 feed，并将其标记为检查中。"""
+        now = time.monotonic() if now is None else now
+        due = []
+        with self._lock:
+            for name, state in self._states.items():
+                if not state.running and state.next_due <= now:
+                    state.running = True
+                    due.append(self.feeds[name])
+        return due
+
+    def record_success(self, name: str, new_entries: int = 0, now: float = None) -> float:
+        """记录一次成功的检查，返回距下次检查的秒数。"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            state = self._states[name]
+            state.running = False
+            state.consecutive_failures = 0
+            if state.adaptive:
+                elapsed = now - state.last_success_at if state.last_success_at is not None else 0
+                delay = state.adaptive.observe(new_entries, elapsed)
+            else:
+                delay = self.feeds[name].interval
+            state.last_success_at = now
+            state.next_due = now + delay
+            return delay
+
+    def record_failure(self, name: str, now: float = None) -> float:
+        """记录一次失败，返回距下次检查的秒数。"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            state = self._states[name]
+            state.running = False
+            state.consecutive_failures += 1
+            interval = state.adaptive.current if state.adaptive else self.feeds[name].interval
+            delay = min(interval * 2 ** (state.consecutive_failures - 1), self.max_backoff_seconds)
+            delay = max(delay, interval)
+            state.next_due = now + delay
+            return delay
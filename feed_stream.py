@@ -0,0 +1,103 @@
+"""
+增量解析 RSS / Atom feed。
+
+feedparser 会先解析整个文档并为每个帖子建立对象，而一轮检查通常只有最前面的几个帖子是新的。
+这里使用 ElementTree 的 XMLPullParser 分块喂入文档，每解析完一个 <item> / <entry> 就立即产出，
+调用方在遇到已处理过的帖子后即可停止，不再解析更旧的部分。
+产出的帖子对象兼容 feedparser 帖子中本项目用到的字段 (title、link、id、summary、content、tags)。
+"""
+import xml.etree.ElementTree as ElementTree
+
+CHUNK_SIZE = 16 * 1024
+# 可以流式解析的根元素 (RSS 2.0 / RSS 1.0 (RDF) / Atom)
+FEED_ROOTS = ('rss', 'RDF', 'feed')
+ENTRY_TAGS = ('item', 'entry')
+
+
+class FeedParseError(ValueError):
+    """文档不是格式正确的 RSS / Atom feed。"""
+
+
+class StreamedEntry(dict):
+    """一个帖子。与 feedparser 的帖子对象相同，既可按键访问，也可按属性访问。"""
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def _text(element) -> str:
+    # Atom 的 type="xhtml" 内容是子元素，其他情况下 itertext() 即元素文本
+    return ''.join(element.itertext()).strip()
+
+
+def _entry_from_element(element) -> StreamedEntry:
+    entry = StreamedEntry(title='', summary='', tags=[])
+    for child in element:
+        name = _local_name(child.tag)
+        if name == 'title':
+            entry['title'] = _text(child)
+        elif name == 'link':
+            # Atom: <link rel="alternate" href="..."/>；RSS: <link>...</link>
+            href = child.get('href')
+            if href is None:
+                entry.setdefault('link', _text(child))
+            elif child.get('rel', 'alternate') == 'alternate':
+                entry.setdefault('link', href)
+        elif name in ('guid', 'id'):
+            entry['id'] = _text(child)
+        elif name in ('description', 'summary'):
+            entry['summary'] = _text(child)
+        elif name in ('encoded', 'content'):
+            entry.setdefault('content', []).append({'value': _text(child)})
+        elif name == 'category':
+            entry['tags'].append({'term': child.get('term') or _text(child)})
+    if 'link' not in entry and entry.get('id'):
+        entry['link'] = entry['id']
+    return entry
+
+
+def iter_entries(body: bytes, chunk_size: int = CHUNK_SIZE):
+    """
+    按文档顺序 (通常从新到旧) 逐个产出帖子，只解析到调用方停止迭代为止。没有链接的帖子被跳过。
+    根元素不是 RSS / Atom 或 XML 格式错误时抛出 FeedParseError。
+    """
+    parser = ElementTree.XMLPullParser(events=('start', 'end'))
+    checked_root = False
+    depth = 0
+    for offset in range(0, len(body), chunk_size):
+        try:
+            parser.feed(body[offset:offset + chunk_size])
+            events = list(parser.read_events())
+        except ElementTree.ParseError as e:
+            raise FeedParseError(f"XML 格式错误: {e}") from e
+        for event, element in events:
+            if event == 'start':
+                depth += 1
+                if not checked_root:
+                    checked_root = True
+                    if _local_name(element.tag) not in FEED_ROOTS:
+                        raise FeedParseError(f"不支持的根元素 <{_local_name(element.tag)}>")
+                continue
+            depth -= 1
+            # 只取 feed 的直接条目 (RSS 2.0 中位于 <channel> 下)，忽略正文中嵌套的同名元素
+            if _local_name(element.tag) not in ENTRY_TAGS or depth > 2:
+                continue
+            entry = _entry_from_element(element)
+            # 已产出的帖子不再需要其子元素，释放内存
+            element.clear()
+            if entry.get('link'):
+                yield entry
+    try:
+        parser.close()
+    except ElementTree.ParseError as e:
+        raise FeedParseError(f"XML 格式错误: {e}") from e
+    if not checked_root:
+        raise FeedParseError("文档为空")
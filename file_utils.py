@@ -0,0 +1,68 @@
+"""数据文件读写的公共工具函数。"""
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+def atomic_write(path: str, content: str):
+    """先写入同目录下的临时文件，再用 os.replace 原子替换目标文件，避免写到一半时进程退出导致文件损坏。"""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class AppendLog:
+    """
+    只追加的记录文件。append() 暂存新行，flush() 一次性追加到文件末尾；文件行数将超过上限时
+    改为用当前完整内容重写 (压缩)。写入失败时暂存的行保留到下次 flush()，压缩失败时仍追加暂存的行，
+    保证已记录的内容不会只留在内存中。不加锁，由调用方在自己的锁内调用。
+    """
+
+    def __init__(self, path: str, name: str):
+        self.path = path
+        # 用于日志中的描述，例如 "推送记录"
+        self.name = name
+        # 文件中的行数 (加载时由调用方设置)
+        self.lines = 0
+        self._pending = []
+
+    def append(self, line: str):
+        self._pending.append(line)
+
+    def flush(self, max_lines: int, snapshot):
+        """追加暂存的行；文件行数将超过 max_lines 时改为写入 snapshot() 返回的全部行 (已包含暂存的内容)。"""
+        if self.lines + len(self._pending) > max_lines:
+            lines = snapshot()
+            try:
+                atomic_write(self.path, ''.join(lines))
+            except OSError as e:
+                logger.error(f"压缩{self.name}失败 ({self.path}): {e}", exc_info=True)
+            else:
+                logger.info(f"已压缩{self.name}: {self.lines + len(self._pending)} 行 -> {len(lines)} 行。")
+                self.lines = len(lines)
+                self._pending = []
+                return
+        if not self._pending:
+            return
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.writelines(self._pending)
+        except OSError as e:
+            logger.error(f"保存{self.name}失败 ({self.path}): {e}", exc_info=True)
+            return
+        self.lines += len(self._pending)
+        self._pending = []
@@ -0,0 +1,168 @@
+"""
+帖子内容指纹，用于识别重发、修改后重新发布以及同时出现在多个 feed 中的帖子。
+
+按链接去重无法识别内容相同但链接不同的帖子。这里对规范化后的标题 (以及正文开头) 取字符
+n-gram 片段计算 64 位 SimHash，内容相近的帖子指纹只相差少数几位。
+最近一段时间内的指纹保存在 LSH 索引中：指纹被切分为 max_distance + 1 段，相差不超过
+max_distance 位的两个指纹至少有一段完全相同，因此只需比较某一段相同的候选，查找耗时与
+窗口内的帖子总数基本无关。索引以只追加日志保存，超出时间窗口的指纹被淘汰。
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+
+from file_utils import AppendLog
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_BITS = 64
+SHINGLE_SIZE = 3
+# 正文只取开头部分：重发的帖子正文通常相同，而长正文会淹没标题的差异
+SUMMARY_CHARS = 200
+# 片段太少 (标题过短) 时指纹不可靠，不参与去重
+MIN_SHINGLES = 4
+
+# 只保留文字和数字，忽略标点、空白和 emoji 的差异
+_NON_WORD_RE = re.compile(r'[\W_]+')
+
+
+def shingles(text: str) -> set:
+    """文本 (应已规范化) 去除标点空白后的字符 n-gram 集合。"""
+    text = _NON_WORD_RE.sub('', text)
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+# 按位计数时把 64 位哈希的每一位展开为 16 位宽的计数槽，一次大整数加法即可同时累加 64 个计数。
+# _SPREAD[k][v] 为第 k 个字节取值为 v 时展开后的结果
+_LANE_BITS = 16
+_SPREAD = [[sum(1 << ((8 * k + bit) * _LANE_BITS) for bit in range(8) if value >> bit & 1) for value in range(256)]
+           for k in range(FINGERPRINT_BITS // 8)]
+_LANE_MASK = (1 << _LANE_BITS) - 1
+
+
+def simhash(features: set) -> int:
+    """各片段哈希的每一位按多数表决组合成 64 位指纹。"""
+    counts = 0
+    for feature in features:
+        # 指纹需要跨进程、跨重启保持一致，不能使用 hash()
+        digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+        for k, value in enumerate(digest):
+            counts += _SPREAD[k][value]
+    fingerprint = 0
+    for bit in range(FINGERPRINT_BITS):
+        # 该位为 1 的片段多于一半
+        if 2 * (counts >> (bit * _LANE_BITS) & _LANE_MASK) > len(features):
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def content_fingerprint(entry) -> int:
+    """帖子 (entry_pipeline.NormalizedEntry) 的内容指纹，内容过短时返回 None。"""
+    features = shingles(entry.fields['title'])
+    features |= shingles(entry.fields['summary'][:SUMMARY_CHARS])
+    # 计数槽为 16 位，片段数不能超过其上限 (正文已截断，实际远小于此)
+    if not MIN_SHINGLES <= len(features) < _LANE_MASK:
+        return None
+    return simhash(features)
+
+
+class FingerprintIndex:
+    """
+    最近 window_seconds 秒内出现过的帖子指纹。find_duplicates() 返回与给定指纹相差不超过
+    max_distance 位的其他帖子，add() 记录新指纹，写入磁盘推迟到 flush()。
+    """
+
+    def __init__(self, path: str, window_seconds: float = 86400, max_distance: int = 3):
+        self.path = path
+        self.window_seconds = window_seconds
+        self.max_distance = max_distance
+        # 段数为 max_distance + 1，每段 band_bits 位 (剩余的高位不参与分段)
+        self.band_count = max_distance + 1
+        self.band_bits = FINGERPRINT_BITS // self.band_count
+        self._band_mask = (1 << self.band_bits) - 1
+
+        self._lock = threading.Lock()
+        # 按时间顺序排列的 (记录时间, 指纹, feed 名称, 帖子去重键)
+        self._entries = deque()
+        # (段序号, 段的值) -> [记录, ...]
+        self._bands = {}
+        self._log = AppendLog(path, "帖子指纹")
+        self._load()
+
+    def _band_keys(self, fingerprint: int) -> list:
+        return [(band, fingerprint >> (band * self.band_bits) & self._band_mask) for band in range(self.band_count)]
+
+    def _load(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    self._log.lines += 1
+                    try:
+                        fingerprint, feed_name, key, recorded_at = line.rstrip('\n').split('\t')
+                        self._insert((float(recorded_at), int(fingerprint, 16), feed_name, key))
+                    except ValueError:
+                        # 进程在写入过程中退出时，最后一行可能不完整
+                        continue
+        except IOError as e:
+            logger.error(f"加载帖子指纹失败 ({self.path}): {e}", exc_info=True)
+            return
+        self._expire(time.time())
+        logger.info(f"已加载 {len(self._entries)} 个帖子指纹。")
+
+    def _insert(self, record: tuple):
+        self._entries.append(record)
+        for band_key in self._band_keys(record[1]):
+            self._bands.setdefault(band_key, []).append(record)
+
+    def _expire(self, now: float):
+        oldest_allowed = now - self.window_seconds
+        while self._entries and self._entries[0][0] < oldest_allowed:
+            record = self._entries.popleft()
+            for band_key in self._band_keys(record[1]):
+                bucket = self._bands[band_key]
+                bucket.remove(record)
+                if not bucket:
+                    del self._bands[band_key]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def find_duplicates(self, fingerprint: int, feed_name: str, key: str) -> list:
+        """返回窗口内与 fingerprint 相近的其他帖子 [(feed 名称, 帖子去重键), ...]，没有时返回空列表。"""
+        found = []
+        with self._lock:
+            self._expire(time.time())
+            for band_key in self._band_keys(fingerprint):
+                for _, other, other_feed, other_key in self._bands.get(band_key, ()):
+                    # 同一 feed 的同一个帖子 (上一轮处理中断后重新处理) 不算重复，出现在其他 feed 中的同一帖子算
+                    if (other_feed, other_key) == (feed_name, key) or (other_feed, other_key) in found:
+                        continue
+                    if bin(fingerprint ^ other).count('1') <= self.max_distance:
+                        found.append((other_feed, other_key))
+        return found
+
+    def add(self, fingerprint: int, feed_name: str, key: str):
+        now = time.time()
+        with self._lock:
+            self._insert((now, fingerprint, feed_name, key))
+            self._log.append(f"{fingerprint:016x}\t{feed_name}\t{key}\t{now:.0f}\n")
+
+    def flush(self):
+        """将新增的指纹一次性追加到日志；过期行过多时改为重写压缩整个文件。"""
+        with self._lock:
+            self._expire(time.time())
+            self._log.flush(2 * len(self._entries) + 1000,
+                            lambda: [f"{fingerprint:016x}\t{feed_name}\t{key}\t{recorded_at:.0f}\n"
+                                     for recorded_at, fingerprint, feed_name, key in self._entries])
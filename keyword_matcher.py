@@ -0,0 +1,135 @@
+"""
+基于 Aho-Corasick 自动机的关键词匹配器。
+
+把所有已启用用户的关键词构建为一个自动机，对每个帖子标题只扫描一遍，
+即可得到所有匹配的用户，避免 帖子 × 用户 × 关键词 的逐一比较。
+整词、正则与组合规则 (见 keyword_rules) 以其中的字面量作为触发词加入自动机，
+只有触发词命中时才进一步验证；不含字面量的正则规则对每个帖子求值。
+每个用户可以选择匹配的字段 (见 entry_pipeline)，自动机只扫描至少有一个用户使用的字段。
+"""
+from collections import deque
+
+from entry_pipeline import NormalizedEntry, user_match_fields
+from keyword_rules import RuleCache
+
+
+class KeywordMatcher:
+    """将帖子一次性映射到所有匹配的用户。"""
+
+    def __init__(self, subscriptions: dict, rule_cache: RuleCache = None):
+        """rule_cache 用于在多次重建之间复用各用户编译好的规则。"""
+        rule_cache = rule_cache if rule_cache is not None else RuleCache()
+        # 自动机状态: 每个状态的转移表、失败指针以及在该状态结束的模式编号
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        # 模式编号 -> [(user_id_str, 关键词在用户列表中的序号, 原始关键词, 需验证的 Conjunction 或 None,
+        #              用户的匹配字段), ...]
+        self._pattern_owners = []
+        # 没有触发词、需要对每个帖子求值的规则，元素格式同上
+        self._always_check = []
+        # 设置了排除规则的用户 -> (UserRules, 用户的匹配字段)
+        self._exclusions = {}
+        # 至少有一个用户使用的字段
+        self.fields_in_use = set()
+        # 关闭了关键词过滤 (或只设置了排除规则) 的用户，接收所有帖子
+        self.match_all_users = set()
+
+        pattern_ids = {}
+        for user_id_str, config in subscriptions.items():
+            if not config.get("enabled", False) or not config.get("chat_id"):
+                continue
+            rules = rule_cache.get(user_id_str, config.get("keywords", []))
+            fields = user_match_fields(config)
+            if rules.exclusions:
+                self._exclusions[user_id_str] = (rules, fields)
+                self.fields_in_use.update(fields)
+            if not config.get("keyword_filter_active", True) or (rules.exclusions and not rules.positive):
+                self.match_all_users.add(user_id_str)
+                continue
+            if rules.positive:
+                self.fields_in_use.update(fields)
+            for index, keyword, rule in rules.positive:
+                for conjunction in rule.alternatives:
+                    owner = (user_id_str, index, keyword, None if conjunction.exact else conjunction, fields)
+                    pattern = conjunction.trigger
+                    if pattern is None:
+                        self._always_check.append(owner)
+                        continue
+                    if pattern not in pattern_ids:
+                        pattern_ids[pattern] = len(self._pattern_owners)
+                        self._pattern_owners.append([])
+                        self._add_pattern(pattern, pattern_ids[pattern])
+                    self._pattern_owners[pattern_ids[pattern]].append(owner)
+        rule_cache.retain(subscriptions)
+
+        self.pattern_count = len(self._pattern_owners)
+        self._build_failure_links()
+
+    def _add_pattern(self, pattern: str, pattern_id: int):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][char] = next_state
+            state = next_state
+        self._output[state].append(pattern_id)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                # 合并失败状态上的输出，使匹配时无需沿失败链回溯
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find_patterns(self, text: str) -> set:
+        """返回在 text (需已规范化，见 entry_pipeline.normalize_text) 中出现的所有模式编号。"""
+        found = set()
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+    def match(self, entry) -> dict:
+        """
+        返回 {user_id_str: 匹配到的关键词}。entry 为 NormalizedEntry，也可以直接传入标题字符串。
+        关闭关键词过滤的用户对应的值为 None。若用户有多个关键词命中，取其列表中最靠前的一个。
+        命中排除规则的用户不会出现在结果中。
+        """
+        if isinstance(entry, str):
+            entry = NormalizedEntry(entry)
+        matched = {}
+        candidates = []
+        for field in self.fields_in_use:
+            for pattern_id in self.find_patterns(entry.fields[field]):
+                candidates.extend(owner for owner in self._pattern_owners[pattern_id] if field in owner[4])
+        for user_id_str, index, keyword, conjunction, fields in candidates + self._always_check:
+            current = matched.get(user_id_str)
+            if current is not None and current[0] <= index:
+                continue
+            if conjunction is None or conjunction.matches(entry.view(fields)):
+                matched[user_id_str] = (index, keyword)
+        result = {user_id_str: keyword for user_id_str, (_, keyword) in matched.items()}
+        for user_id_str in self.match_all_users:
+            result[user_id_str] = None
+        if self._exclusions:
+            for user_id_str in [uid for uid in result if uid in self._exclusions]:
+                rules, fields = self._exclusions[user_id_str]
+                if rules.excludes(entry.view(fields)):
+                    del result[user_id_str]
+        return result
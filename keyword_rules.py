@@ -0,0 +1,296 @@
+"""
+关键词规则的解析与编译。
+
+每条关键词都是一条规则，支持以下写法 (均不区分大小写):
+    vps                 子串匹配 (与旧版本相同)
+    w:vps               整词匹配，前后不能紧挨字母、数字或下划线，例如不会匹配 "vpsx"
+    re:^\\[出\\].*cn2    正则表达式
+    -出                 排除规则：标题匹配时不推送，即使其他关键词命中 (可与上面的写法组合，如 -w:收)
+    vps & 香港          所有条件都满足时匹配 (运算符两侧需有空格)
+    dmit | 搬瓦工       任一条件满足时匹配，& 的优先级高于 |
+    lit:-收             普通子串，不解析上面的任何语法 (旧版本保存的关键词升级时会自动加上该前缀，见 escape_legacy_keyword)
+
+正则规则中的 & 和 | 属于正则本身，不作为运算符。
+任何用户都可以添加正则规则，而匹配在所有用户共享的线程中进行，因此正则需满足 check_regex 的限制
+(长度、不能嵌套量词、不定长量词的个数等)，只搜索文本的前 REGEX_MAX_TEXT 个字符，单次匹配超过
+REGEX_SLOW_SECONDS 秒的规则会被停用，避免一条回溯严重的正则拖慢所有用户的推送。
+关键词与帖子使用相同的规范化 (见 entry_pipeline)，因此全角字母与半角字母视为相同。
+每个用户的规则只在关键词变化时编译一次，由 RuleCache 缓存。
+"""
+import logging
+import re
+import time
+
+from entry_pipeline import normalize_text
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+logger = logging.getLogger(__name__)
+
+# 用户配置中的 keyword_syntax 字段：没有该字段的配置来自只支持普通子串的旧版本
+RULE_SYNTAX_VERSION = 2
+
+WORD_PREFIX = 'w:'
+REGEX_PREFIX = 're:'
+LITERAL_PREFIX = 'lit:'
+EXCLUDE_PREFIX = '-'
+AND_SEPARATOR = ' & '
+OR_SEPARATOR = ' | '
+
+# 整词边界只看 ASCII 字母、数字和下划线，中文标题中词语之间通常没有空格
+_WORD_BOUNDARY_BEFORE = r'(?<![0-9a-z_])'
+_WORD_BOUNDARY_AFTER = r'(?![0-9a-z_])'
+_SINGLE_TOKEN_RE = re.compile(r'[0-9a-z_]+')
+
+# 用户正则的限制：模式长度、搜索的文本长度、每个用户的正则规则数
+MAX_REGEX_LENGTH = 100
+REGEX_MAX_TEXT = 300
+MAX_REGEX_RULES = 5
+# 最多允许两个不定长量词 (* + {m,} 等)：回溯的次数约为文本长度的 (不定长量词数 + 1) 次方。
+# 取值范围较小的量词 (? {1,3} 等) 按其取值个数计入
+MAX_REGEX_COST = REGEX_MAX_TEXT ** 3
+_SMALL_REPEAT_RANGE = 10
+# 单次匹配超过该耗时 (秒) 的正则被停用，直到用户修改关键词
+REGEX_SLOW_SECONDS = 0.1
+_REPEAT_OPCODES = {'MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT'}
+_BACKREF_OPCODES = {'GROUPREF', 'GROUPREF_EXISTS'}
+
+
+def _subpatterns(value):
+    """sre_parse 节点参数中包含的子模式。"""
+    if isinstance(value, sre_parse.SubPattern):
+        yield value
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            yield from _subpatterns(item)
+
+
+def _regex_cost(pattern, inside_repeat: bool = False) -> int:
+    """估算正则回溯的规模 (各量词取值个数之积)，遇到会导致指数级回溯的结构时抛出 ValueError。"""
+    cost = 1
+    for opcode, value in pattern:
+        name = str(opcode)
+        if name in _BACKREF_OPCODES:
+            raise ValueError("正则表达式不支持反向引用。")
+        if name == 'BRANCH' and inside_repeat:
+            raise ValueError("正则表达式中带量词的分组内不能使用 |，请改用字符集 (例如 [ab]+)。")
+        if name in _REPEAT_OPCODES:
+            low, high = value[0], value[1]
+            if high > 1:
+                if inside_repeat:
+                    raise ValueError("正则表达式不能嵌套量词 (例如 (a+)+)。")
+                cost *= high - low + 1 if high - low <= _SMALL_REPEAT_RANGE else REGEX_MAX_TEXT
+            elif high != low:
+                cost *= 2
+            for child in _subpatterns(value[2]):
+                cost *= _regex_cost(child, inside_repeat or high > 1)
+            continue
+        for child in _subpatterns(value):
+            cost *= _regex_cost(child, inside_repeat)
+    return cost
+
+
+def check_regex(pattern: str):
+    """检查用户正则是否满足限制 (见模块说明)，不满足时抛出 ValueError。"""
+    if len(pattern) > MAX_REGEX_LENGTH:
+        raise ValueError(f"正则表达式不能超过 {MAX_REGEX_LENGTH} 个字符。")
+    try:
+        parsed = sre_parse.parse(pattern, re.IGNORECASE)
+    except re.error as e:
+        raise ValueError(f"正则表达式无效: {e}")
+    if REGEX_MAX_TEXT * _regex_cost(parsed) > MAX_REGEX_COST:
+        raise ValueError("正则表达式过于复杂：最多使用两个 * 或 + 这样的不定长量词。")
+
+
+class Term:
+    """
+    规则中的一个条件。literal 为可用于 Aho-Corasick 预筛选的规范化字面量，正则条件为 None。
+    token 为 True 时 literal 本身是一个完整的词，整词匹配可直接查分词结果。
+    guarded 为 True 表示用户编写的正则，只搜索文本开头并在过慢时停用。
+    """
+    __slots__ = ('literal', 'regex', 'token', 'guarded', 'disabled')
+
+    def __init__(self, literal: str = None, regex=None, token: bool = False, guarded: bool = False):
+        self.literal = literal
+        self.regex = regex
+        self.token = token
+        self.guarded = guarded
+        self.disabled = False
+
+    def matches(self, view) -> bool:
+        """view 为 entry_pipeline.TextView。"""
+        if self.token:
+            return self.literal in view.tokens
+        if self.guarded:
+            return self._guarded_search(view.text)
+        if self.regex is not None:
+            return self.regex.search(view.text) is not None
+        return self.literal in view.text
+
+    def _guarded_search(self, text: str) -> bool:
+        if self.disabled:
+            return False
+        started = time.perf_counter()
+        found = self.regex.search(text, 0, REGEX_MAX_TEXT) is not None
+        elapsed = time.perf_counter() - started
+        if elapsed > REGEX_SLOW_SECONDS:
+            self.disabled = True
+            logger.warning("正则规则 '%s' 单次匹配耗时 %.2f 秒，已停用 (用户修改关键词后重新启用)。",
+                           self.regex.pattern, elapsed)
+        return found
+
+
+class Conjunction:
+    """若干条件同时满足 (AND)。"""
+    __slots__ = ('terms', 'trigger', 'exact')
+
+    def __init__(self, terms: list):
+        self.terms = terms
+        literals = [term.literal for term in terms if term.literal]
+        # 取最长的字面量作为预筛选触发词，没有字面量时需要对每个帖子求值
+        self.trigger = max(literals, key=len) if literals else None
+        # 只有一个子串条件时，触发词命中即匹配，无需再次验证
+        self.exact = len(terms) == 1 and terms[0].regex is None
+
+    def matches(self, view) -> bool:
+        return all(term.matches(view) for term in self.terms)
+
+
+class KeywordRule:
+    """一条关键词规则：若干 Conjunction 之一满足 (OR) 即匹配。exclude 为 True 时表示排除规则。"""
+    __slots__ = ('source', 'exclude', 'alternatives')
+
+    def __init__(self, source: str, exclude: bool, alternatives: list):
+        self.source = source
+        self.exclude = exclude
+        self.alternatives = alternatives
+
+    def matches(self, view) -> bool:
+        return any(conjunction.matches(view) for conjunction in self.alternatives)
+
+    @property
+    def uses_regex(self) -> bool:
+        """是否包含用户编写的正则 (计入 MAX_REGEX_RULES)。"""
+        return any(term.guarded for conjunction in self.alternatives for term in conjunction.terms)
+
+
+def _parse_term(text: str) -> Term:
+    text = text.strip()
+    lowered = normalize_text(text)
+    if lowered.startswith(REGEX_PREFIX):
+        pattern = text[len(REGEX_PREFIX):]
+        if not pattern:
+            raise ValueError("正则表达式不能为空。")
+        check_regex(pattern)
+        try:
+            return Term(regex=re.compile(pattern, re.IGNORECASE), guarded=True)
+        except re.error as e:
+            raise ValueError(f"正则表达式无效: {e}")
+    if lowered.startswith(WORD_PREFIX):
+        word = lowered[len(WORD_PREFIX):].strip()
+        if not word:
+            raise ValueError("整词匹配的关键词不能为空。")
+        return Term(literal=word, regex=re.compile(_WORD_BOUNDARY_BEFORE + re.escape(word) + _WORD_BOUNDARY_AFTER),
+                    token=bool(_SINGLE_TOKEN_RE.fullmatch(word)))
+    if not lowered:
+        raise ValueError("关键词不能为空。")
+    return Term(literal=lowered)
+
+
+def parse_rule(source: str) -> KeywordRule:
+    """解析一条关键词规则，格式无效时抛出 ValueError (消息可直接展示给用户)。"""
+    text = source.strip()
+    if normalize_text(text).startswith(LITERAL_PREFIX):
+        literal = normalize_text(text[len(LITERAL_PREFIX):])
+        if not literal:
+            raise ValueError("关键词不能为空。")
+        return KeywordRule(source, False, [Conjunction([Term(literal=literal)])])
+    exclude = text.startswith(EXCLUDE_PREFIX) and len(text) > len(EXCLUDE_PREFIX)
+    if exclude:
+        text = text[len(EXCLUDE_PREFIX):].strip()
+
+    if normalize_text(text).startswith(REGEX_PREFIX):
+        alternatives = [Conjunction([_parse_term(text)])]
+    else:
+        alternatives = [Conjunction([_parse_term(part) for part in group.split(AND_SEPARATOR)])
+                        for group in text.split(OR_SEPARATOR)]
+    return KeywordRule(source, exclude, alternatives)
+
+
+def escape_legacy_keyword(keyword: str) -> str:
+    """
+    旧版本中所有关键词都是普通子串。返回在当前语法下含义不变的写法：会被解析为排除、组合、
+    整词或正则规则的关键词加上 LITERAL_PREFIX，其余关键词原样返回。
+    """
+    text = keyword.strip()
+    lowered = normalize_text(text)
+    if (text.startswith(EXCLUDE_PREFIX) and len(text) > len(EXCLUDE_PREFIX)
+            or AND_SEPARATOR in text or OR_SEPARATOR in text
+            or lowered.startswith((WORD_PREFIX, REGEX_PREFIX, LITERAL_PREFIX))):
+        return LITERAL_PREFIX + keyword
+    return keyword
+
+
+def check_regex_rule_count(keywords: list):
+    """用户的正则规则超过 MAX_REGEX_RULES 条时抛出 ValueError。无效的规则不计入。"""
+    count = 0
+    for keyword in keywords:
+        try:
+            count += parse_rule(keyword).uses_regex
+        except ValueError:
+            continue
+    if count > MAX_REGEX_RULES:
+        raise ValueError(f"每个用户最多设置 {MAX_REGEX_RULES} 条正则规则。")
+
+
+class UserRules:
+    """一个用户编译后的全部规则。positive 为 [(关键词序号, 原始关键词, KeywordRule)]。"""
+    __slots__ = ('positive', 'exclusions')
+
+    def __init__(self, keywords: list, on_invalid=None):
+        self.positive = []
+        self.exclusions = []
+        regex_rules = 0
+        for index, keyword in enumerate(keywords):
+            try:
+                rule = parse_rule(keyword)
+                if rule.uses_regex:
+                    regex_rules += 1
+                    if regex_rules > MAX_REGEX_RULES:
+                        raise ValueError(f"每个用户最多设置 {MAX_REGEX_RULES} 条正则规则。")
+            except ValueError as e:
+                # 手动编辑数据文件、旧版本保存的规则不再满足限制等情况，跳过而不影响其他规则
+                if on_invalid:
+                    on_invalid(keyword, e)
+                continue
+            if rule.exclude:
+                self.exclusions.append(rule)
+            else:
+                self.positive.append((index, keyword, rule))
+
+    def excludes(self, view) -> bool:
+        return any(rule.matches(view) for rule in self.exclusions)
+
+
+class RuleCache:
+    """按用户缓存编译后的规则，用户的关键词列表变化时重新编译。"""
+
+    def __init__(self, on_invalid=None):
+        self.on_invalid = on_invalid
+        self._entries = {}
+
+    def get(self, user_id_str: str, keywords: list) -> UserRules:
+        key = tuple(keywords)
+        entry = self._entries.get(user_id_str)
+        if entry is None or entry[0] != key:
+            entry = self._entries[user_id_str] = (key, UserRules(keywords, self.on_invalid))
+        return entry[1]
+
+    def retain(self, user_ids):
+        """丢弃不在 user_ids 中的用户的缓存。"""
+        user_ids = set(user_ids)
+        for user_id_str in [uid for uid in self._entries if uid not in user_ids]:
+            del self._entries[user_id_str]
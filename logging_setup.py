@@ -0,0 +1,77 @@
+"""
+日志配置。
+
+所有日志记录先放入内存队列 (QueueHandler)，由后台线程 (QueueListener) 格式化并写出，
+RSS 检查和投递线程不会因为写日志而等待 I/O。LOG_FORMAT=json 时每条记录输出为一行 JSON，
+调用 logger 时通过 extra={...} 传入的字段 (例如 feed、新帖子数) 作为独立的键输出，便于日志系统检索。
+
+热路径上的日志使用 %s 占位符而不是 f-string，级别未启用时不会格式化消息；
+逐个用户的记录 (匹配、发送成功) 使用 DEBUG 级别，默认只输出每轮的汇总。
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# LogRecord 自带的属性，其余属性来自 extra
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON：时间、级别、logger 名称、消息、extra 字段以及异常堆栈。"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exc_info'] = record.exc_text
+        if record.stack_info:
+            data['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    标准 QueueHandler 在入队前就在调用线程中格式化消息。这里只在有异常时提前转换堆栈
+    (异常对象不能留到其他线程)，消息由后台线程格式化。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_logging(level: str = 'INFO', log_format: str = 'text') -> logging.handlers.QueueListener:
+    """把根 logger 的输出改为经由队列写到 stderr，返回已启动的 QueueListener (退出时自动停止并写出剩余记录)。"""
+    handler = logging.StreamHandler(sys.stderr)
+    if log_format == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(_QueueHandler(queue.SimpleQueue()))
+    root.setLevel(getattr(logging, str(level).upper(), logging.INFO))
+
+    listener = logging.handlers.QueueListener(root.handlers[0].queue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
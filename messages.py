@@ -0,0 +1,147 @@
+"""
+预先渲染的消息文本。
+
+命令回复中不随用户变化的 MarkdownV2 文本在导入时转义一次；每个帖子的推送消息
+(MarkdownV2 版本与纯文本后备版本) 每轮只渲染一次，由所有收件人共享。
+"""
+import time
+
+from telegram.utils.helpers import escape_markdown
+
+
+def md(text: str) -> str:
+    """按 MarkdownV2 规则转义文本。"""
+    return escape_markdown(text, version=2)
+
+
+class RenderedPost:
+    """一个帖子渲染后的推送内容。"""
+    __slots__ = ('title', 'link', 'markdown', 'plain', 'description')
+
+    def __init__(self, title: str, link: str):
+        self.title = title
+        self.link = link
+        self.markdown = f"*{md(title)}*\n\n{link}"
+        self.plain = f"{title}\n\n{link}"
+        self.description = f"帖子 '{title}'"
+
+
+# --- /start 帮助信息 (问候语之后的部分) ---
+_COMMANDS_DESCRIPTIONS = [
+    f"/start \\- {md('显示此帮助信息')}",
+    f"/addkeyword \\<关键词或短语\\> \\- {md('添加关键词。支持 w:整词、re:正则、-排除词，以及 a & b、a | b 组合。')}", # 转义 < >
+    f"/delkeyword \\<关键词或短语 或 序号\\> \\- {md('删除关键词。')}", # 转义 < >
+    f"/editkeyword \\<序号\\> \\<新的关键词或短语\\> \\- {md('修改关键词。')}", # 转义 < >
+    f"/listkeywords \\- {md('显示您订阅的关键词。')}",
+    f"/togglefilter \\- {md('切换关键词过滤模式 (开/关)。')}",
+    f"/enablenotifications \\- {md('开启所有来自此机器人的通知。')}",
+    f"/disablenotifications \\- {md('关闭所有来自此机器人的通知。')}",
+    f"/myrssstatus \\- {md('查看您当前的订阅状态和最近的推送记录。')}",
+    f"/myrssstatus \\<帖子 ID 或链接\\> \\- {md('查看某个帖子是否推送给了您。')}",
+    f"/feeds \\- {md('查看可订阅的 feed。')}",
+    f"/subscribefeed \\<名称\\> \\- {md('订阅一个 feed。')}",
+    f"/unsubscribefeed \\<名称\\> \\- {md('退订一个 feed。')}",
+    f"/matchfields \\<字段\\.\\.\\.\\> \\- {md('设置关键词匹配的字段: title (标题)、summary (正文)、category (分类)。')}",
+    f"/digest \\- {md('设置摘要模式，将多个帖子合并为一条消息推送。')}",
+]
+
+START_HELP_BODY = "\n".join(
+    [md("\n我可以根据您设置的关键词，在 RSS 有新帖子时通知您。\n"), md("可用命令:")]
+    + _COMMANDS_DESCRIPTIONS
+    + [md("\n我会定期检查新帖子！")] # 转义感叹号
+)
+
+# --- 关键词列表 ---
+NO_KEYWORDS_TEXT = md("您还没有设置任何关键词。使用 /addkeyword 命令来添加吧！")
+KEYWORDS_HEADER = md("您当前订阅的关键词 (匹配时不区分大小写):")
+
+# --- 通知开关 ---
+NOTIFICATIONS_TEXT = {
+    enable: f"{'🔔' if enable else '🔕'} {md('您(来自此机器人的)所有通知已设为 ')}**{md('开启' if enable else '关闭')}**。"
+    for enable in (True, False)
+}
+
+# --- 关键词过滤开关 ---
+_FILTER_NOTE = md("（请注意：总体通知开关 /enablenotifications 必须也为开启状态才会收到推送。）"
+                  .replace("（", "(").replace("）", ")"))
+FILTER_TOGGLED_TEXT = {
+    True: f"🔎 您的关键词过滤模式已更新为: **{md('开启 (仅推送匹配关键词的帖子)')}**。\n{_FILTER_NOTE}",
+    False: f"📢 您的关键词过滤模式已更新为: **{md('关闭 (推送所有帖子)')}**。\n{_FILTER_NOTE}",
+}
+
+# --- /myrssstatus ---
+STATUS_HEADER = md("ℹ️ 您当前的 RSS 订阅状态:")
+STATUS_ENABLED_LINE = {
+    True: f"🔔 {md('总体通知: ')}**{md('开启')}**",
+    False: f"🔕 {md('总体通知: ')}**{md('关闭')}**",
+}
+STATUS_FILTER_LINE = {
+    True: f"🔎 {md('关键词过滤: ')}**{md('开启 (仅关键词)')}**",
+    False: f"📢 {md('关键词过滤: ')}**{md('关闭 (所有帖子)')}**",
+}
+STATUS_NO_KEYWORDS = md("📜 关键词列表: 您还没有设置任何关键词。")
+STATUS_KEYWORDS_HEADER = md("📜 您已设置的关键词 (匹配时不区分大小写):")
+STATUS_NO_KEYWORDS_TIP = "\n**⚠️** " + md("提示: 当前关键词过滤已开启，但您没有设置任何关键词，因此不会收到任何帖子。"
+                                          "请添加关键词或使用 /togglefilter 关闭过滤以接收所有帖子。")
+
+# --- 推送记录 (/myrssstatus) ---
+STATUS_HISTORY_HEADER = md("🧾 最近的推送:")
+STATUS_NO_HISTORY = md("🧾 最近的推送: 暂无记录。")
+_OUTCOME_LABELS = {
+    'sent': "✅ 已推送",
+    'digest': "🗞 已加入摘要",
+    'digest_sent': "✅ 已随摘要推送",
+    'failed': "❌ 推送失败",
+}
+FAILURE_REASONS = {
+    'forbidden': "机器人被屏蔽或账户已停用",
+    'blocked': "机器人被屏蔽或账户已停用",
+    'bad_request': "消息被 Telegram 拒绝",
+    'max_attempts': "多次重试后仍未成功",
+}
+
+
+def history_line(record) -> str:
+    """渲染一条推送记录 (delivery_history.DeliveryRecord)。"""
+    label = _OUTCOME_LABELS.get(record.outcome, record.outcome)
+    if record.reason:
+        label += f" ({FAILURE_REASONS.get(record.reason, record.reason)})"
+    text = f"{time.strftime('%m-%d %H:%M', time.localtime(record.at))} {label}: {record.title or '帖子 ' + record.post_key}"
+    if record.keyword:
+        text += f" [关键词: {record.keyword}]"
+    return md(text)
+
+
+def numbered_keywords(keywords: list) -> list:
+    """渲染带序号的关键词列表行。"""
+    return [f"  {i+1}\\. {md(kw)}" for i, kw in enumerate(keywords)]
+
+
+# --- 摘要消息 ---
+# Telegram 单条消息的最大长度
+MAX_MESSAGE_LENGTH = 4096
+
+
+def render_digest(items: list) -> list:
+    """
+    把多个帖子渲染为摘要消息，超过 MAX_MESSAGE_LENGTH 时按帖子拆分为多条。
+    items 为 [{'title': ..., 'link': ...}, ...]，返回 [(MarkdownV2 文本, 纯文本, 该条消息包含的 items), ...]。
+    """
+    header = f"📰 {len(items)} 条新帖子"
+    messages = []
+    markdown_parts, plain_parts, chunk = [md(header)], [header], []
+    length = len(markdown_parts[0])
+    for item in items:
+        # 单个帖子的标题过长时截断，保证每条消息至少能容纳一个帖子
+        title = item['title'] if len(item['title']) <= 1000 else item['title'][:1000] + "…"
+        markdown_block = f"• *{md(title)}*\n{md(item['link'])}"
+        if chunk and length + 2 + len(markdown_block) > MAX_MESSAGE_LENGTH:
+            messages.append(("\n\n".join(markdown_parts), "\n\n".join(plain_parts), chunk))
+            markdown_parts, plain_parts, chunk = [md(header + " (续)")], [header + " (续)"], []
+            length = len(markdown_parts[0])
+        markdown_parts.append(markdown_block)
+        plain_parts.append(f"• {title}\n{item['link']}")
+        chunk.append(item)
+        length += 2 + len(markdown_block)
+    messages.append(("\n\n".join(markdown_parts), "\n\n".join(plain_parts), chunk))
+    return messages
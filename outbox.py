@@ -0,0 +1,244 @@
+"""
+持久化的发件箱。
+
+每条待发送的消息 (用户 × 帖子) 先写入发件箱，再标记帖子为已处理，最后才交给投递队列；
+只有 Telegram 确认收到后才标记为完成，临时错误按退避时间重试，进程重启时重新投递未完成的消息。
+同一用户的同一帖子 (或同一组摘要帖子) 在保留期内只会进入发件箱一次，重复处理不会重复发送。
+
+默认实现把状态变化追加到 JSON Lines 日志文件中，日志过长时压缩；
+SQLite 后端的实现见 sqlite_storage.SqliteOutbox。
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from file_utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+def dedup_key(job) -> str:
+    """用于去重的键: 用户 + 帖子，摘要消息为用户 + 所含帖子的哈希，广播为用户 + 广播编号。无法去重的消息返回 None。"""
+    if job.post_key:
+        return f"{job.user_id_str}|{job.feed_name}|{job.post_key}"
+    if job.broadcast_id is not None:
+        return f"{job.user_id_str}|broadcast|{job.broadcast_id}"
+    if job.posts:
+        digest = hashlib.sha1("\n".join(f"{feed}|{key}" for feed, key in job.posts).encode('utf-8')).hexdigest()
+        return f"{job.user_id_str}|digest|{digest}"
+    return None
+
+
+class Outbox:
+    """
+    以追加日志保存的发件箱。
+    write() 在一次写入中持久化一批消息并返回实际新增的消息 (已去重)，由调用方放入投递队列。
+    每个调用方 (RSS 检查、摘要、广播) 传入自己的一批消息，互不影响。
+    """
+
+    def __init__(self, path: str, retention_seconds: float = 7 * 86400):
+        self.path = path
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        # 未完成的消息: id -> {'key', 'job', 'attempts', 'next_at'}
+        self._pending = {}
+        # 去重键 -> 完成时间 (未完成的消息为 None)，已完成的键保留 retention_seconds
+        self._keys = OrderedDict()
+        self._next_id = 1
+        self._log_lines = 0
+        self._file = None
+        self._load()
+
+    # --- 对外接口 ---
+
+    def write(self, jobs: list) -> list:
+        """持久化 jobs，返回新写入的消息 (重复的消息被忽略)。写入失败时仍返回消息，但不再保证重启后重发。"""
+        if not jobs:
+            return []
+        candidates = []
+        batch_keys = set()
+        for job in jobs:
+            key = dedup_key(job)
+            if key is not None:
+                if key in batch_keys:
+                    continue
+                batch_keys.add(key)
+            candidates.append((key, job))
+        try:
+            return self._insert(candidates)
+        except Exception as e:
+            logger.error(f"写入发件箱失败: {e}。本批 {len(candidates)} 条消息将不经持久化直接发送。", exc_info=True)
+            return [job for _, job in candidates]
+
+    def ack(self, job):
+        """Telegram 已确认收到消息。"""
+        self._finish(job, 'done')
+
+    def fail(self, job, reason: str = ''):
+        """消息无法发送 (例如用户屏蔽了机器人)，不再重试。"""
+        self._finish(job, 'failed')
+
+    def retry(self, job, next_attempt_at: float):
+        """记录消息的重试次数、下次尝试时间 (时间戳) 以及可能变化的 chat_id。"""
+        if job.outbox_id is None:
+            return
+        job.next_attempt_at = next_attempt_at
+        try:
+            self._record_retry(job)
+        except Exception as e:
+            logger.error(f"更新发件箱中消息 {job.outbox_id} 的重试状态失败: {e}", exc_info=True)
+
+    def pending_jobs(self) -> list:
+        """返回所有未完成的消息 (按写入顺序)，job.next_attempt_at 为下次尝试时间。用于启动时重新投递。"""
+        from delivery import DeliveryJob
+        with self._lock:
+            records = [(outbox_id, dict(record)) for outbox_id, record in sorted(self._pending.items())]
+        jobs = []
+        for outbox_id, record in records:
+            job = DeliveryJob.from_dict(record['job'])
+            job.outbox_id = outbox_id
+            job.attempts = record['attempts']
+            job.next_attempt_at = record['next_at']
+            jobs.append(job)
+        return jobs
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def _finish(self, job, status: str):
+        if job.outbox_id is None:
+            return
+        try:
+            self._record_finished(job, status)
+        except Exception as e:
+            logger.error(f"更新发件箱中消息 {job.outbox_id} 的状态失败: {e}", exc_info=True)
+
+    # --- 持久化 (SQLite 后端覆盖以下方法) ---
+
+    def _load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    self._log_lines += 1
+                    try:
+                        self._apply(json.loads(line))
+                    except (ValueError, KeyError):
+                        # 进程在写入过程中退出时，最后一行可能不完整
+                        logger.warning(f"忽略发件箱日志中无法解析的一行 ({self.path})。")
+        self._prune(time.time())
+        if self._pending:
+            logger.info(f"发件箱中有 {len(self._pending)} 条未完成的消息，将在启动后重新投递。")
+        self._compact()
+
+    def _apply(self, record: dict):
+        op = record['op']
+        if op == 'add':
+            outbox_id = record['id']
+            self._pending[outbox_id] = {'key': record.get('key'), 'job': record['job'],
+                                        'attempts': record.get('attempts', 0),
+                                        'next_at': record.get('next_at', record.get('at', 0))}
+            if record.get('key'):
+                self._keys[record['key']] = None
+            self._next_id = max(self._next_id, outbox_id + 1)
+        elif op in ('done', 'failed'):
+            pending = self._pending.pop(record['id'], None)
+            if pending and pending['key']:
+                self._keys.pop(pending['key'], None)
+                self._keys[pending['key']] = record['at']
+        elif op == 'retry':
+            pending = self._pending.get(record['id'])
+            if pending:
+                pending['attempts'] = record['attempts']
+                pending['next_at'] = record['next_at']
+                pending['job']['chat_id'] = record.get('chat_id', pending['job']['chat_id'])
+        elif op == 'finished':
+            self._keys[record['key']] = record['at']
+
+    def _prune(self, now: float):
+        """淘汰超出保留期的已完成去重键 (按完成时间排列，最早的在前)。"""
+        cutoff = now - self.retention_seconds
+        for key, finished_at in list(self._keys.items()):
+            if finished_at is None:
+                continue
+            if finished_at >= cutoff:
+                break
+            del self._keys[key]
+
+    def _append(self, records: list, sync: bool = False):
+        """在持有 self._lock 时调用。"""
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+        self._log_lines += len(records)
+        if self._log_lines > 2 * (len(self._pending) + len(self._keys)) + 1000:
+            self._prune(time.time())
+            self._compact()
+
+    def _compact(self):
+        """用当前状态重写日志。在持有 self._lock (或初始化) 时调用。"""
+        records = [{'op': 'finished', 'key': key, 'at': finished_at}
+                   for key, finished_at in self._keys.items() if finished_at is not None]
+        records += [{'op': 'add', 'id': outbox_id, 'key': record['key'], 'job': record['job'],
+                     'attempts': record['attempts'], 'next_at': record['next_at']}
+                    for outbox_id, record in sorted(self._pending.items())]
+        if self._file:
+            self._file.close()
+            self._file = None
+        if not records and not os.path.exists(self.path):
+            return
+        atomic_write(self.path, ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+        self._log_lines = len(records)
+
+    def _insert(self, candidates: list) -> list:
+        now = time.time()
+        accepted = []
+        records = []
+        with self._lock:
+            for key, job in candidates:
+                if key is not None and key in self._keys:
+                    continue
+                job.outbox_id = self._next_id
+                self._next_id += 1
+                job.next_attempt_at = now
+                records.append({'op': 'add', 'id': job.outbox_id, 'key': key, 'job': job.to_dict(), 'at': now})
+                accepted.append(job)
+            if not records:
+                return []
+            for record in records:
+                self._apply(record)
+            self._append(records, sync=True)
+        return accepted
+
+    def _record_finished(self, job, status: str):
+        with self._lock:
+            if job.outbox_id not in self._pending:
+                return
+            record = {'op': status, 'id': job.outbox_id, 'at': time.time()}
+            self._apply(record)
+            self._append([record])
+
+    def _record_retry(self, job):
+        with self._lock:
+            if job.outbox_id not in self._pending:
+                return
+            record = {'op': 'retry', 'id': job.outbox_id, 'attempts': job.attempts,
+                      'next_at': job.next_attempt_at, 'chat_id': job.chat_id}
+            self._apply(record)
+            self._append([record])
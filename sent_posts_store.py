@@ -0,0 +1,127 @@
+"""
+有界的已处理帖子去重存储。
+
+RSS feed 只会返回最近的一批帖子，因此只需记住一个有限的窗口（按条数和时间）。
+内存中使用按插入顺序排列的字典，超出窗口的旧记录被淘汰；磁盘上的记录文件是
+只追加的日志，每轮检查批量追加一次，当日志中的过期行过多时整体重写压缩。
+记录文件较大时可在后台线程中加载，机器人不必等待加载完成即可开始处理命令。
+"""
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from file_utils import AppendLog
+
+logger = logging.getLogger(__name__)
+
+# NodeSeek 帖子链接形如 https://www.nodeseek.com/post-123456-1，数字部分即帖子 ID
+NODESEEK_POST_ID_RE = re.compile(r'nodeseek\.com/post-(\d+)')
+
+
+def post_key(link: str, key_by_post_id: bool = True) -> str:
+    """返回帖子的去重键：能解析出 NodeSeek 帖子 ID 时使用 ID，否则使用完整链接。"""
+    if key_by_post_id:
+        match = NODESEEK_POST_ID_RE.search(link)
+        if match:
+            return match.group(1)
+    return link
+
+
+class SentPostStore:
+    """
+    记住最近处理过的帖子，条数和存活时间都有上限。
+    background_load 为 True 时在后台线程中加载记录文件，加载完成前访问记录的调用会等待。
+    """
+
+    def __init__(self, path: str, max_entries: int = 5000, max_age_seconds: float = 30 * 86400,
+                 key_by_post_id: bool = True, background_load: bool = False):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.key_by_post_id = key_by_post_id
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # 去重键 -> 首次记录时间
+        self._log = AppendLog(path, "全局已发送帖子记录")
+        self._loaded = threading.Event()
+        if background_load:
+            threading.Thread(target=self._load, name='sent-posts-load', daemon=True).start()
+        else:
+            self._load()
+
+    def _load(self):
+        try:
+            self._read_log()
+        finally:
+            self._loaded.set()
+
+    def _read_log(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if not os.path.exists(self.path):
+            return
+        now = time.time()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    self._log.lines += 1
+                    # 新格式为 "去重键\t时间戳"；旧版本文件每行只有完整链接，视为刚刚记录
+                    key, _, timestamp = line.partition('\t')
+                    try:
+                        recorded_at = float(timestamp) if timestamp else now
+                    except ValueError:
+                        recorded_at = now
+                    key = post_key(key, self.key_by_post_id)
+                    self._entries.pop(key, None)
+                    self._entries[key] = recorded_at
+        except IOError as e:
+            logger.error(f"加载全局已发送帖子记录失败 ({self.path}): {e}。将返回空集合。", exc_info=True)
+            return
+        self._evict(now)
+        logger.info(f"已加载 {len(self._entries)} 条已处理帖子记录 (日志共 {self._log.lines} 行)。")
+
+    def __contains__(self, link: str) -> bool:
+        key = post_key(link, self.key_by_post_id)
+        self._loaded.wait()
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        self._loaded.wait()
+        with self._lock:
+            return len(self._entries)
+
+    def add(self, link: str):
+        """记录一个已处理的帖子。写入磁盘推迟到 flush()。"""
+        key = post_key(link, self.key_by_post_id)
+        now = time.time()
+        self._loaded.wait()
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = now
+            self._log.append(f"{key}\t{now:.0f}\n")
+            self._evict(now)
+
+    def _evict(self, now: float):
+        oldest_allowed = now - self.max_age_seconds
+        while self._entries:
+            key, recorded_at = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and recorded_at >= oldest_allowed:
+                break
+            self._entries.popitem(last=False)
+
+    def flush(self):
+        """将本轮新增的记录一次性追加到日志；过期行过多时改为重写压缩整个文件。"""
+        self._loaded.wait()
+        with self._lock:
+            self._evict(time.time())
+            self._log.flush(2 * max(len(self._entries), self.max_entries // 2),
+                            lambda: [f"{key}\t{recorded_at:.0f}\n" for key, recorded_at in self._entries.items()])
@@ -0,0 +1,222 @@
+"""
+多进程分片部署 (WORKER_PROCESSES > 0)。
+
+主进程处理 Telegram 命令、抓取并解析 feed，然后把每个 feed 的新帖子通过本地 Unix socket 发布给
+N 个工作进程。每个工作进程负责按用户 ID 哈希分到自己的那部分用户，独立完成关键词匹配、摘要缓冲和发送
+(拥有各自的发件箱和投递队列)，因此匹配与发送不再受单个进程的 GIL 和 JobQueue 线程限制。
+
+主进程在所有工作进程确认 (新帖子已写入各自的发件箱或摘要缓冲) 后才把帖子标记为已处理；
+否则下一轮会重新发布这些帖子，已写入发件箱的推送由去重键过滤。工作进程退出后由主进程重新启动，
+并重新投递其发件箱中未完成的消息，因此重启不会导致重复发送或漏发。
+"""
+import itertools
+import logging
+import os
+import secrets
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import zlib
+from multiprocessing.connection import Client, Listener
+
+logger = logging.getLogger(__name__)
+
+
+def shard_for(user_id_str: str, shard_count: int) -> int:
+    """用户所属的分片。使用 crc32 而不是 hash()，保证在不同进程和重启之间结果一致。"""
+    return zlib.crc32(user_id_str.encode('utf-8')) % shard_count
+
+
+def partition_subscriptions(subscriptions: dict, shard_index: int, shard_count: int) -> dict:
+    return {user_id_str: config for user_id_str, config in subscriptions.items()
+            if shard_for(user_id_str, shard_count) == shard_index}
+
+
+def connect_to_coordinator(address: str, authkey_hex: str, shard_index: int):
+    """工作进程连接主进程，返回双向的 multiprocessing Connection。"""
+    conn = Client(address, family='AF_UNIX', authkey=bytes.fromhex(authkey_hex))
+    conn.send(('hello', shard_index))
+    return conn
+
+
+class _Worker:
+    __slots__ = ('index', 'process', 'conn', 'send_lock', 'subscriptions_version')
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.send_lock = threading.Lock()
+        self.subscriptions_version = None
+
+
+class ShardPool:
+    """
+    主进程中的工作进程管理：启动与重启工作进程、同步各分片的订阅、发布新帖子并等待确认。
+    command 为启动工作进程的命令行；工作进程通过环境变量 SHARD_INDEX / SHARD_COUNT / SHARD_SOCKET /
+    SHARD_AUTHKEY 得知自己的分片和主进程地址。on_event(event) 在读取线程中处理工作进程上报的事件。
+    """
+
+    def __init__(self, count: int, command: list, on_event=None, ack_timeout: float = 60.0):
+        self.count = count
+        self.command = command
+        self.on_event = on_event
+        self.ack_timeout = ack_timeout
+        self._workers = [_Worker(index) for index in range(count)]
+        self._cond = threading.Condition()
+        self._acks = {}
+        self._failed_batches = set()
+        self._batch_ids = itertools.count(1)
+        self._subscriptions = None
+        self._subscriptions_version = None
+        self._stopping = False
+        self._authkey = secrets.token_bytes(32)
+        self._socket_dir = tempfile.mkdtemp(prefix='rss-bot-shards-')
+        self.address = os.path.join(self._socket_dir, 'coordinator.sock')
+        self._listener = Listener(self.address, family='AF_UNIX', authkey=self._authkey)
+        self._accept_thread = threading.Thread(target=self._accept_loop, name='shard-accept', daemon=True)
+
+    def start(self):
+        self._accept_thread.start()
+        for worker in self._workers:
+            self._spawn(worker)
+        logger.info(f"已启动 {self.count} 个工作进程，用户按 ID 哈希分配到各进程。")
+
+    def _spawn(self, worker: _Worker):
+        env = dict(os.environ, SHARD_INDEX=str(worker.index), SHARD_COUNT=str(self.count),
+                   SHARD_SOCKET=self.address, SHARD_AUTHKEY=self._authkey.hex())
+        worker.process = subprocess.Popen(self.command, env=env)
+        logger.info(f"工作进程 {worker.index} 已启动 (pid {worker.process.pid})。")
+
+    def ensure_running(self):
+        """重新启动已退出的工作进程。"""
+        for worker in self._workers:
+            if self._stopping or worker.process is None or worker.process.poll() is None:
+                continue
+            logger.error(f"工作进程 {worker.index} 已退出 (返回码 {worker.process.returncode})，正在重新启动。")
+            with self._cond:
+                worker.conn = None
+            self._spawn(worker)
+
+    def _accept_loop(self):
+        while not self._stopping:
+            try:
+                conn = self._listener.accept()
+                _, index = conn.recv()
+            except Exception as e:
+                # 包括认证失败 (AuthenticationError) 与监听关闭后的 OSError
+                if not self._stopping:
+                    logger.error(f"接受工作进程连接时出错: {e}")
+                continue
+            worker = self._workers[index]
+            with self._cond:
+                worker.conn = conn
+                worker.subscriptions_version = None
+                self._cond.notify_all()
+            logger.info(f"工作进程 {index} 已连接。")
+            threading.Thread(target=self._read_loop, args=(worker, conn), name=f'shard-reader-{index}',
+                             daemon=True).start()
+
+    def _read_loop(self, worker: _Worker, conn):
+        while True:
+            try:
+                message = conn.recv()
+            except (OSError, EOFError):
+                break
+            if message[0] in ('ack', 'nack'):
+                with self._cond:
+                    if message[0] == 'ack':
+                        self._acks.setdefault(message[1], set()).add(worker.index)
+                    else:
+                        self._failed_batches.add(message[1])
+                    self._cond.notify_all()
+            elif self.on_event:
+                try:
+                    self.on_event(message)
+                except Exception as e:
+                    logger.error(f"处理工作进程 {worker.index} 的事件 {message[0]} 时出错: {e}", exc_info=True)
+        with self._cond:
+            if worker.conn is conn:
+                worker.conn = None
+            self._cond.notify_all()
+        if not self._stopping:
+            logger.warning(f"与工作进程 {worker.index} 的连接已断开。")
+
+    def _send(self, worker: _Worker, message) -> bool:
+        conn = worker.conn
+        if conn is None:
+            return False
+        try:
+            with worker.send_lock:
+                conn.send(message)
+            return True
+        except (OSError, ValueError) as e:
+            logger.error(f"向工作进程 {worker.index} 发送消息失败: {e}")
+            return False
+
+    def update_subscriptions(self, version: int, subscriptions: dict):
+        """记录最新的订阅，并把各分片的部分发给订阅版本落后的工作进程。"""
+        self._subscriptions, self._subscriptions_version = subscriptions, version
+        for worker in self._workers:
+            self._sync_subscriptions(worker)
+
+    def _sync_subscriptions(self, worker: _Worker):
+        if self._subscriptions is None or worker.conn is None:
+            return
+        if worker.subscriptions_version == self._subscriptions_version:
+            return
+        partition = partition_subscriptions(self._subscriptions, worker.index, self.count)
+        if self._send(worker, ('subscriptions', self._subscriptions_version, partition)):
+            worker.subscriptions_version = self._subscriptions_version
+
+    def publish(self, feed_name: str, entries: list) -> bool:
+        """
+        把新帖子发布给所有工作进程，等待它们确认已写入发件箱或摘要缓冲。
+        有工作进程未连接或在 ack_timeout 秒内未确认时返回 False，调用方应稍后重新发布。
+        """
+        deadline = time.monotonic() + self.ack_timeout
+        with self._cond:
+            while not all(worker.conn for worker in self._workers):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stopping:
+                    logger.error("部分工作进程尚未连接，本轮新帖子暂不发布。")
+                    return False
+                self._cond.wait(remaining)
+        batch_id = next(self._batch_ids)
+        for worker in self._workers:
+            self._sync_subscriptions(worker)
+            if not self._send(worker, ('entries', batch_id, feed_name, entries)):
+                return False
+        with self._cond:
+            try:
+                while len(self._acks.get(batch_id, ())) < self.count:
+                    remaining = deadline - time.monotonic()
+                    if (remaining <= 0 or batch_id in self._failed_batches
+                            or not all(worker.conn for worker in self._workers)):
+                        missing = sorted(set(range(self.count)) - self._acks.get(batch_id, set()))
+                        logger.error(f"工作进程 {missing} 未确认 feed {feed_name} 的 {len(entries)} 个新帖子。")
+                        return False
+                    self._cond.wait(min(remaining, 1.0))
+            finally:
+                self._acks.pop(batch_id, None)
+                self._failed_batches.discard(batch_id)
+        return True
+
+    def stop(self, timeout: float = 15.0):
+        """通知所有工作进程在发送完队列后退出，超时后强制结束。"""
+        self._stopping = True
+        for worker in self._workers:
+            self._send(worker, ('stop',))
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            if worker.process is None:
+                continue
+            try:
+                worker.process.wait(max(0.1, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                logger.warning(f"工作进程 {worker.index} 未在 {timeout:.0f} 秒内退出，强制结束。")
+                worker.process.kill()
+        self._listener.close()
+        shutil.rmtree(self._socket_dir, ignore_errors=True)
@@ -0,0 +1,399 @@
+"""
+可选的 SQLite 存储后端 (STORAGE_BACKEND=sqlite)。
+
+提供与 JSON / 文本文件存储相同接口的订阅存储、已处理帖子存储和发件箱，另外记录每个用户
+收到了哪些帖子。数据库使用 WAL 模式，写入按批在单个事务中完成。
+首次启用时会把现有的 user_subscriptions.json 和 sent_posts_*.txt 一次性导入数据库。
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from outbox import Outbox
+from sent_posts_store import post_key
+from sharding import shard_for
+from subscription_store import SubscriptionStore, copy_config
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    chat_id INTEGER,
+    enabled INTEGER NOT NULL DEFAULT 1,
+    keyword_filter_active INTEGER NOT NULL DEFAULT 1,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_users_enabled ON users(enabled);
+CREATE TABLE IF NOT EXISTS keywords (
+    user_id TEXT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    keyword TEXT NOT NULL,
+    PRIMARY KEY (user_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_keywords_keyword ON keywords(keyword COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS seen_posts (
+    feed TEXT NOT NULL,
+    post_key TEXT NOT NULL,
+    seen_at REAL NOT NULL,
+    PRIMARY KEY (feed, post_key)
+);
+CREATE INDEX IF NOT EXISTS idx_seen_posts_seen_at ON seen_posts(feed, seen_at);
+CREATE TABLE IF NOT EXISTS deliveries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    feed TEXT,
+    post_key TEXT,
+    delivered_at REAL NOT NULL,
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_deliveries_user ON deliveries(user_id, delivered_at);
+CREATE INDEX IF NOT EXISTS idx_deliveries_post ON deliveries(post_key);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dedup_key TEXT UNIQUE,
+    user_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox(status, updated_at);
+"""
+
+# users 表中有独立列的字段，其余字段 (如 feeds) 以 JSON 存入 extra 列
+_USER_COLUMNS = ('chat_id', 'enabled', 'keyword_filter_active', 'keywords')
+
+
+class SqliteDatabase:
+    """共享的 SQLite 连接。所有线程通过同一把锁串行访问。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+
+    @contextmanager
+    def transaction(self):
+        """在一个事务中执行多条语句，出错时回滚。"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def query(self, sql: str, params=()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def get_meta(self, key: str):
+        rows = self.query("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def set_meta(self, key: str, value: str):
+        with self.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SqliteSubscriptionStore(SubscriptionStore):
+    """
+    数据保存在 SQLite 中的订阅存储。
+    内存中的读写方式与 JSON 版本相同，写回时只更新内容发生变化的用户。
+    """
+
+    def __init__(self, database: SqliteDatabase, flush_delay: float = 2.0):
+        self.database = database
+        self._persisted = {}
+        super().__init__(database.path, flush_delay=flush_delay)
+
+    def _load(self) -> dict:
+        data = {}
+        for user_id, chat_id, enabled, filter_active, extra in self.database.query(
+                "SELECT user_id, chat_id, enabled, keyword_filter_active, extra FROM users"):
+            config = {"chat_id": chat_id, "keywords": [], "enabled": bool(enabled),
+                      "keyword_filter_active": bool(filter_active)}
+            config.update(json.loads(extra))
+            data[user_id] = config
+        for user_id, keyword in self.database.query(
+                "SELECT user_id, keyword FROM keywords ORDER BY user_id, position"):
+            if user_id in data:
+                data[user_id]["keywords"].append(keyword)
+        self._persisted = {user_id: _serialize(config) for user_id, config in data.items()}
+        return data
+
+    def flush(self):
+        """把内容有变化的用户在一个事务中写入数据库。只检查 mark_changed() 中记录的用户，未记录时检查所有用户。"""
+        with self._write_lock:
+            with self._lock:
+                self._flush_timer = None
+                if not self._dirty:
+                    return
+                candidates = self._changed_users
+                if candidates is None:
+                    candidates = set(self._data) | set(self._persisted)
+                current = {user_id: _serialize(self._data[user_id]) for user_id in candidates if user_id in self._data}
+                changed = {user_id: copy_config(self._data[user_id]) for user_id, serialized in current.items()
+                           if self._persisted.get(user_id) != serialized}
+                removed = [user_id for user_id in candidates if user_id not in self._data and user_id in self._persisted]
+                self._dirty = False
+                self._changed_users = set()
+            try:
+                with self.database.transaction() as conn:
+                    for user_id, config in changed.items():
+                        _write_user(conn, user_id, config)
+                    for user_id in removed:
+                        conn.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+                with self._lock:
+                    for user_id in changed:
+                        self._persisted[user_id] = current[user_id]
+                    for user_id in removed:
+                        self._persisted.pop(user_id, None)
+                logger.info(f"用户订阅信息已保存到数据库 ({len(changed)} 个用户有变化)。")
+            except sqlite3.Error as e:
+                logger.error(f"保存用户订阅到数据库失败 ({self.path}): {e}", exc_info=True)
+                with self._lock:
+                    self._dirty = True
+                    if self._changed_users is not None:
+                        self._changed_users |= candidates
+
+
+def _serialize(config: dict) -> str:
+    return json.dumps(config, sort_keys=True, ensure_ascii=False)
+
+
+def _write_user(conn, user_id: str, config: dict):
+    extra = {key: value for key, value in config.items() if key not in _USER_COLUMNS}
+    conn.execute("INSERT OR REPLACE INTO users (user_id, chat_id, enabled, keyword_filter_active, extra) "
+                 "VALUES (?, ?, ?, ?, ?)",
+                 (user_id, config.get("chat_id"), int(config.get("enabled", True)),
+                  int(config.get("keyword_filter_active", True)), json.dumps(extra, ensure_ascii=False)))
+    conn.execute("DELETE FROM keywords WHERE user_id = ?", (user_id,))
+    conn.executemany("INSERT INTO keywords (user_id, position, keyword) VALUES (?, ?, ?)",
+                     [(user_id, position, keyword) for position, keyword in enumerate(config.get("keywords", []))])
+
+
+class SqliteSentPostStore:
+    """数据保存在 SQLite 中的已处理帖子存储，接口与 SentPostStore 相同。"""
+
+    def __init__(self, database: SqliteDatabase, feed_name: str, max_entries: int = 5000,
+                 max_age_seconds: float = 30 * 86400, key_by_post_id: bool = True):
+        self.database = database
+        self.feed_name = feed_name
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.key_by_post_id = key_by_post_id
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def __contains__(self, link: str) -> bool:
+        key = post_key(link, self.key_by_post_id)
+        with self._lock:
+            if key in self._pending:
+                return True
+        return bool(self.database.query("SELECT 1 FROM seen_posts WHERE feed = ? AND post_key = ?",
+                                        (self.feed_name, key)))
+
+    def __len__(self) -> int:
+        return self.database.query("SELECT COUNT(*) FROM seen_posts WHERE feed = ?", (self.feed_name,))[0][0]
+
+    def add(self, link: str):
+        """记录一个已处理的帖子。写入数据库推迟到 flush()。"""
+        key = post_key(link, self.key_by_post_id)
+        with self._lock:
+            self._pending.setdefault(key, time.time())
+
+    def flush(self):
+        """在一个事务中写入本轮新增的记录，并淘汰超出窗口的旧记录。"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            with self.database.transaction() as conn:
+                conn.executemany("INSERT OR IGNORE INTO seen_posts (feed, post_key, seen_at) VALUES (?, ?, ?)",
+                                 [(self.feed_name, key, seen_at) for key, seen_at in pending.items()])
+                conn.execute("DELETE FROM seen_posts WHERE feed = ? AND seen_at < ?",
+                             (self.feed_name, time.time() - self.max_age_seconds))
+                conn.execute("DELETE FROM seen_posts WHERE feed = ? AND post_key NOT IN "
+                             "(SELECT post_key FROM seen_posts WHERE feed = ? ORDER BY seen_at DESC LIMIT ?)",
+                             (self.feed_name, self.feed_name, self.max_entries))
+        except sqlite3.Error as e:
+            logger.error(f"保存已处理帖子记录到数据库失败 (feed {self.feed_name}): {e}", exc_info=True)
+            with self._lock:
+                pending.update(self._pending)
+                self._pending = pending
+
+
+class DeliveryLog:
+    """记录每个用户收到的帖子。记录先在内存中缓冲，每轮检查结束时批量写入。"""
+
+    def __init__(self, database: SqliteDatabase):
+        self.database = database
+        self._lock = threading.Lock()
+        self._pending = []
+
+    def record(self, user_id_str: str, feed_name: str, post_key_value: str, status: str = 'sent'):
+        with self._lock:
+            self._pending.append((user_id_str, feed_name, post_key_value, time.time(), status))
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        try:
+            with self.database.transaction() as conn:
+                conn.executemany("INSERT INTO deliveries (user_id, feed, post_key, delivered_at, status) "
+                                 "VALUES (?, ?, ?, ?, ?)", pending)
+        except sqlite3.Error as e:
+            logger.error(f"保存推送记录到数据库失败: {e}", exc_info=True)
+
+    def recent_for_user(self, user_id_str: str, limit: int = 10) -> list:
+        """返回用户最近收到的推送记录 [(feed, post_key, delivered_at, status), ...]。"""
+        return self.database.query("SELECT feed, post_key, delivered_at, status FROM deliveries "
+                                   "WHERE user_id = ? ORDER BY delivered_at DESC LIMIT ?", (user_id_str, limit))
+
+
+class SqliteOutbox(Outbox):
+    """
+    数据保存在 SQLite 中的发件箱，接口与 Outbox 相同。
+    去重依赖 dedup_key 列的唯一约束，已完成的记录保留 retention_seconds 后删除。
+    多个工作进程共用同一张表，shard 为 (分片编号, 分片数) 时只重新投递属于本分片用户的推送；
+    广播只由主进程发送和统计，工作进程不重新投递。
+    """
+
+    def __init__(self, database: SqliteDatabase, retention_seconds: float = 7 * 86400, shard: tuple = None):
+        self.database = database
+        self.shard = shard
+        super().__init__(database.path, retention_seconds)
+
+    def _owns(self, user_id_str: str, payload: str) -> bool:
+        if self.shard is None:
+            return True
+        return (shard_for(user_id_str, self.shard[1]) == self.shard[0]
+                and json.loads(payload).get('broadcast_id') is None)
+
+    def _load(self):
+        count = self.pending_count()
+        if count:
+            logger.info(f"发件箱中有 {count} 条未完成的消息，将在启动后重新投递。")
+
+    def pending_count(self) -> int:
+        if self.shard is None:
+            return self.database.query("SELECT COUNT(*) FROM outbox WHERE status = 'pending'")[0][0]
+        return sum(1 for user_id, payload in self.database.query(
+                       "SELECT user_id, payload FROM outbox WHERE status = 'pending'")
+                   if self._owns(user_id, payload))
+
+    def pending_jobs(self) -> list:
+        from delivery import DeliveryJob
+        jobs = []
+        for outbox_id, user_id, payload, attempts, next_attempt_at in self.database.query(
+                "SELECT id, user_id, payload, attempts, next_attempt_at FROM outbox "
+                "WHERE status = 'pending' ORDER BY id"):
+            if not self._owns(user_id, payload):
+                continue
+            job = DeliveryJob.from_dict(json.loads(payload))
+            job.outbox_id = outbox_id
+            job.attempts = attempts
+            job.next_attempt_at = next_attempt_at
+            jobs.append(job)
+        return jobs
+
+    def close(self):
+        pass
+
+    def _insert(self, candidates: list) -> list:
+        now = time.time()
+        accepted = []
+        with self.database.transaction() as conn:
+            for key, job in candidates:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO outbox (dedup_key, user_id, payload, status, attempts, next_attempt_at, "
+                    "created_at, updated_at) VALUES (?, ?, ?, 'pending', 0, ?, ?, ?)",
+                    (key, job.user_id_str, json.dumps(job.to_dict(), ensure_ascii=False), now, now, now))
+                if cursor.rowcount:
+                    job.outbox_id = cursor.lastrowid
+                    job.next_attempt_at = now
+                    accepted.append(job)
+            conn.execute("DELETE FROM outbox WHERE status != 'pending' AND updated_at < ?",
+                         (now - self.retention_seconds,))
+        return accepted
+
+    def _record_finished(self, job, status: str):
+        with self.database.transaction() as conn:
+            conn.execute("UPDATE outbox SET status = ?, updated_at = ? WHERE id = ? AND status = 'pending'",
+                         (status, time.time(), job.outbox_id))
+
+    def _record_retry(self, job):
+        with self.database.transaction() as conn:
+            conn.execute("UPDATE outbox SET attempts = ?, next_attempt_at = ?, payload = ?, updated_at = ? "
+                         "WHERE id = ? AND status = 'pending'",
+                         (job.attempts, job.next_attempt_at, json.dumps(job.to_dict(), ensure_ascii=False),
+                          time.time(), job.outbox_id))
+
+
+def migrate_from_files(database: SqliteDatabase, subscriptions_file: str, sent_posts_files: dict,
+                       key_by_post_id: bool = True):
+    """
+    把 JSON / 文本文件中的数据一次性导入数据库。
+    sent_posts_files 为 {feed 名称: 记录文件路径}。导入完成后在 meta 表中记录，之后不再重复导入。
+    """
+    if database.get_meta('migrated_from_files'):
+        return
+    imported_users = 0
+    imported_posts = 0
+    with database.transaction() as conn:
+        if os.path.exists(subscriptions_file):
+            try:
+                with open(subscriptions_file, 'r', encoding='utf-8') as f:
+                    subscriptions = json.load(f)
+            except (json.JSONDecodeError, IOError) as e:
+                raise RuntimeError(f"无法读取 {subscriptions_file} 以导入数据库: {e}") from e
+            for user_id, config in subscriptions.items():
+                _write_user(conn, user_id, config)
+                imported_users += 1
+        for feed_name, path in sent_posts_files.items():
+            if not os.path.exists(path):
+                continue
+            now = time.time()
+            rows = []
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    key, _, timestamp = line.strip().partition('\t')
+                    if not key:
+                        continue
+                    try:
+                        seen_at = float(timestamp) if timestamp else now
+                    except ValueError:
+                        seen_at = now
+                    rows.append((feed_name, post_key(key, key_by_post_id), seen_at))
+            conn.executemany("INSERT OR IGNORE INTO seen_posts (feed, post_key, seen_at) VALUES (?, ?, ?)", rows)
+            imported_posts += len(rows)
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from_files', ?)",
+                     (str(int(time.time())),))
+    logger.info(f"已从文件导入 {imported_users} 个用户和 {imported_posts} 条已处理帖子记录到数据库 {database.path}。")
@@ -0,0 +1,120 @@
+"""
+常驻内存的用户订阅存储。
+
+订阅数据在启动时从 JSON 文件加载一次，之后所有读写都在内存中进行并由锁保护
+（命令处理线程、JobQueue 线程和投递线程会同时访问）。修改后的数据在短暂延迟后
+批量写回磁盘，写入时先写临时文件再原子替换，避免进程中途退出导致文件损坏。
+"""
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+from file_utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriptionStore:
+    """用户订阅的内存存储，带延迟批量写回。"""
+
+    def __init__(self, path: str, flush_delay: float = 2.0):
+        self.path = path
+        self.flush_delay = flush_delay
+        # 每次修改后递增，供关键词匹配器等缓存判断是否需要重建
+        self.version = 0
+
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._data = self._load()
+        self._dirty = False
+        # 自上次写回以来修改过的用户，None 表示未知 (需要检查所有用户)
+        self._changed_users = set()
+        self._flush_timer = None
+        self._snapshot = None
+        self._snapshot_version = -1
+
+    def _load(self) -> dict:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            logger.error(f"加载用户订阅失败 ({self.path}): {e}。将返回空配置。", exc_info=True)
+            return {}
+
+    @contextmanager
+    def edit(self):
+        """
+        持有锁并返回可直接修改的订阅字典。
+        修改后需在锁内调用 mark_changed(user_id_str) 以安排写回磁盘。
+        """
+        with self._lock:
+            yield self._data
+
+    def mark_changed(self, user_id_str: str = None):
+        """标记订阅已修改，并在 flush_delay 秒后写回磁盘。user_id_str 为被修改的用户，不指定时视为所有用户都可能被修改。"""
+        with self._lock:
+            self.version += 1
+            self._dirty = True
+            if user_id_str is None:
+                self._changed_users = None
+            elif self._changed_users is not None:
+                self._changed_users.add(user_id_str)
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.flush_delay, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def get_user(self, user_id_str: str):
+        """返回指定用户配置的副本，用户不存在时返回 None。"""
+        with self._lock:
+            config = self._data.get(user_id_str)
+            return copy_config(config) if config is not None else None
+
+    def snapshot(self):
+        """
+        返回 (版本号, 订阅字典的只读快照)。
+        快照只在数据变化后重建一次，RSS 检查等热路径可以直接使用而无需持锁。
+        """
+        with self._lock:
+            if self._snapshot_version != self.version:
+                self._snapshot = {uid: copy_config(config) for uid, config in self._data.items()}
+                self._snapshot_version = self.version
+            return self._snapshot_version, self._snapshot
+
+    def flush(self):
+        """若有未保存的修改，立即原子地写回磁盘。"""
+        with self._write_lock:
+            with self._lock:
+                self._flush_timer = None
+                if not self._dirty:
+                    return
+                content = json.dumps(self._data, indent=4, ensure_ascii=False) # ensure_ascii=False 保证中文正确显示
+                self._dirty = False
+                self._changed_users = set()
+            try:
+                atomic_write(self.path, content)
+                logger.info(f"用户订阅信息已保存到 {self.path}")
+            except OSError as e:
+                logger.error(f"保存用户订阅失败 ({self.path}): {e}", exc_info=True)
+                with self._lock:
+                    self._dirty = True
+
+    def close(self):
+        """停止延迟写回并立即保存所有修改。"""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+        self.flush()
+
+
+def copy_config(config: dict) -> dict:
+    """复制用户配置，其中的列表 (关键词、feed 等) 也一并复制，避免快照被后续修改影响。"""
+    return {key: list(value) if isinstance(value, list) else value for key, value in config.items()}
+
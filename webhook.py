@@ -0,0 +1,66 @@
+"""
+Webhook 模式 (替代长轮询)。
+
+设置 WEBHOOK_URL 后，机器人通过 updater.start_webhook 在本地启动 HTTP 服务接收 Telegram 推送的更新，
+适合部署在反向代理 (负责 TLS) 之后。同一服务上提供健康检查路由，供反向代理或容器编排探测。
+"""
+import hashlib
+import json
+import logging
+from urllib.parse import urlsplit
+
+import tornado.web
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEALTH_PATH = '/healthz'
+
+
+def default_url_path(token: str) -> str:
+    """未配置路径时，用 token 的哈希生成一个难以猜测且重启后不变的路径 (不直接暴露 token)。"""
+    return 'telegram/' + hashlib.sha256(token.encode('utf-8')).hexdigest()[:32]
+
+
+def join_webhook_url(base_url: str, url_path: str) -> str:
+    return base_url.rstrip('/') + '/' + url_path.lstrip('/')
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    """返回 health_check() 的结果。健康时为 200，否则为 503。"""
+
+    def initialize(self, health_check):
+        self.health_check = health_check
+
+    def get(self):
+        healthy, details = self.health_check()
+        self.set_status(200 if healthy else 503)
+        self.set_header('Content-Type', 'application/json; charset=utf-8')
+        self.finish(json.dumps(dict(details, status='ok' if healthy else 'unhealthy'), ensure_ascii=False))
+
+
+def start_webhook(updater, listen: str, port: int, url_path: str, webhook_url: str, health_check=None,
+                  health_path: str = DEFAULT_HEALTH_PATH, max_connections: int = 40):
+    """
+    以 webhook 模式启动 updater，并向 Telegram 注册 webhook_url (对外地址，包含 url_path)。
+    health_check() 返回 (是否健康, 详情 dict)，提供时在 health_path 上注册健康检查路由。
+    """
+    # bootstrap_retries=-1: 注册 webhook 失败时 (例如启动时网络尚未就绪) 持续重试，而不是静默放弃
+    updater.start_webhook(listen=listen, port=port, url_path=url_path, webhook_url=webhook_url,
+                          max_connections=max_connections, bootstrap_retries=-1)
+    # 路径相当于密钥，不写入日志
+    public = urlsplit(webhook_url)
+    logger.info(f"Webhook 服务已在 {listen}:{port} 启动，Telegram 将把更新推送到 {public.scheme}://{public.netloc}/...")
+    if health_check:
+        _add_health_route(updater, health_path, health_check)
+
+
+def _add_health_route(updater, health_path: str, health_check):
+    # python-telegram-bot v13 没有提供为 webhook 服务添加路由的接口，
+    # 这里把处理器加到其内部的 tornado Application 上 (需在服务自己的 IOLoop 中执行)
+    httpd = getattr(updater, 'httpd', None)
+    app = getattr(getattr(httpd, 'http_server', None), 'request_callback', None)
+    if not isinstance(app, tornado.web.Application) or httpd.loop is None:
+        logger.warning("无法在 webhook 服务上注册健康检查路由，请改用 METRICS_PORT 上的 /healthz。")
+        return
+    httpd.loop.add_callback(app.add_handlers, r'.*', [(health_path, HealthHandler, {'health_check': health_check})])
+    logger.info(f"健康检查路由: http://{httpd.listen}:{httpd.port}{health_path}")